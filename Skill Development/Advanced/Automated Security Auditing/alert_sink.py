@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import boto3
+
+# SNS PublishBatch takes at most 10 entries, and at most 256 KB of payload across all of them together
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# Room left in each batch for the request's own JSON around every entry
+ENTRY_OVERHEAD_BYTES = 64
+MAX_MESSAGE_BYTES = MAX_BATCH_BYTES - ENTRY_OVERHEAD_BYTES
+
+class S3FingerprintStore:
+    """Fingerprints of findings alerted on in the previous run, kept as one JSON object in S3"""
+
+    def __init__(self, bucket, key):
+        self.s3_client = boto3.client('s3')
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        try:
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return set()
+        return set(json.loads(body))
+
+    def save(self, fingerprints):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(sorted(fingerprints)))
+
+class FileFingerprintStore:
+    """Local stand-in for the S3 store; /tmp survives between warm invocations only"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as f:
+            return set(json.load(f))
+
+    def save(self, fingerprints):
+        with open(self.path, 'w') as f:
+            json.dump(sorted(fingerprints), f)
+
+def fingerprint_store_from_env():
+    """S3 store when FINGERPRINT_BUCKET is set, otherwise the local file stand-in"""
+    bucket = os.environ.get('FINGERPRINT_BUCKET')
+    if bucket:
+        return S3FingerprintStore(bucket, os.environ.get('FINGERPRINT_KEY', 'sg-audit/fingerprints.json'))
+    return FileFingerprintStore(os.environ.get('FINGERPRINT_FILE', '/tmp/sg-audit-fingerprints.json'))
+
+def fingerprint(group_id, rule, cidr):
+    """Stable identity of one open inbound rule, independent of rule order and descriptions"""
+    identity = f"{group_id}|{rule.get('IpProtocol')}|{rule.get('FromPort')}|{rule.get('ToPort')}|{cidr}"
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+
+class AlertSink:
+    """Buffer audit findings, drop the ones already alerted on, and publish the rest in few SNS calls
+
+    mode='batch' sends one message per finding through PublishBatch (10 per call);
+    mode='digest' sends one message per security group.
+    """
+
+    def __init__(self, sns_client, topic_arn, store, mode='batch'):
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.store = store
+        self.mode = mode
+        self.previous = store.load()
+        self.current = set()
+        self.findings = {}
+        self.publish_calls = 0
+
+    def add(self, group_id, group_name, rule, cidr, message):
+        """Record a finding; it is only sent if it was not already alerted on in the previous run"""
+        key = fingerprint(group_id, rule, cidr)
+        if key in self.current:
+            return
+        self.current.add(key)
+        if key not in self.previous:
+            self.findings.setdefault((group_id, group_name), []).append((key, message))
+
+    def messages(self):
+        """Yield (subject, message, fingerprints) for every SNS message to send"""
+        if self.mode == 'digest':
+            for (group_id, group_name), findings in self.findings.items():
+                subject = f"{len(findings)} open inbound rules in {group_id}"[:100]
+                body = truncate("\n\n".join(message for _, message in findings), len(subject.encode('utf-8')))
+                yield subject, body, [key for key, _ in findings]
+        else:
+            for findings in self.findings.values():
+                for key, message in findings:
+                    yield None, truncate(message), [key]
+
+    def flush(self):
+        """Publish buffered findings, persist this run's fingerprints and return a summary"""
+        entries = list(self.messages())
+        # Every new finding counts as unsent until its batch is accepted
+        unsent = {key for _, _, keys in entries for key in keys}
+        try:
+            for chunk in batches(entries):
+                batch = [
+                    {'Id': str(number), 'Message': message, **({'Subject': subject} if subject else {})}
+                    for number, (subject, message, _) in enumerate(chunk)
+                ]
+                response = self.sns_client.publish_batch(TopicArn=self.topic_arn, PublishBatchRequestEntries=batch)
+                self.publish_calls += 1
+                failed_ids = set()
+                for failed in response.get('Failed', []):
+                    print(f"Failed to publish alert {failed['Id']}: {failed.get('Message')}.")
+                    failed_ids.add(int(failed['Id']))
+                for number, (_, _, keys) in enumerate(chunk):
+                    if number not in failed_ids:
+                        unsent.difference_update(keys)
+        finally:
+            # Saved even when a call raises, so what earlier batches sent is not sent again next run.
+            # Only fingerprints still present are kept, so a rule that is closed and reopened alerts again;
+            # findings whose alert failed or was never sent are left out so the next run retries them
+            self.store.save(self.current - unsent)
+        new_findings = sum(len(findings) for findings in self.findings.values())
+        self.findings = {}
+        return {
+            'findings': len(self.current),
+            'new_findings': new_findings,
+            'suppressed': len(self.current) - new_findings,
+            'messages': len(entries),
+            'failed': len(unsent),
+            'publish_calls': self.publish_calls
+        }
+
+def entry_bytes(entry):
+    subject, message, _ = entry
+    return len(message.encode('utf-8')) + len((subject or '').encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+
+def batches(entries):
+    """Group entries into PublishBatch calls of at most 10 entries and MAX_BATCH_BYTES in total"""
+    chunk, size = [], 0
+    for entry in entries:
+        entry_size = entry_bytes(entry)
+        if chunk and (size + entry_size > MAX_BATCH_BYTES or len(chunk) == MAX_BATCH_ENTRIES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += entry_size
+    if chunk:
+        yield chunk
+
+def truncate(message, reserved=0):
+    """Cut a message so that, with reserved bytes of subject, it fits a PublishBatch call on its own"""
+    limit = MAX_MESSAGE_BYTES - reserved
+    encoded = message.encode('utf-8')
+    if len(encoded) <= limit:
+        return message
+    return encoded[:limit - 20].decode('utf-8', 'ignore') + "\n\n[truncated]"
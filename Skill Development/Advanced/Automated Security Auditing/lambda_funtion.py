@@ -1,4 +1,6 @@
+import os
 import boto3
+from alert_sink import AlertSink, fingerprint_store_from_env
 
 def lambda_handler(event, context):
     ec2 = boto3.resource('ec2')
@@ -7,6 +9,10 @@ def lambda_handler(event, context):
     sns_client = boto3.client('sns')
     sns_topic_arn = 'arn:aws:sns:us-east-1:407119665821:DCTSecurityGroupAuditAlerts'
     
+    # Findings are buffered, deduplicated against the previous run, and published in batches
+    alert_sink = AlertSink(sns_client, sns_topic_arn, fingerprint_store_from_env(),
+                           mode=os.environ.get('ALERT_MODE', 'batch'))
+    
     security_groups = ec2.security_groups.all()
     
     for sg in security_groups:
@@ -21,9 +27,14 @@ def lambda_handler(event, context):
                               f" allows traffic from any IP address: \n\n{rule}.")
                     
                     print(message)
-                    sns_client.publish(TopicArn=sns_topic_arn, Message=message)
+                    alert_sink.add(sg.id, sg.group_name, rule, ip_range['CidrIp'], message)
+    
+    summary = alert_sink.flush()
+    print(f"Alerted on {summary['new_findings']} new findings ({summary['suppressed']} already alerted)"
+          f" with {summary['publish_calls']} SNS calls.")
     
     return {
         'statusCode': 200,
-        'body': 'Security audit complete.'
+        'body': 'Security audit complete.',
+        'summary': summary
     }
\ No newline at end of file
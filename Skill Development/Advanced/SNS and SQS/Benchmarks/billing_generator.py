@@ -0,0 +1,104 @@
+import argparse
+import csv
+import random
+import sys
+from collections import deque
+from datetime import date, timedelta
+
+HEADER = ('id', 'company_name', 'country', 'city', 'product_line',
+          'item', 'bill_date', 'currency', 'bill_amount')
+
+# Customers in the shape of the sample files: each country bills in its own currency
+LOCATIONS = {
+    'US': ('USD', ('Austin', 'Dallas', 'Houston', 'San Antonio', 'El Paso')),
+    'CA': ('CAD', ('Toronto', 'Montreal', 'Vancouver', 'Calgary')),
+    'MX': ('MXN', ('Monterrey', 'Mexico City', 'Guadalajara', 'Tijuana')),
+}
+CATALOG = {
+    'Bakery': (('Lone Star Bakery', 'Big D Doughnuts', 'Bayou Bagels'),
+               ('Texas Pecan Pie', 'Sourdough Donuts', 'Everything Bagels', 'Kolaches')),
+    'Meat': (('The Beef Baron', 'Longhorn Delicacies', 'Bison Bites'),
+             ('Wagyu Beef', 'USDA Prime Ribeye', 'Bison Burgers', 'Smoked Brisket')),
+    'Dairy': (('Lone Star Lactose', 'Bluebonnet Butter', 'Houston Creamery'),
+              ('Artisan Cheese', 'Grass-Fed Butter', 'Gourmet Yogurt', 'Whole Milk')),
+}
+
+def repeat_recent(row, rng, recent):
+    """Give the row the id and bill date of one of the recent valid rows"""
+    if recent:
+        earlier = rng.choice(recent)
+        row[0], row[6] = earlier[0], earlier[6]
+
+# One corruption per reason code in billing_rules, applied to an otherwise valid row; `recent` holds the
+# previous thousand valid rows
+ERROR_KINDS = {
+    'product_line': lambda row, rng, recent: row.__setitem__(4, rng.choice(('Produce', 'Seafood', 'bakery'))),
+    'currency': lambda row, rng, recent: row.__setitem__(7, rng.choice(('EUR', 'GBP', 'usd'))),
+    'bill_amount': lambda row, rng, recent: row.__setitem__(8, rng.choice(('N/A', '', '12,50'))),
+    'negative_amount': lambda row, rng, recent: row.__setitem__(8, f'-{row[8]}'),
+    'bill_date': lambda row, rng, recent: row.__setitem__(6, row[6].replace('-', '/')),
+    'malformed_row': lambda row, rng, recent: row.__delitem__(slice(rng.randint(1, 7), None)),
+    # Repeats the id and bill date of a previous row; only caught when the duplicate id index is enabled
+    'duplicate_id': repeat_recent,
+}
+
+# Corruptions every validator rejects without extra configuration
+DEFAULT_ERROR_KINDS = tuple(kind for kind in ERROR_KINDS if kind != 'duplicate_id')
+
+def generate_rows(rows, error_rate=0.0, seed=0, error_kinds=DEFAULT_ERROR_KINDS, start=date(2023, 5, 1), days=31,
+                  first_id=1):
+    """Yield `rows` billing rows; each is corrupted with probability `error_rate` by one of `error_kinds`
+
+    The output is deterministic for a given seed, so before/after benchmark runs see identical files.
+    Like the exporters, every file's ids start at 1 by default; bill dates fall in the `days` days from `start`.
+    """
+    rng = random.Random(seed)
+    customers = [(company, country, city, product_line, item, currency)
+                 for country, (currency, cities) in LOCATIONS.items()
+                 for product_line, (companies, items) in CATALOG.items()
+                 for company in companies for city in cities for item in items]
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    corruptions = [ERROR_KINDS[kind] for kind in error_kinds]
+    choice, random_float = rng.choice, rng.random
+    recent = deque(maxlen=1000)
+    for record_id in range(first_id, first_id + rows):
+        company, country, city, product_line, item, currency = choice(customers)
+        row = [record_id, company, country, city, product_line, item, choice(dates), currency,
+               f'{random_float() * 9990 + 10:.2f}']
+        if error_rate and random_float() < error_rate:
+            choice(corruptions)(row, rng, recent)
+        else:
+            recent.append(row)
+        yield row
+
+def write_csv(file, rows, error_rate=0.0, seed=0, error_kinds=DEFAULT_ERROR_KINDS, first_id=1, start=date(2023, 5, 1),
+              days=31):
+    """Write a header plus `rows` generated rows to a text file opened with newline=''"""
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(HEADER)
+    writer.writerows(generate_rows(rows, error_rate, seed, error_kinds, start=start, days=days, first_id=first_id))
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic billing CSV for the billing parsers')
+    parser.add_argument('output', help="destination file, or '-' for stdout")
+    parser.add_argument('--rows', type=int, default=1000, help='data rows to generate (1K to 10M)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability that a row is corrupted')
+    parser.add_argument('--errors', default=','.join(DEFAULT_ERROR_KINDS),
+                        help='comma-separated reason codes to inject')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--first-id', type=int, default=1, help='id of the first row')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2023, 5, 1),
+                        help='first bill date (YYYY-MM-DD); dates span the 31 days from it')
+    args = parser.parse_args()
+    error_kinds = tuple(args.errors.split(','))
+    unknown = set(error_kinds) - ERROR_KINDS.keys()
+    if unknown:
+        parser.error(f"unknown error kinds: {', '.join(sorted(unknown))}")
+    if args.output == '-':
+        write_csv(sys.stdout, args.rows, args.error_rate, args.seed, error_kinds, args.first_id, args.start)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as file:
+            write_csv(file, args.rows, args.error_rate, args.seed, error_kinds, args.first_id, args.start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date
+import boto3
+from moto import mock_aws
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+PROJECT = os.path.join(BENCHMARKS, '..')
+LAB = os.path.join(PROJECT, '..', '..', 'Lambda', 'Learning Labs', 'Automating S3 Real-time Data Validation.py')
+
+# Make the shared layer importable the same way /opt/python is inside Lambda
+sys.path.insert(0, os.path.join(PROJECT, 'Billing Shared Layer', 'python'))
+from billing_generator import write_csv
+
+ROWS = int(os.environ.get('ROWS', '100000'))
+FILES = int(os.environ.get('FILES', '4'))
+ERROR_RATE = float(os.environ.get('ERROR_RATE', '0'))
+# DUPLICATES=1 turns on the parsers' duplicate id index (the lab has none)
+DUPLICATES = os.environ.get('DUPLICATES', '0') == '1'
+REGION = 'us-west-2'
+SOURCE_BUCKET = 'winterday-billing'
+ID_TABLE = 'billing-ids'
+FILTER_BUCKET = 'winterday-billing-ids'
+BUCKETS = (SOURCE_BUCKET, 'Processed', 'billing-errors', 'winter-errors', FILTER_BUCKET)
+
+def s3_event(keys):
+    """One S3 notification carrying every uploaded object"""
+    return {'Records': [{'s3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key}}} for key in keys]}
+
+def retry_event(keys):
+    """One SQS batch of the failure messages the Billing Bucket Parser publishes"""
+    return {'Records': [{
+        'messageId': f'benchmark-{number}',
+        'body': f"Lambda function failed to reach international taxes API for '{SOURCE_BUCKET}' bucket and file '{key}'."
+    } for number, key in enumerate(keys)]}
+
+PIPELINES = (
+    ('Billing Bucket Parser', os.path.join(PROJECT, 'Billing Bucket Parser', 'lambda_function.py'), s3_event),
+    ('Retry Billing Parser', os.path.join(PROJECT, 'Retry Billing Parser', 'lambda_function.py'), retry_event),
+    ('Real-time Validation lab', LAB, s3_event),
+)
+
+def run_pipeline(conn, path, make_event, files):
+    """Child process: replay one event through a handler against a fresh moto S3 and report its cost"""
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    with mock_aws():
+        s3 = boto3.client('s3')
+        for bucket in BUCKETS:
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+        for file in files:
+            s3.upload_file(file, SOURCE_BUCKET, os.path.basename(file))
+        if DUPLICATES:
+            boto3.client('dynamodb').create_table(
+                TableName=ID_TABLE, BillingMode='PAY_PER_REQUEST',
+                AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ('id', 'bill_date')],
+                KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}, {'AttributeName': 'bill_date', 'KeyType': 'RANGE'}]
+            )
+            os.environ.update(DUPLICATE_ID_TABLE=ID_TABLE, DUPLICATE_FILTER_BUCKET=FILTER_BUCKET)
+        # Clients copy the session's event hooks when created, so this counts every call the handler makes
+        calls = Counter()
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('before-call.s3', lambda model, **kwargs: calls.update([model.name]))
+        spec = importlib.util.spec_from_file_location('handler', path)
+        handler = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(handler)
+        event = make_event([os.path.basename(file) for file in files])
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            handler.lambda_handler(event, None)
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux
+    conn.send((elapsed, rss_after / 1024, (rss_after - rss_before) / 1024, dict(calls)))
+    conn.close()
+
+def main():
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for number in range(FILES):
+            file = os.path.join(directory, f'billing_data_synthetic_{number}.csv')
+            with open(file, 'w', newline='', encoding='utf-8') as output:
+                # Like the sample exports, each file covers its own month and its ids start again at 1
+                month = 4 + number
+                write_csv(output, ROWS, ERROR_RATE, seed=number, start=date(2023 + month // 12, month % 12 + 1, 1),
+                          days=28)
+            files.append(file)
+        size_mb = sum(os.path.getsize(file) for file in files) / 1024 / 1024
+        print(f"{FILES} files x {ROWS:,} rows ({size_mb:.0f} MB), error rate {ERROR_RATE}"
+              f"{', duplicate ids checked' if DUPLICATES else ''}")
+        print(f"  {'pipeline':<26}{'time':>8}{'rows/sec':>14}{'peak RSS':>11}{'growth':>10}  S3 calls")
+        for name, path, make_event in PIPELINES:
+            # Each handler runs in its own process so module state and peak RSS don't leak between runs
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=run_pipeline, args=(child_conn, path, make_event, files))
+            process.start()
+            child_conn.close()
+            elapsed, peak_mb, growth_mb, calls = parent_conn.recv()
+            process.join()
+            # Rows per second counts every generated row, even those after the first error in first_error mode
+            call_summary = ', '.join(f'{operation}={count}' for operation, count in sorted(calls.items()))
+            print(f"  {name:<26}{elapsed:7.2f}s{FILES * ROWS / elapsed:14,.0f}{peak_mb:8.0f} MB"
+                  f"{growth_mb:7.0f} MB  {sum(calls.values())} ({call_summary})")
+
+if __name__ == '__main__':
+    main()
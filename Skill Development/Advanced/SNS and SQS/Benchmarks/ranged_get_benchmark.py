@@ -0,0 +1,97 @@
+import csv
+import io
+import logging
+import os
+import sys
+import time
+import boto3
+from moto.server import ThreadedMotoServer
+
+# Make the shared layer importable the same way /opt/python is inside Lambda
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Billing Shared Layer', 'python'))
+from billing_ranges import validate_object_ranges
+from billing_rules import compile_plan
+
+# The workers run in processes forked from a fork server, which moto's in-process mock does not reach, so
+# moto runs as a local server (pip install 'moto[server]') and every process is pointed at it
+MOTO_PORT = int(os.environ.get('MOTO_PORT', '5123'))
+TARGET_MB = int(os.environ.get('TARGET_MB', '64'))
+CHUNK_MB = int(os.environ.get('CHUNK_MB', '4'))
+WORKER_COUNTS = (1, 2, 4)
+# Small ranges for the boundary check, so bad rows can be placed across range edges
+BOUNDARY_CHUNK_BYTES = 4096
+
+def make_csv(target_bytes):
+    """Clean billing CSV of roughly target_bytes"""
+    header = b'id,company_name,country,city,product_line,item,bill_date,currency,bill_amount\n'
+    block = b''.join(
+        f'{i},Lone Star Lactose,US,Austin,Dairy,Artisan Cheese,2023-05-{i % 28 + 1:02d},USD,{i % 5000}.00\n'.encode()
+        for i in range(10_000)
+    )
+    return header + block * max(1, target_bytes // len(block))
+
+def boundary_check(s3, plan):
+    """Put one bad row across a range boundary, right after one and inside a range, and check that both modes
+    report what find_errors does on the whole stream; return the number of mismatches"""
+    header = b'id,company_name,country,city,product_line,item,bill_date,currency,bill_amount\n'
+    lines = [f'{i},Lone Star Lactose,US,Austin,Dairy,Artisan Cheese,2023-05-{i % 28 + 1:02d},USD,{i}.00\n'.encode()
+             for i in range(1, 1001)]
+    ends, offset = [], len(header)
+    for line in lines:
+        offset += len(line)
+        ends.append(offset)
+    # Rows whose bytes straddle a boundary, the row starting right after one, and a row well inside a range
+    straddling = [n for n in range(1, len(lines))
+                  if (ends[n] - len(lines[n])) // BOUNDARY_CHUNK_BYTES != (ends[n] - 1) // BOUNDARY_CHUNK_BYTES]
+    cases = straddling[:3] + [straddling[0] + 1, 500]
+    mismatches = 0
+    for bad in cases:
+        data = header + b''.join(line.replace(b',USD,', b',EUR,') if n in (bad, bad + 40) else line
+                                 for n, line in enumerate(lines))
+        s3.put_object(Bucket='winterday-billing', Key='boundary.csv', Body=data)
+        for collect_all in (False, True):
+            rows = csv.reader(io.StringIO(data.decode('utf-8')))
+            next(rows)
+            expected = plan.find_errors(rows, collect_all)
+            actual = validate_object_ranges(plan, 'winterday-billing', 'boundary.csv', len(data), 2,
+                                            collect_all=collect_all, chunk_size=BOUNDARY_CHUNK_BYTES)
+            if actual != expected:
+                mismatches += 1
+                print(f"  MISMATCH for bad row {bad + 1} (collect_all={collect_all}): {actual} != {expected}")
+    print(f"  boundary check: {len(cases)} placements of a bad row, {mismatches} mismatches with find_errors")
+    return mismatches
+
+def main():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    # Set before the first ranged validation starts the fork server, which passes its environment to the workers
+    os.environ.update(AWS_ENDPOINT_URL_S3=f'http://127.0.0.1:{MOTO_PORT}', AWS_ACCESS_KEY_ID='testing',
+                      AWS_SECRET_ACCESS_KEY='testing')
+    plan = compile_plan()
+    # One access-log line per ranged GET would bury the results
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=MOTO_PORT, verbose=False)
+    server.start()
+    try:
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='winterday-billing', CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        data = make_csv(TARGET_MB * 1024 * 1024)
+        s3.put_object(Bucket='winterday-billing', Key='big.csv', Body=data)
+        print(f"{len(data) / 1024 / 1024:.0f} MB object, {CHUNK_MB} MB ranges, {os.cpu_count()} CPUs")
+        baseline = None
+        for workers in WORKER_COUNTS:
+            started = time.perf_counter()
+            row_count, errors = validate_object_ranges(
+                plan, 'winterday-billing', 'big.csv', len(data), workers, chunk_size=CHUNK_MB * 1024 * 1024
+            )
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            print(f"  {workers} worker(s): {elapsed:6.2f}s to verdict, {row_count / elapsed:12,.0f} rows/sec, "
+                  f"{baseline / elapsed:.1f}x, errors={len(errors)}")
+        failed = boundary_check(s3, plan)
+    finally:
+        server.stop()
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
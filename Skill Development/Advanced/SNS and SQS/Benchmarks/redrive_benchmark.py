@@ -0,0 +1,64 @@
+import json
+import os
+import random
+import sys
+import boto3
+from moto import mock_aws
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'Tools'))
+from redrive_dlq import Redrive, source_queue
+
+# Moto scans the whole queue on every call, so keep the defaults small; the point is correctness and rate limiting
+MESSAGES = int(os.environ.get('MESSAGES', '500'))
+FILES = int(os.environ.get('FILES', '200'))
+UNPARSEABLE = int(os.environ.get('UNPARSEABLE', '10'))
+REGION = 'us-west-2'
+
+def failure_message(key):
+    """A retry message as it reaches the queue: the Billing Bucket Parser's alert inside an SNS envelope"""
+    return json.dumps({'Type': 'Notification', 'Subject': 'Lambda API Call failure', 'Message': (
+        f"Lambda function failed to reach international taxes API for 'winterday-billing' bucket and file "
+        f"'{key}'. Error: 'Tax API circuit is open'."
+    )})
+
+def fill_dlq(sqs, dlq_url):
+    """MESSAGES retries spread over FILES files (repeats from SNS redelivery), plus UNPARSEABLE junk messages"""
+    rng = random.Random(0)
+    keys = [f'billing_data_{number}.csv' for number in range(FILES)]
+    bodies = keys + [rng.choice(keys) for _ in range(MESSAGES - FILES)]
+    bodies = [failure_message(key) for key in bodies] + ['not a billing retry'] * UNPARSEABLE
+    rng.shuffle(bodies)
+    for start in range(0, len(bodies), 10):
+        sqs.send_message_batch(QueueUrl=dlq_url, Entries=[
+            {'Id': str(number), 'MessageBody': body} for number, body in enumerate(bodies[start:start + 10])
+        ])
+
+def main():
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    print(f"{MESSAGES:,} retry messages for {FILES:,} files, {UNPARSEABLE} unparseable")
+    print(f"  {'receivers':>9}{'rate limit':>12}{'time':>8}{'msgs/sec':>10}  {'redriven':>8}{'duplicates':>11}"
+          f"{'left in DLQ':>12}")
+    for receivers, rate in ((1, 0), (4, 0), (4, 50)):
+        with mock_aws():
+            sqs = boto3.client('sqs')
+            dlq_url = sqs.create_queue(QueueName='billing-retry-dlq')['QueueUrl']
+            dlq_arn = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+            sqs.create_queue(QueueName='billing-retry', Attributes={
+                'RedrivePolicy': json.dumps({'deadLetterTargetArn': dlq_arn, 'maxReceiveCount': 5})
+            })
+            fill_dlq(sqs, dlq_url)
+            # Short polls keep the idle check quick; moto answers at once whenever messages are waiting
+            summary = Redrive(sqs, dlq_url, source_queue(sqs, dlq_url), receivers, rate, wait_seconds=1,
+                              visibility_timeout=60).run()
+            target = sqs.get_queue_attributes(QueueUrl=source_queue(sqs, dlq_url),
+                                              AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+            left = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=['ApproximateNumberOfMessagesNotVisible'])
+            assert int(target['ApproximateNumberOfMessages']) == FILES, target
+        # Idle polls are included in the time, so this is a floor on what a drain costs
+        print(f"  {receivers:>9}{rate or 'none':>12}{summary['elapsed']:7.2f}s"
+              f"{summary['received'] / summary['elapsed']:10,.0f}  {summary['redriven']:>8,}"
+              f"{summary['duplicates']:>11,}{int(left['Attributes']['ApproximateNumberOfMessagesNotVisible']):>12}")
+
+if __name__ == '__main__':
+    main()
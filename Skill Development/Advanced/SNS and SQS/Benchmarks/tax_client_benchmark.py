@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Make the shared layer importable the same way /opt/python is inside Lambda
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Billing Shared Layer', 'python'))
+from billing_taxes import CircuitBreaker, TaxApiUnavailable, TaxRateClient
+
+FILES = 40
+ROWS_PER_FILE = 50
+HEALTHY_LATENCY = 0.005
+FAILING_LATENCY = 0.25
+PAIRS = [(country, product_line) for country in ('US', 'CA', 'MX') for product_line in ('Bakery', 'Meat', 'Dairy')]
+
+class StubTaxApi(BaseHTTPRequestHandler):
+    """Local stand-in for the international taxes API; `server.down` makes it fail slowly"""
+
+    def do_POST(self):
+        self.server.requests += 1
+        pairs = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['pairs']
+        if self.server.down:
+            time.sleep(FAILING_LATENCY)
+            self.send_response(503)
+            self.end_headers()
+            return
+        time.sleep(HEALTHY_LATENCY)
+        body = json.dumps({'rates': [{**pair, 'rate': 0.08} for pair in pairs]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def file_rows(file_number):
+    return [PAIRS[(file_number + row) % len(PAIRS)] for row in range(ROWS_PER_FILE)]
+
+def run(label, server, lookup):
+    """Look up rates for every synthetic file and report wall time and API requests"""
+    server.requests = 0
+    failures = 0
+    started = time.perf_counter()
+    for file_number in range(FILES):
+        try:
+            lookup(file_rows(file_number))
+        except TaxApiUnavailable:
+            failures += 1
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<44}{elapsed:7.2f}s  {server.requests:5} API requests  {failures:3} failed files")
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTaxApi)
+    server.down = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/rates'
+
+    def per_row(client):
+        # The old shape: one uncached request per row
+        return lambda rows: [client.fetch({row}) for row in rows]
+
+    def batched(client):
+        return lambda rows: client.get_rates(rows)
+
+    print(f"{FILES} files x {ROWS_PER_FILE} rows, {len(PAIRS)} distinct (country, product line) pairs")
+    print("Healthy API:")
+    run('per-row requests', server, per_row(TaxRateClient(url, breaker=CircuitBreaker(failure_threshold=10**9))))
+    run('batched per file + TTL cache', server, batched(TaxRateClient(url)))
+
+    server.down = True
+    print(f"Failure storm (API answers 503 after {FAILING_LATENCY}s):")
+    run('batched per file, no breaker', server, batched(TaxRateClient(url, breaker=CircuitBreaker(failure_threshold=10**9))))
+    run('batched per file + circuit breaker', server, batched(TaxRateClient(url)))
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,69 @@
-import csv
+import os
+import resource
+import time
 import boto3
-from datetime import datetime
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from billing_aggregates import FileAggregate, aggregate_sidecar
+from billing_duplicates import duplicate_index_from_env, with_duplicates
+from billing_events import s3_objects
+from billing_moves import MoveEngine
+from billing_parquet import parquet_stage_from_env
+from billing_quarantine import Quarantine
+from billing_ranges import validate_object_ranges
+from billing_rules import compile_plan, error_manifest, track_pairs
+from billing_streams import compression_of, open_csv_rows
+from billing_taxes import TaxApiUnavailable, tax_client_from_env
+from billing_verdicts import make_verdict, usable_verdict, verdict_store_from_env
 
-def get_international_taxes(valid_product_lines, billing_bucket, csv_file):
-    """Fetch international tax rates from external API (currently unavailable)"""
+# Validation rules compiled once per cold start (billing_rules ships in the Billing Shared Layer)
+VALIDATION_PLAN = compile_plan()
+
+# 'first_error' stops at the first bad record; 'collect_all' reports every bad record in an error manifest;
+# 'quarantine' splits a file into its valid rows (processed bucket) and its rejected rows (error bucket)
+VALIDATION_MODE = os.environ.get('VALIDATION_MODE', 'first_error')
+
+# Objects at least this large are validated with concurrent ranged GETs when more than one worker is configured
+RANGED_GET_WORKERS = int(os.environ.get('RANGED_GET_WORKERS', '1'))
+RANGED_GET_THRESHOLD = int(os.environ.get('RANGED_GET_THRESHOLD', str(256 * 1024 * 1024)))
+
+# Verdicts keyed by bucket, key and ETag, so the Retry Billing Parser can skip files already validated here
+VERDICT_STORE = verdict_store_from_env()
+
+# International tax rates behind an in-process + shared TTL cache and a circuit breaker (None without TAX_API_URL)
+TAX_CLIENT = tax_client_from_env()
+
+# Ids of every processed file, so repeated ids are caught before the RDS load (None without DUPLICATE_ID_TABLE)
+DUPLICATE_INDEX = duplicate_index_from_env()
+
+# Objects from one notification batch are validated and routed concurrently on this many threads
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', '8'))
+
+# Boto3 clients are thread-safe, unlike resources, so one client is shared by the fan-out and part-copy workers
+s3_client = boto3.client('s3', config=Config(max_pool_connections=64))
+sns_client = boto3.client('sns')
+
+# Clean files are also written as Parquet partitioned by bill_date and currency (None without PARQUET_BUCKET)
+PARQUET_STAGE = parquet_stage_from_env(s3_client)
+
+def report_throughput(csv_file, row_count, started):
+    """Print validation throughput and the peak resident memory of this execution environment"""
+    elapsed = time.perf_counter() - started
+    rows_per_sec = row_count / elapsed if elapsed > 0 else 0.0
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Validated {row_count} rows of '{csv_file}' in {elapsed:.2f}s "
+          f"({rows_per_sec:,.0f} rows/sec), peak RSS {peak_rss_mb:.1f} MB.")
+
+def get_international_taxes(tax_pairs, billing_bucket, csv_file):
+    """Fetch international tax rates for every (country, product line) pair in the file with one batched lookup"""
     try:
-        raise Exception("API failure: International Taxes API is currently unavailable.")
-    except Exception as error:
-        # Alert operations team via SNS when API calls fail
-        sns = boto3.client('sns')
+        return TAX_CLIENT.get_rates(tuple(pair) for pair in tax_pairs)
+    except TaxApiUnavailable as error:
+        # Alert operations team via SNS when API calls fail; the topic also queues the file for the Retry Billing Parser
         sns_topic_arn = 'arn:aws:sns:us-west-2:522814732220:Winterday2225:3bedf646-9d96-49f5-9498-602777c7da25'
         message = f"Lambda function failed to reach international taxes API for '{billing_bucket}' bucket and file '{csv_file}'. Error: '{error}'."
-        sns.publish(
+        sns_client.publish(
             TopicArn=sns_topic_arn,
             Message=message,
             Subject="Lambda API Call failure"
@@ -20,81 +72,244 @@ def get_international_taxes(valid_product_lines, billing_bucket, csv_file):
         raise error
 
 def lambda_handler(event, context):
-    s3 = boto3.resource('s3')
+    # Collect every object in the notification: direct S3 events, SQS/SNS-wrapped batches or EventBridge
+    objects = s3_objects(event)
+    if DUPLICATE_INDEX is not None:
+        # Pick up the ids other containers committed since this one last loaded the filter
+        DUPLICATE_INDEX.refresh()
+    
+    # Validate and route the objects concurrently on a bounded pool
+    mover = MoveEngine(s3_client)
+    with ThreadPoolExecutor(max_workers=max(1, min(FANOUT_WORKERS, len(objects)))) as executor:
+        results = list(executor.map(lambda obj: process_object(*obj, mover), objects))
+    
+    # Delete every moved original with batched DeleteObjects calls
+    failed_deletes = set(mover.flush_deletes())
+    for result in results:
+        if (result['bucket'], result['key']) in failed_deletes:
+            result.update(status='failed', error='Copied but could not delete the original file.')
     
-    # Extract S3 event details: which bucket and file triggered this Lambda
-    billing_bucket = event['Records'][0]['s3']['bucket']['name']
-    csv_file = event['Records'][0]['s3']['object']['key']
+    if DUPLICATE_INDEX is not None:
+        # The ids are already in the exact store; an unsaved filter is kept and saved by the next invocation
+        try:
+            DUPLICATE_INDEX.save()
+        except Exception as e:
+            print(f"Error while saving the duplicate id filter: {str(e)}.")
     
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    print(f"Handled {len(results)} objects: {summary}.")
+    
+    return {
+        'statusCode': 200,
+        'summary': summary,
+        'results': results
+    }
+
+def uses_ranges(csv_file, size, content_encoding=None):
+    """Large plain-text objects are split into byte ranges; a compressed stream can only be read from the start,
+    quarantine writes the rows out in order, and duplicate ids are only found by seeing every id of the file"""
+    return (RANGED_GET_WORKERS > 1 and size >= RANGED_GET_THRESHOLD and VALIDATION_MODE != 'quarantine'
+            and DUPLICATE_INDEX is None and compression_of(csv_file, content_encoding) is None)
+
+def validate_object(billing_bucket, csv_file, size, collect_all, pairs, aggregate, parquet=None,
+                    content_encoding=None, split=None, scan=None):
+    """Validate one billing file and return (row_count, errors); its (country, product line) pairs go into `pairs`
+    and its totals into `aggregate`. When a Parquet writer, a quarantine split or a duplicate id scan is passed,
+    the streamed rows are fed to it in the same pass"""
+    if uses_ranges(csv_file, size, content_encoding):
+        # Large object: fetch byte ranges concurrently and validate them on a pool of worker processes
+        return validate_object_ranges(
+            VALIDATION_PLAN, billing_bucket, csv_file, size, RANGED_GET_WORKERS, collect_all, pairs=pairs,
+            aggregate=aggregate
+        )
+    # Stream and parse CSV file from S3 without holding the whole object in memory; gzip and zstd
+    # files are decompressed on the fly. 'collect_all' validates whole column batches; otherwise stop
+    # at the first bad record
+    csv_rows, body = open_csv_rows(s3_client, billing_bucket, csv_file)
+    rows = track_pairs(csv_rows, pairs)
+    if split is not None:
+        # Every row is checked and written to the accepted or the rejected output; the split feeds the
+        # Parquet writer and the aggregates only the valid rows
+        row_count, errors = split.run(rows)
+    else:
+        rows = aggregate.tee(rows)
+        if parquet is not None:
+            rows = parquet.tee(rows)
+        if scan is not None:
+            rows = scan.tee(rows)
+        row_count, errors = VALIDATION_PLAN.find_errors(rows, collect_all)
+        if scan is not None:
+            # Ids the filter has seen before are confirmed in batches once the pass is over
+            errors = with_duplicates(errors, scan, collect_all)
+    # Release the connection early when validation stopped before the end of the stream
+    body.close()
+    return row_count, errors
+
+def write_parquet(billing_bucket, csv_file, parquet):
+    """Publish a clean file's Parquet partitions; stream the file again only if validation did not feed the writer"""
+    restream = parquet is None
+    if restream:
+        parquet = PARQUET_STAGE.open(csv_file)
+    try:
+        if restream:
+            csv_rows, _ = open_csv_rows(s3_client, billing_bucket, csv_file)
+            for _ in parquet.tee(csv_rows):
+                pass
+        partitions = parquet.commit()
+    finally:
+        parquet.close()
+    print(f"Wrote {parquet.rows} rows of '{csv_file}' to {partitions} Parquet partitions.")
+    return partitions
+
+def write_aggregates(bucket, key, aggregate):
+    """Write the per-file totals next to a routed object; the sidecar is best effort and never fails the file"""
+    sidecar_key = f"{key}.aggregates.json"
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=sidecar_key,
+            Body=aggregate_sidecar(key, aggregate),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Error while writing aggregates for '{key}': {str(e)}.")
+        return False
+    print(f"Wrote aggregates to: {bucket}/{sidecar_key}.")
+    return True
+
+def process_object(billing_bucket, csv_file, mover):
+    """Validate one billing file and move it to the processed or error bucket; return its status"""
     error_bucket = 'billing-errors'
     processed_bucket = 'Processed'
+    result = {'bucket': billing_bucket, 'key': csv_file}
     
-    # Download and parse CSV file from S3
-    obj = s3.Object(billing_bucket, csv_file)
-    data = obj.get()['Body'].read().decode('utf-8').splitlines()
+    collect_all = VALIDATION_MODE == 'collect_all'
+    quarantine = VALIDATION_MODE == 'quarantine'
+    errors = []
+    parquet = None
+    split = None
+    scan = None
+    aggregate = FileAggregate()
     
-    error_found = False
+    try:
+        head = s3_client.head_object(Bucket=billing_bucket, Key=csv_file)
+        # A verdict for these exact bytes (same ETag) lets a retry skip the GET and the parse
+        verdict = VERDICT_STORE.get(billing_bucket, csv_file, head['ETag'])
+        if usable_verdict(verdict, collect_all or quarantine):
+            print(f"Using cached verdict for '{csv_file}' (ETag {head['ETag']}).")
+        else:
+            started = time.perf_counter()
+            pairs = set()
+            # Ranged validation never sees the rows in order, so the Parquet stage only rides on the streaming path
+            size, content_encoding = head['ContentLength'], head.get('ContentEncoding')
+            if PARQUET_STAGE is not None and not uses_ranges(csv_file, size, content_encoding):
+                parquet = PARQUET_STAGE.open(csv_file)
+            if DUPLICATE_INDEX is not None:
+                scan = DUPLICATE_INDEX.scan(f'{billing_bucket}/{csv_file}')
+            if quarantine:
+                split = Quarantine(VALIDATION_PLAN, s3_client, csv_file, processed_bucket, error_bucket,
+                                   sinks=(parquet, aggregate), duplicates=scan)
+            row_count, errors = validate_object(
+                billing_bucket, csv_file, size, collect_all, pairs, aggregate, parquet, content_encoding, split, scan
+            )
+            report_throughput(csv_file, row_count, started)
+            if scan is not None and (not errors or split is not None and split.valid_rows > 0):
+                # Ids of the rows going on to the processed bucket are recorded before the verdict is cached,
+                # so a cached verdict always means the ids are in the index
+                DUPLICATE_INDEX.commit(scan)
+            verdict = make_verdict(VALIDATION_PLAN, row_count, errors, pairs, aggregate)
+            VERDICT_STORE.put(billing_bucket, csv_file, head['ETag'], verdict)
+    except Exception as e:
+        print(f"Error while validating '{csv_file}': {str(e)}.")
+        if parquet is not None:
+            parquet.close()
+        if split is not None:
+            split.abort()
+        return {**result, 'status': 'failed', 'error': str(e)}
+    finally:
+        if scan is not None:
+            # Drops the scan's spool file from /tmp
+            scan.close()
     
-    # Business rules for data validation
-    valid_product_lines = ['Bakery', 'Meat', 'Dairy']
-    valid_currencies = ['USD', 'MXN', 'CAD']
+    error_found = not verdict['valid']
+    # A file with both good and bad rows is split; one with no good rows is routed whole like before
+    quarantined = split is not None and error_found and split.valid_rows > 0
+    if error_found and not quarantined and parquet is not None:
+        # Only clean files (or the valid rows of a quarantined one) are published as Parquet
+        parquet.close()
+    if quarantined:
+        print(f"Quarantining {verdict['errors']} of {verdict['rows']} records in '{csv_file}'.")
+    elif error_found and collect_all:
+        print(f"Found {verdict['errors']} invalid records in '{csv_file}'.")
+    elif error_found:
+        print(verdict['message'])
+    result.update(rows=int(verdict['rows']), errors=int(verdict['errors']))
     
-    # Validate each billing record against business rules
-    for row in csv.reader(data[1:], delimiter=','):
-        date = row[6]
-        product_line = row[4]
-        currency = row[7]
-        bill_amount = float(row[8])
-        
-        # Validate product line
-        if product_line not in valid_product_lines:
-            error_found = True
-            print(f"Error in record {row[0]}: Unrecognized product line: {product_line}.")
-            break
-        
-        # Validate currency code
-        if currency not in valid_currencies:
-            error_found = True
-            print(f"Error in record {row[0]}: Unrecognized currency: {currency}.")
-            break
-        
-        # Validate bill amount is non-negative
-        if bill_amount < 0:
-            error_found = True
-            print(f"Error in record {row[0]}: negative bill amount: {bill_amount}.")
-            break
-        
-        # Validate date format (YYYY-MM-DD)
+    # Optional columnar copy for the downstream jobs; a failure here is logged but does not hold up routing
+    if (not error_found or quarantined) and PARQUET_STAGE is not None:
         try:
-            datetime.strptime(date, '%Y-%m-%d')
-        except ValueError:
-            error_found = True
-            print(f"Error in record {row[0]}: incorrect date format: {date}.")
-            break
+            result['parquet_partitions'] = write_parquet(billing_bucket, csv_file, parquet)
+        except Exception as e:
+            print(f"Error while writing Parquet for '{csv_file}': {str(e)}.")
+            result['parquet_error'] = str(e)
     
-    # Route file to appropriate bucket based on validation results
-    if error_found:
-        copy_source = {
-            'Bucket': billing_bucket,
-            'Key': csv_file
-        }
+    # Clean files need international tax rates; one batched lookup covers every pair in the file
+    if (not error_found or quarantined) and TAX_CLIENT is not None:
         try:
-            s3.meta.client.copy(copy_source, error_bucket, csv_file)
-            print(f"Moved erroneous file to: {error_bucket}.")
-            s3.Object(billing_bucket, csv_file).delete()
-            print("Deleted original file from bucket.")
+            rates = get_international_taxes(verdict['pairs'], billing_bucket, csv_file)
+            result['tax_rates'] = len(rates)
         except Exception as e:
-            print(f"Error while move file: {str(e)}.")
+            # Leave the file in place; the SNS alert queues it for the Retry Billing Parser
+            print(f"Error while fetching tax rates for '{csv_file}': {str(e)}.")
+            if split is not None:
+                split.abort()
+            return {**result, 'status': 'tax_retry', 'error': str(e)}
     
-    else:
-        copy_source = {
-            'Bucket': billing_bucket,
-            'Key': csv_file
-        }
+    if quarantined:
         try:
-            s3.meta.client.copy(copy_source, processed_bucket, csv_file)
-            print(f"Moved processed file to: {processed_bucket}.")
-            s3.Object(billing_bucket, csv_file).delete()
-            print("Deleted original file from bucket.")
+            # The valid rows become the processed file and the rejected rows land in the error bucket;
+            # the original is deleted with the rest of the batch
+            split.commit()
+            mover.delete(billing_bucket, csv_file)
+            print(f"Wrote {split.valid_rows} valid records to: {processed_bucket}/{split.accepted.key} and "
+                  f"{verdict['errors']} rejected records to: {error_bucket}/{split.rejected.key}.")
         except Exception as e:
-            print(f"Error while move file: {str(e)}.")
\ No newline at end of file
+            print(f"Error while writing quarantine output: {str(e)}.")
+            return {**result, 'status': 'failed', 'error': str(e)}
+        # Totals of the valid rows only, next to the file that holds them
+        result['aggregates'] = write_aggregates(processed_bucket, split.accepted.key, aggregate)
+        return {**result, 'status': 'quarantined', 'valid_rows': split.valid_rows}
+    if split is not None:
+        # Nothing to split: the file is routed whole, bytes unchanged
+        split.abort()
+    
+    # Route file to appropriate bucket based on validation results
+    destination = error_bucket if error_found else processed_bucket
+    try:
+        # Server-side copy now, reusing the HeadObject response from the verdict lookup; the original is
+        # deleted in one batch once every object is routed
+        mover.move(billing_bucket, csv_file, destination, head=head)
+        print(f"Moved {'erroneous' if error_found else 'processed'} file to: {destination}.")
+        if collect_all and error_found:
+            # Write every failing row and reason next to the moved file so it can be fixed in one pass
+            manifest_key = f"{csv_file}.errors.json"
+            s3_client.put_object(
+                Bucket=error_bucket,
+                Key=manifest_key,
+                Body=error_manifest(csv_file, row_count, errors),
+                ContentType='application/json'
+            )
+            print(f"Wrote error manifest to: {error_bucket}/{manifest_key}.")
+    except Exception as e:
+        print(f"Error while move file: {str(e)}.")
+        return {**result, 'status': 'failed', 'error': str(e)}
+    
+    # Clean files get their totals alongside; a cached verdict carries them, so no second pass is needed
+    if not error_found and verdict.get('aggregates'):
+        result['aggregates'] = write_aggregates(
+            processed_bucket, csv_file, FileAggregate.from_dict(verdict['aggregates'])
+        )
+    
+    return {**result, 'status': 'error' if error_found else 'processed'}
@@ -0,0 +1,121 @@
+import json
+from billing_rules import COLUMNS, BILL_AMOUNT, BILL_DATE, CURRENCY, PRODUCT_LINE, canonical_date
+
+# Same rates the RDS loader applies (currency_conversion_to_usd in Automating RDS with Lambda)
+CURRENCY_CONVERSION_TO_USD = {'USD': 1, 'CAD': 0.79, 'MXN': 0.05}
+
+class FileAggregate:
+    """Per-file totals built from the rows the validator already reads
+
+    Amounts are summed as integer cents per (currency, product_line), so the totals are exact and the
+    state is small enough to keep in the verdict cache.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.min_date = None
+        self.max_date = None
+        self.totals = {}
+
+    def tee(self, rows):
+        """Pass rows through unchanged while adding each one to the totals"""
+        add = self.add
+        for row in rows:
+            add(row)
+            yield row
+
+    def add(self, row):
+        # Short rows fail validation, so their file never gets a sidecar; just skip them. Trailing columns
+        # pass validation (ValidationPlan.check has the same rule), so they are counted and the extras ignored
+        if len(row) < len(COLUMNS):
+            return
+        try:
+            cents = round(float(row[BILL_AMOUNT]) * 100)
+        except (ValueError, OverflowError):
+            return
+        self.rows += 1
+        bill_date = row[BILL_DATE]
+        if len(bill_date) != 10:
+            bill_date = canonical_date(bill_date)
+        if self.min_date is None or bill_date < self.min_date:
+            self.min_date = bill_date
+        if self.max_date is None or bill_date > self.max_date:
+            self.max_date = bill_date
+        key = (row[CURRENCY], row[PRODUCT_LINE])
+        total = self.totals.get(key)
+        if total is None:
+            self.totals[key] = [1, cents]
+        else:
+            total[0] += 1
+            total[1] += cents
+
+    def merge(self, other):
+        """Fold in the totals of another part of the same file (a ranged-GET worker's share)"""
+        self.rows += other.rows
+        for bill_date in (other.min_date, other.max_date):
+            if bill_date is not None:
+                self.min_date = bill_date if self.min_date is None else min(self.min_date, bill_date)
+                self.max_date = bill_date if self.max_date is None else max(self.max_date, bill_date)
+        for key, (rows, cents) in other.totals.items():
+            total = self.totals.setdefault(key, [0, 0])
+            total[0] += rows
+            total[1] += cents
+
+    def to_dict(self):
+        """Plain ints and strings, storable in the verdict cache (DynamoDB rejects floats)"""
+        return {
+            'rows': self.rows,
+            'min_date': self.min_date,
+            'max_date': self.max_date,
+            'totals': [[currency, product_line, rows, cents]
+                       for (currency, product_line), (rows, cents) in sorted(self.totals.items())]
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        aggregate = cls()
+        # DynamoDB hands numbers back as Decimal
+        aggregate.rows = int(state['rows'])
+        aggregate.min_date = state['min_date']
+        aggregate.max_date = state['max_date']
+        aggregate.totals = {(currency, product_line): [int(rows), int(cents)]
+                            for currency, product_line, rows, cents in state['totals']}
+        return aggregate
+
+def aggregate_sidecar(source, aggregate, rates=CURRENCY_CONVERSION_TO_USD):
+    """Serialize a file's totals as the compact JSON sidecar written next to the routed object"""
+    by_currency, by_product_line, unconverted = {}, {}, set()
+    total_usd_cents = 0.0
+    for (currency, product_line), (rows, cents) in sorted(aggregate.totals.items()):
+        rate = rates.get(currency)
+        usd_cents = cents * rate if rate is not None else None
+        currency_total = by_currency.setdefault(currency, {'rows': 0, 'cents': 0, 'usd_cents': 0.0})
+        product_total = by_product_line.setdefault(product_line, {'rows': 0, 'usd_cents': 0.0})
+        currency_total['rows'] += rows
+        currency_total['cents'] += cents
+        product_total['rows'] += rows
+        if usd_cents is None:
+            # No rate: the amount is left out of every USD total and the currency is listed instead
+            unconverted.add(currency)
+            continue
+        currency_total['usd_cents'] += usd_cents
+        product_total['usd_cents'] += usd_cents
+        total_usd_cents += usd_cents
+    sidecar = {
+        'source': source,
+        'rows': aggregate.rows,
+        'min_bill_date': aggregate.min_date,
+        'max_bill_date': aggregate.max_date,
+        'by_currency': {currency: {
+            'rows': total['rows'],
+            'amount': total['cents'] / 100,
+            'amount_usd': None if currency in unconverted else round(total['usd_cents'] / 100, 2)
+        } for currency, total in by_currency.items()},
+        'by_product_line': {product_line: {
+            'rows': total['rows'],
+            'amount_usd': round(total['usd_cents'] / 100, 2)
+        } for product_line, total in by_product_line.items()},
+        'total_usd': round(total_usd_cents / 100, 2),
+        'unconverted_currencies': sorted(unconverted)
+    }
+    return json.dumps(sidecar, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,487 @@
+import csv
+import functools
+import math
+import os
+import struct
+import tempfile
+import threading
+import boto3
+from hashlib import blake2b
+from billing_rules import BILL_DATE, ID, canonical_date, is_valid_date
+
+# A billing record is identified by its id and its bill date: every exporter restarts ids at 1 each month, so
+# the same id in two months' files is two records, not a duplicate
+
+# Blocked Bloom filter: every probe for a key lands in one 64-byte block (one cache line), so a lookup
+# costs one hash and one memory fetch however large the filter grows
+BLOCK_BYTES = 64
+BLOCK_BITS = BLOCK_BYTES * 8
+# Bit offsets inside a block are taken 9 bits at a time from one 64-bit hash, so at most 7 probes
+MAX_HASHES = 7
+
+# Sizing for each month's persisted filter: roughly 1.2 bytes per key at a 1% false-positive rate (about 12 MB)
+FILTER_CAPACITY = 10_000_000
+FILTER_ERROR_RATE = 0.01
+
+# Header of a persisted filter: magic, format version, block count, probes per key, keys added.
+# Version 2 filters hold (id, bill date) keys, one filter per bill month
+HEADER = struct.Struct('<4sHQHQ')
+MAGIC = b'BIDS'
+VERSION = 2
+
+# A file's own keys go into a filter of this many keys, and a new one twice the size each time the last one fills
+SCAN_CAPACITY = 1_000_000
+
+# Keys are read back from a scan's spool file and committed this many at a time
+COMMIT_BATCH_KEYS = 10_000
+
+# Merging two copies of the filter works through it this many bytes at a time
+UNION_CHUNK_BYTES = 1024 * 1024
+# A persisted filter is read into place this many bytes at a time
+READ_CHUNK_BYTES = 8 * 1024 * 1024
+
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+MAX_BATCH_GET_KEYS = 100
+
+# Conditional PUT attempts before giving up on saving a filter that other containers keep updating
+MAX_SAVE_ATTEMPTS = 5
+
+@functools.lru_cache(maxsize=4096)
+def bill_day(bill_date):
+    """The zero-padded bill date, or None when it is not a date (such a row fails validation anyway)"""
+    return canonical_date(bill_date) if is_valid_date(bill_date) else None
+
+def key_digest(record_id, day):
+    """Hash of one (id, bill date) key; computed once per row and probed in every filter it is checked against"""
+    return blake2b(f'{day}/{record_id}'.encode('utf-8'), digest_size=16).digest()
+
+class BloomFilter:
+    """Space-efficient set of billing keys: no false negatives, false positives at about the configured rate"""
+
+    def __init__(self, blocks, hashes, count=0):
+        self.blocks = blocks
+        self.hashes = hashes
+        # One buffer holds the persisted header and then the bit array, so neither loading nor saving the
+        # filter makes a second copy of it (at the default capacity it is about 120 MB)
+        self.buffer = bytearray(HEADER.size + blocks * BLOCK_BYTES)
+        self.data = memoryview(self.buffer)[HEADER.size:]
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity=FILTER_CAPACITY, error_rate=FILTER_ERROR_RATE):
+        bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        # Blocking costs a little accuracy, so round the block count up rather than down
+        blocks = max(1, math.ceil(bits / BLOCK_BITS))
+        hashes = min(MAX_HASHES, max(1, round(blocks * BLOCK_BITS / capacity * math.log(2))))
+        return cls(blocks, hashes)
+
+    def probe(self, digest):
+        """Return (block offset, hash bits) for a key_digest()"""
+        return int.from_bytes(digest[:8], 'little') % self.blocks * BLOCK_BYTES, int.from_bytes(digest[8:], 'little')
+
+    def add(self, digest):
+        """Set a key's bits; return True if they were all set already, i.e. the key may have been added before"""
+        data = self.data
+        block, bits = self.probe(digest)
+        present = True
+        for _ in range(self.hashes):
+            bit = bits & 511
+            offset, mask = block + (bit >> 3), 1 << (bit & 7)
+            if not data[offset] & mask:
+                data[offset] |= mask
+                present = False
+            bits >>= 9
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, digest):
+        data = self.data
+        block, bits = self.probe(digest)
+        for _ in range(self.hashes):
+            bit = bits & 511
+            if not data[block + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+            bits >>= 9
+        return True
+
+    def union(self, other):
+        """Fold in the keys of a filter with the same shape (another container's copy)"""
+        if (other.blocks, other.hashes) != (self.blocks, self.hashes):
+            raise ValueError("Cannot merge Bloom filters of different sizes.")
+        # OR a chunk at a time as big ints: no per-byte Python loop and no second copy of the whole filter
+        for start in range(0, len(self.data), UNION_CHUNK_BYTES):
+            chunk = self.data[start:start + UNION_CHUNK_BYTES]
+            merged = int.from_bytes(chunk, 'little') | int.from_bytes(other.data[start:start + len(chunk)], 'little')
+            self.data[start:start + len(chunk)] = merged.to_bytes(len(chunk), 'little')
+        # An upper bound: keys seen by both copies are counted twice
+        self.count += other.count
+
+    def payload(self):
+        """The persisted form, header and bit array, as the filter's own buffer (not a copy)"""
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, self.blocks, self.hashes, self.count)
+        return self.buffer
+
+    @classmethod
+    def read(cls, stream):
+        """Load a persisted filter from a binary stream straight into a preallocated buffer"""
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("Not a billing id filter.")
+        magic, version, blocks, hashes, count = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a billing id filter.")
+        bloom = cls(blocks, hashes, count)
+        bloom.buffer[:HEADER.size] = header
+        data, filled = bloom.data, 0
+        # Read straight into the buffer; response bodies of older botocore releases have no readinto, so those
+        # are copied in pieces
+        readinto = getattr(stream, 'readinto', None)
+        while filled < len(data):
+            if readinto is not None:
+                read = readinto(data[filled:filled + READ_CHUNK_BYTES])
+            else:
+                chunk = stream.read(min(READ_CHUNK_BYTES, len(data) - filled))
+                read = len(chunk)
+                data[filled:filled + read] = chunk
+            if not read:
+                raise ValueError("Truncated billing id filter.")
+            filled += read
+        return bloom
+
+class S3FilterStore:
+    """One S3 object per bill month under a prefix; saves are conditional on the ETag a month was loaded from"""
+
+    def __init__(self, bucket, prefix):
+        self.s3_client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, month):
+        return f'{self.prefix}{month}.bloom'
+
+    def etags(self):
+        """Return {month: etag} for every saved month, from one listing instead of a HEAD per month"""
+        etags = {}
+        for page in self.s3_client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if name.endswith('.bloom'):
+                    etags[name[:-len('.bloom')]] = item['ETag']
+        return etags
+
+    def load(self, month):
+        """Return (filter or None, etag)"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(month))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None, None
+        with response['Body'] as body:
+            return BloomFilter.read(body), response['ETag']
+
+    def save(self, month, bloom, etag):
+        """Write a month's filter unless someone else saved it since `etag`; return the new ETag, or None on a
+        conflict"""
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            response = self.s3_client.put_object(Bucket=self.bucket, Key=self.key(month), Body=bloom.payload(),
+                                                 **condition)
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return None
+            raise
+        return response['ETag']
+
+class FileFilterStore:
+    """Local stand-in for the S3 store, one file per month; /tmp survives between warm invocations only"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, month):
+        return os.path.join(self.directory, f'{month}.bloom')
+
+    def etags(self):
+        if not os.path.isdir(self.directory):
+            return {}
+        return {name[:-len('.bloom')]: os.path.getmtime(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory) if name.endswith('.bloom')}
+
+    def load(self, month):
+        path = self.path(month)
+        if not os.path.exists(path):
+            return None, None
+        with open(path, 'rb') as f:
+            return BloomFilter.read(f), os.path.getmtime(path)
+
+    def save(self, month, bloom, etag):
+        path = self.path(month)
+        if (os.path.getmtime(path) if os.path.exists(path) else None) != etag:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(bloom.payload())
+        return os.path.getmtime(path)
+
+class DynamoIdStore:
+    """Exact record of every committed key and the file it came from, keyed by id and bill_date; confirms filter
+    hits"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = boto3.resource('dynamodb')
+
+    def sources(self, keys):
+        """Return {(id, bill_date): source} for the keys that are already recorded"""
+        found = {}
+        keys = [{'id': record_id, 'bill_date': day} for record_id, day in keys]
+        for start in range(0, len(keys), MAX_BATCH_GET_KEYS):
+            request = {self.table_name: {
+                'Keys': keys[start:start + MAX_BATCH_GET_KEYS],
+                # Placeholders, since 'source' is a DynamoDB reserved word
+                'ProjectionExpression': '#id, #bill_date, #source',
+                'ExpressionAttributeNames': {'#id': 'id', '#bill_date': 'bill_date', '#source': 'source'}
+            }}
+            # Unlike a cache miss, an unanswered key could hide a duplicate, so keep asking until every key is read
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    found[item['id'], item['bill_date']] = item['source']
+                request = response.get('UnprocessedKeys')
+        return found
+
+    def put(self, keys, source):
+        with self.dynamodb.Table(self.table_name).batch_writer(overwrite_by_pkeys=['id', 'bill_date']) as batch:
+            for record_id, day in keys:
+                batch.put_item(Item={'id': record_id, 'bill_date': day, 'source': source})
+
+class MemoryIdStore:
+    """Local stand-in for the id table; shared by every invocation of a warm container"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def sources(self, keys):
+        with self.lock:
+            return {key: self.items[key] for key in keys if key in self.items}
+
+    def put(self, keys, source):
+        with self.lock:
+            for key in keys:
+                self.items[key] = source
+
+class DuplicateIndex:
+    """Keys of every processed billing file: a Bloom filter answers "never seen" from memory, and only its hits
+    are confirmed against the exact key store
+
+    The filter is split by bill month, so a save writes, and other containers reload, only the months a file
+    touched (a monthly export touches one). A month is loaded on its first lookup, reloaded after another
+    container has saved it, and saved back (merged with any concurrent save) at the end of each invocation that
+    committed keys to it.
+    """
+
+    def __init__(self, filter_store, id_store, capacity=FILTER_CAPACITY, error_rate=FILTER_ERROR_RATE):
+        self.filter_store = filter_store
+        self.id_store = id_store
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Filters loaded in this container and the ETags they were loaded from, by month
+        self.months = {}
+        self.etags = {}
+        # ETag of every month in the store as of the last refresh()
+        self.saved = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """List the saved months and drop every loaded month that another container saved since, so it is
+        reloaded on its next lookup; call once per invocation"""
+        with self.lock:
+            self.saved = self.filter_store.etags()
+            for month in list(self.months):
+                if self.saved.get(month) == self.etags[month]:
+                    continue
+                if month in self.dirty:
+                    # Keys committed here but not saved yet must survive the reload
+                    bloom, etag = self.filter_store.load(month)
+                    if bloom is not None:
+                        bloom.union(self.months[month])
+                        self.months[month], self.etags[month] = bloom, etag
+                else:
+                    del self.months[month], self.etags[month]
+
+    def month(self, month):
+        """The filter for one bill month, loaded (or created empty) on first use"""
+        bloom = self.months.get(month)
+        if bloom is None:
+            with self.lock:
+                bloom = self.months.get(month)
+                if bloom is None:
+                    bloom, etag = self.filter_store.load(month) if month in self.saved else (None, None)
+                    if bloom is None:
+                        bloom = BloomFilter.for_capacity(self.capacity, self.error_rate)
+                    self.months[month], self.etags[month] = bloom, etag
+        return bloom
+
+    def scan(self, source):
+        return IdScan(self, source)
+
+    def commit(self, scan):
+        """Record a file's keys as processed: each batch goes to the exact store first, so a filter hit can always
+        be confirmed"""
+        for keys in scan.batches():
+            self.id_store.put(keys, scan.source)
+            # Months are loaded outside the lock, which month() takes itself
+            digests = [(self.month(day[:7]), key_digest(record_id, day)) for record_id, day in keys]
+            with self.lock:
+                for bloom, digest in digests:
+                    bloom.add(digest)
+                self.dirty.update(day[:7] for _, day in keys)
+
+    def save(self):
+        """Persist every month that keys were committed to; a concurrent save is merged in and the write retried"""
+        with self.lock:
+            for month in sorted(self.dirty):
+                for _ in range(MAX_SAVE_ATTEMPTS):
+                    etag = self.filter_store.save(month, self.months[month], self.etags[month])
+                    if etag is not None:
+                        self.etags[month] = self.saved[month] = etag
+                        self.dirty.discard(month)
+                        break
+                    latest, self.etags[month] = self.filter_store.load(month)
+                    if latest is not None:
+                        self.months[month].union(latest)
+                else:
+                    print(f"Could not save the duplicate id filter for {month} after {MAX_SAVE_ATTEMPTS} attempts; "
+                          f"it will be retried.")
+
+class IdScan:
+    """Duplicate keys (id and bill date) of one billing file, found while its rows are validated
+
+    Memory does not grow with the file: its keys go into small Bloom filters and a spool file in /tmp rather
+    than a set. A key that may repeat within the file, or that the index may have seen before, is held as a
+    suspect; confirm() settles the repeats with one pass over the spool and the rest against the exact store.
+    """
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.seen = [BloomFilter.for_capacity(SCAN_CAPACITY)]
+        self.seen_capacity = SCAN_CAPACITY
+        # Row number, id and bill date of every observed row; read back by confirm() and by the commit
+        self.spool = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.spool, lineterminator='\n')
+        # Later row numbers of keys the file's own filters have (maybe) seen, and the first row of index hits
+        self.repeats = {}
+        self.suspects = {}
+        # Keys another file already has; they are not committed again for this one
+        self.claimed = set()
+        self.duplicate_rows = set()
+        self.duplicates = []
+
+    def observe(self, row_number, record_id, bill_date):
+        """Return 'suspect' for a key that may repeat within the file or may have been processed before,
+        otherwise None"""
+        day = bill_day(bill_date)
+        if day is None:
+            return None
+        digest = key_digest(record_id, day)
+        self.writer.writerow((row_number, record_id, day))
+        suspect = None
+        seen = self.seen
+        if seen[-1].count >= self.seen_capacity:
+            self.seen_capacity *= 2
+            seen.append(BloomFilter.for_capacity(self.seen_capacity))
+        # One probe both checks and records the key in the newest filter
+        if seen[-1].add(digest) or len(seen) > 1 and any(digest in older for older in seen[:-1]):
+            self.repeats.setdefault(digest, []).append(row_number)
+            suspect = 'suspect'
+        if digest not in self.suspects and digest in self.index.month(day[:7]):
+            self.suspects[digest] = (row_number, record_id, day)
+            suspect = 'suspect'
+        return suspect
+
+    def tee(self, rows):
+        """Pass rows through unchanged while checking each row's key"""
+        observe = self.observe
+        for row_number, row in enumerate(rows, start=1):
+            # A short row fails validation on its own and has no bill date to key on
+            if len(row) > BILL_DATE:
+                observe(row_number, row[ID], row[BILL_DATE])
+            yield row
+
+    def spooled(self):
+        """Every observed (row number, id, bill date), in row order"""
+        self.spool.flush()
+        self.spool.seek(0)
+        for row_number, record_id, day in csv.reader(self.spool):
+            yield int(row_number), record_id, day
+
+    def confirm(self):
+        """Settle the suspects; return every duplicate as an error tuple sorted by row number.
+        A key recorded under this same file is a reprocessing, not a duplicate"""
+        if self.repeats:
+            # The first row of each possible repeat; any later row with the same key repeats it
+            first = {}
+            for row_number, record_id, day in self.spooled():
+                digest = key_digest(record_id, day)
+                if digest in self.repeats and digest not in first:
+                    first[digest] = row_number
+                    for repeat in self.repeats[digest]:
+                        if repeat != row_number:
+                            self.duplicates.append((repeat, record_id, 'duplicate_id', f'row {row_number}'))
+            self.repeats = {}
+        if self.suspects:
+            hits = {(record_id, day): (row_number, digest)
+                    for digest, (row_number, record_id, day) in self.suspects.items()}
+            for (record_id, day), source in self.index.id_store.sources(list(hits)).items():
+                if source != self.source:
+                    row_number, digest = hits[record_id, day]
+                    self.duplicates.append((row_number, record_id, 'duplicate_id', source))
+                    self.claimed.add(digest)
+            self.suspects = {}
+        self.duplicates.sort()
+        self.duplicate_rows = {duplicate[0] for duplicate in self.duplicates}
+        return self.duplicates
+
+    def batches(self, size=COMMIT_BATCH_KEYS):
+        """The file's keys to commit as lists of (id, bill date); repeats and keys another file has are left out"""
+        batch = []
+        for row_number, record_id, day in self.spooled():
+            if row_number in self.duplicate_rows or (self.claimed and key_digest(record_id, day) in self.claimed):
+                continue
+            batch.append((record_id, day))
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        self.spool.close()
+
+def duplicate_index_from_env():
+    """Index backed by the DUPLICATE_ID_TABLE DynamoDB table and monthly filters in DUPLICATE_FILTER_BUCKET (or
+    /tmp without one); None when DUPLICATE_ID_TABLE is unset"""
+    table_name = os.environ.get('DUPLICATE_ID_TABLE')
+    if not table_name:
+        return None
+    bucket = os.environ.get('DUPLICATE_FILTER_BUCKET')
+    if bucket:
+        filter_store = S3FilterStore(bucket, os.environ.get('DUPLICATE_FILTER_PREFIX', 'duplicates/billing-ids/'))
+    else:
+        filter_store = FileFilterStore(os.environ.get('DUPLICATE_FILTER_DIR', '/tmp/billing-ids'))
+    return DuplicateIndex(
+        filter_store,
+        DynamoIdStore(table_name),
+        int(os.environ.get('DUPLICATE_FILTER_CAPACITY', str(FILTER_CAPACITY))),
+        float(os.environ.get('DUPLICATE_FILTER_ERROR_RATE', str(FILTER_ERROR_RATE)))
+    )
+
+def with_duplicates(errors, scan, collect_all):
+    """Fold a scan's confirmed duplicates into the validation errors; only the earliest is kept unless collect_all.
+    A row that already broke a rule is reported once, for that rule"""
+    failed = {error[0] for error in errors}
+    errors = sorted(errors + [duplicate for duplicate in scan.confirm() if duplicate[0] not in failed])
+    return errors if collect_all else errors[:1]
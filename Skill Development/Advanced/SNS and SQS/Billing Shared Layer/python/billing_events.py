@@ -0,0 +1,45 @@
+import json
+import re
+from urllib.parse import unquote_plus
+
+# The failure message the Billing Bucket Parser publishes names the file it could not finish
+RETRY_MESSAGE_PATTERN = re.compile("for '(.*?)' bucket and file '(.*?)'")
+
+def s3_objects(event):
+    """Return every (bucket, key) pair in an S3 notification, whether it arrived directly,
+    wrapped in SQS or SNS messages, or as an EventBridge 'Object Created' event"""
+    # EventBridge delivers one object per event under 'detail'
+    if 'detail' in event:
+        detail = event['detail']
+        return [(detail['bucket']['name'], detail['object']['key'])]
+
+    objects = []
+    for record in event.get('Records', []):
+        if 's3' in record:
+            # S3 URL-encodes object keys in notifications (spaces arrive as '+')
+            objects.append((record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key'])))
+        elif 'Sns' in record:
+            objects.extend(s3_objects(json.loads(record['Sns']['Message'])))
+        elif 'body' in record:
+            body = json.loads(record['body'])
+            # An SNS topic fanned out to SQS without raw delivery wraps the notification once more
+            objects.extend(s3_objects(json.loads(body['Message']) if 'Message' in body else body))
+    return objects
+
+def sns_message(body):
+    """The text of an SNS notification that reached SQS without raw message delivery; any other body unchanged"""
+    if body.startswith('{'):
+        try:
+            envelope = json.loads(body)
+        except ValueError:
+            return body
+        if isinstance(envelope, dict) and envelope.get('Type') == 'Notification' and 'Message' in envelope:
+            return envelope['Message']
+    return body
+
+def retry_target(message):
+    """Return the (bucket, key) named in a tax-failure retry message, bare or in an SNS envelope, or None if the
+    message does not parse"""
+    # Matching inside the envelope's JSON would return keys with their JSON escapes (\", \u00e9) still in them
+    match = RETRY_MESSAGE_PATTERN.search(sns_message(message))
+    return match.groups() if match else None
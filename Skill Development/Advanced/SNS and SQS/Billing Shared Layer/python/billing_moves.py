@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Objects at least this large are copied with parallel UploadPartCopy instead of one CopyObject
+# (CopyObject itself stops at 5 GB)
+MULTIPART_THRESHOLD = 256 * 1024 * 1024
+PART_SIZE = 64 * 1024 * 1024
+PART_WORKERS = 8
+
+# S3 limits for multipart uploads and DeleteObjects
+MAX_PARTS = 10000
+MAX_DELETE_KEYS = 1000
+
+class MoveEngine:
+    """Server-side moves between buckets: copy now, delete the sources in batches at the end"""
+
+    def __init__(self, s3_client, multipart_threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE,
+                 part_workers=PART_WORKERS):
+        self.s3_client = s3_client
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.part_workers = part_workers
+        self.pending_deletes = {}
+        self.lock = threading.Lock()
+
+    def copy(self, bucket, key, dest_bucket, dest_key=None, head=None):
+        """Copy an object server-side and return the number of bytes copied. `head` is the caller's HeadObject
+        response for the source, when it has one; otherwise the object is HEADed here"""
+        dest_key = dest_key or key
+        if head is None:
+            head = self.s3_client.head_object(Bucket=bucket, Key=key)
+        size = head['ContentLength']
+        started = time.perf_counter()
+        if size < self.multipart_threshold:
+            self.s3_client.copy_object(Bucket=dest_bucket, Key=dest_key, CopySource={'Bucket': bucket, 'Key': key})
+        else:
+            self.multipart_copy(bucket, key, dest_bucket, dest_key, head)
+        elapsed = time.perf_counter() - started
+        rate_mb = size / elapsed / 1024 / 1024 if elapsed > 0 else 0.0
+        print(f"Copied {size:,} bytes of '{key}' to {dest_bucket} in {elapsed:.2f}s ({rate_mb:,.1f} MB/sec).")
+        return size
+
+    def move(self, bucket, key, dest_bucket, dest_key=None, head=None):
+        """Copy an object and queue its source for the next flush_deletes(); return bytes copied"""
+        size = self.copy(bucket, key, dest_bucket, dest_key, head)
+        self.delete(bucket, key)
+        return size
+
+    def delete(self, bucket, key):
+        """Queue an object for the next flush_deletes() without copying it anywhere"""
+        with self.lock:
+            self.pending_deletes.setdefault(bucket, []).append(key)
+
+    def multipart_copy(self, bucket, key, dest_bucket, dest_key, head):
+        """Copy a large object as parallel UploadPartCopy requests"""
+        size = head['ContentLength']
+        # Grow the part size when needed to stay within the 10,000-part limit
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+        parts = [(number, start, min(start + part_size, size) - 1)
+                 for number, start in enumerate(range(0, size, part_size), start=1)]
+        upload_id = self.s3_client.create_multipart_upload(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            ContentType=head.get('ContentType', 'binary/octet-stream'),
+            Metadata=head.get('Metadata', {}),
+            # Compressed billing files must stay labelled as such at the destination
+            **({'ContentEncoding': head['ContentEncoding']} if head.get('ContentEncoding') else {})
+        )['UploadId']
+
+        def copy_part(part):
+            number, first_byte, last_byte = part
+            response = self.s3_client.upload_part_copy(
+                Bucket=dest_bucket,
+                Key=dest_key,
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource={'Bucket': bucket, 'Key': key},
+                CopySourceRange=f'bytes={first_byte}-{last_byte}'
+            )
+            return {'PartNumber': number, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.part_workers) as executor:
+                completed = list(executor.map(copy_part, parts))
+            self.s3_client.complete_multipart_upload(
+                Bucket=dest_bucket,
+                Key=dest_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': completed}
+            )
+        except Exception:
+            # Don't leave orphaned parts behind (they are billed until aborted)
+            self.s3_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+            raise
+
+    def flush_deletes(self):
+        """Delete every queued source with DeleteObjects; return the (bucket, key) pairs that failed"""
+        with self.lock:
+            pending, self.pending_deletes = self.pending_deletes, {}
+        failed = []
+        for bucket, keys in pending.items():
+            # The same file can be moved twice when duplicate notifications share an invocation
+            keys = list(dict.fromkeys(keys))
+            for start in range(0, len(keys), MAX_DELETE_KEYS):
+                batch = keys[start:start + MAX_DELETE_KEYS]
+                try:
+                    response = self.s3_client.delete_objects(
+                        Bucket=bucket,
+                        Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                    )
+                except Exception as e:
+                    print(f"Error while deleting {len(batch)} files from {bucket}: {str(e)}.")
+                    failed.extend((bucket, key) for key in batch)
+                    continue
+                for error in response.get('Errors', []):
+                    print(f"Error while deleting '{error['Key']}' from {bucket}: {error.get('Message')}.")
+                    failed.append((bucket, error['Key']))
+                print(f"Deleted {len(batch) - len(response.get('Errors', []))} original files from {bucket}.")
+        return failed
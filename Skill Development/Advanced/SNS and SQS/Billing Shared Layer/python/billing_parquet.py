@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+from operator import itemgetter
+import boto3
+from billing_rules import COLUMNS, BILL_DATE, CURRENCY, canonical_date
+from billing_streams import plain_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is not in the Lambda runtime; attach the AWS SDK for pandas layer to enable the Parquet stage
+    pa = pq = None
+
+# bill_date and currency are the partition keys, so they live in the object path rather than the file
+DATA_INDEXES = tuple(index for index in range(len(COLUMNS)) if index not in (BILL_DATE, CURRENCY))
+DATA_COLUMNS = tuple(COLUMNS[index] for index in DATA_INDEXES)
+data_columns = itemgetter(*DATA_INDEXES)
+COLUMN_TYPES = {'id': 'int64', 'bill_amount': 'float64'}
+
+# Buffered rows across all partitions before they are written out as row groups; bounds memory per file
+FLUSH_ROWS = 64 * 1024
+
+PARQUET_COMPRESSION = 'zstd'
+
+# Glue BatchCreatePartition accepts at most 100 partitions per call
+MAX_PARTITIONS_PER_CALL = 100
+
+class PartitionWriter:
+    """Parquet files for one billing CSV, one per (bill_date, currency) partition, staged in /tmp"""
+
+    def __init__(self, stage, source_key):
+        self.stage = stage
+        self.source_key = source_key
+        self.directory = tempfile.mkdtemp(prefix='parquet-')
+        self.schema = pa.schema([(column, COLUMN_TYPES.get(column, 'string')) for column in DATA_COLUMNS])
+        self.buffers = {}
+        self.buffered = 0
+        self.writers = {}
+        self.rows = 0
+        # Set when a value cannot be cast to its Parquet type; the file is then not published, but validation goes on
+        self.error = None
+
+    def tee(self, rows):
+        """Pass rows through unchanged while buffering them by partition"""
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def add(self, row):
+        """Buffer one row under its partition"""
+        # Short rows fail validation, so the file is never published; just don't buffer them. Trailing columns
+        # pass validation, so those rows are kept and only the known columns written
+        if len(row) < len(COLUMNS) or self.error is not None:
+            return
+        bill_date = row[BILL_DATE]
+        partition = (bill_date if len(bill_date) == 10 else canonical_date(bill_date), row[CURRENCY])
+        columns = self.buffers.get(partition)
+        if columns is None:
+            columns = self.buffers[partition] = [[] for _ in DATA_COLUMNS]
+        for values, value in zip(columns, data_columns(row)):
+            values.append(value)
+        self.buffered += 1
+        if self.buffered >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows out as row groups. This runs in the middle of validation, so an Arrow error
+        (a value the validator accepts but Arrow cannot cast, such as id 'A-1' or amount ' 12.5') marks the
+        writer failed and drops its output instead of raising; commit() reports it"""
+        try:
+            for partition, columns in self.buffers.items():
+                if partition not in self.writers:
+                    path = os.path.join(self.directory, f'{len(self.writers)}.parquet')
+                    self.writers[partition] = (pq.ParquetWriter(path, self.schema, compression=PARQUET_COMPRESSION),
+                                               path)
+                writer = self.writers[partition][0]
+                # Text columns are converted in bulk by Arrow rather than value by value in Python
+                arrays = [pa.array(values, pa.string()).cast(field.type) for values, field in zip(columns, self.schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+                self.rows += len(columns[0])
+        except pa.ArrowException as e:
+            self.error = e
+            self.close()
+        self.buffers = {}
+        self.buffered = 0
+
+    def commit(self):
+        """Upload every partition file and register the partitions; return how many were written"""
+        self.flush()
+        if self.error is not None:
+            raise ValueError(f"Cannot convert '{self.source_key}' to Parquet: {str(self.error)}") from self.error
+        stem = os.path.splitext(os.path.basename(plain_key(self.source_key)))[0]
+        partitions = []
+        for (bill_date, currency), (writer, path) in self.writers.items():
+            writer.close()
+            # Named after the source file, so reprocessing it overwrites instead of duplicating rows
+            key = f'{self.stage.prefix}bill_date={bill_date}/currency={currency}/{stem}.parquet'
+            self.stage.s3_client.upload_file(path, self.stage.bucket, key)
+            partitions.append((bill_date, currency))
+        self.writers = {}
+        self.stage.register_partitions(partitions)
+        return len(partitions)
+
+    def close(self):
+        """Discard whatever is staged locally; safe to call after commit"""
+        for writer, _ in self.writers.values():
+            writer.close()
+        self.writers = {}
+        self.buffers = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class ParquetStage:
+    """Write clean billing files to s3://bucket/prefix as Parquet partitioned by bill_date and currency"""
+
+    def __init__(self, s3_client, bucket, prefix='billing/', database=None, table=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.database = database
+        self.table = table
+        self.glue_client = boto3.client('glue') if database and table else None
+        self.storage_descriptor = None
+
+    def open(self, source_key):
+        return PartitionWriter(self, source_key)
+
+    def register_partitions(self, partitions):
+        """Add the partitions to the Glue table so Athena and Glue jobs can prune by date and currency"""
+        if self.glue_client is None or not partitions:
+            return
+        if self.storage_descriptor is None:
+            table = self.glue_client.get_table(DatabaseName=self.database, Name=self.table)['Table']
+            self.storage_descriptor = table['StorageDescriptor']
+        inputs = [{
+            'Values': [bill_date, currency],
+            'StorageDescriptor': {
+                **self.storage_descriptor,
+                'Location': f's3://{self.bucket}/{self.prefix}bill_date={bill_date}/currency={currency}/'
+            }
+        } for bill_date, currency in partitions]
+        for start in range(0, len(inputs), MAX_PARTITIONS_PER_CALL):
+            response = self.glue_client.batch_create_partition(
+                DatabaseName=self.database,
+                TableName=self.table,
+                PartitionInputList=inputs[start:start + MAX_PARTITIONS_PER_CALL]
+            )
+            for error in response.get('Errors', []):
+                # Most partitions already exist once a date has been loaded; anything else is worth a log line
+                if error['ErrorDetail'].get('ErrorCode') != 'AlreadyExistsException':
+                    print(f"Error registering partition {error['PartitionValues']}: {error['ErrorDetail']}.")
+
+def parquet_stage_from_env(s3_client):
+    """Stage writing to PARQUET_BUCKET and registering partitions in GLUE_DATABASE.GLUE_TABLE; None when disabled"""
+    bucket = os.environ.get('PARQUET_BUCKET')
+    if not bucket:
+        return None
+    if pa is None:
+        print("PARQUET_BUCKET is set but pyarrow is not installed; skipping the Parquet stage.")
+        return None
+    return ParquetStage(
+        s3_client,
+        bucket,
+        os.environ.get('PARQUET_PREFIX', 'billing/'),
+        os.environ.get('GLUE_DATABASE'),
+        os.environ.get('GLUE_TABLE')
+    )
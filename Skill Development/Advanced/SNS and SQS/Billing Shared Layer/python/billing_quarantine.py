@@ -0,0 +1,151 @@
+import csv
+import io
+from billing_rules import BILL_DATE, COLUMNS, ID
+from billing_streams import plain_key
+
+# Multipart parts must be at least 5 MB (except the last); smaller outputs are written with one PutObject
+PART_SIZE = 8 * 1024 * 1024
+
+# Rows between checks of the text buffers; keeps the per-row cost to the check and the csv write
+FLUSH_EVERY_ROWS = 1024
+
+class MultipartWriter:
+    """Bytes streamed into one S3 object, uploaded part by part as the buffer fills"""
+
+    def __init__(self, s3_client, bucket, key, part_size=PART_SIZE, content_type='text/csv'):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.upload_id is None:
+            # Started lazily, so a small output never opens a multipart upload at all
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        self.buffer.clear()
+
+    def commit(self):
+        """Make the object visible: one PutObject if it never outgrew a part, otherwise complete the upload"""
+        try:
+            if self.upload_id is None:
+                self.s3_client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+                )
+            else:
+                if self.buffer:
+                    self.upload_part()
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+        except Exception:
+            self.abort()
+            raise
+        self.upload_id = None
+        self.buffer.clear()
+
+    def abort(self):
+        """Drop the output; uploaded parts are aborted so they are not billed"""
+        if self.upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                print(f"Error aborting upload of '{self.key}': {str(e)}.")
+        self.upload_id = None
+        self.buffer.clear()
+
+class Quarantine:
+    """Split a billing file into its valid rows and its rejected rows in one streaming pass
+
+    Valid rows go to processed_bucket under the source key; rejected rows go to error_bucket as
+    '<key>.rejected.csv' with their record number and reason code in front of the original columns.
+    Nothing is visible until commit(); abort() drops both outputs. With a duplicate id scan, rows whose id and
+    bill date repeat within the file or were already processed are rejected as well.
+    """
+
+    def __init__(self, plan, s3_client, csv_file, processed_bucket, error_bucket, sinks=(), duplicates=None):
+        self.plan = plan
+        key = plain_key(csv_file)
+        self.accepted = MultipartWriter(s3_client, processed_bucket, key)
+        self.rejected = MultipartWriter(s3_client, error_bucket, f'{key}.rejected.csv')
+        # Anything with an add(row) method that should see only the valid rows (Parquet writer, aggregates)
+        self.sinks = [sink for sink in sinks if sink is not None]
+        self.duplicates = duplicates
+        self.valid_rows = 0
+
+    def run(self, rows):
+        """Check every row and write it to the accepted or rejected output; return (row_count, errors)"""
+        accepted_text, rejected_text = io.StringIO(), io.StringIO()
+        accepted = csv.writer(accepted_text, lineterminator='\n')
+        rejected = csv.writer(rejected_text, lineterminator='\n')
+        accepted.writerow(COLUMNS)
+        rejected.writerow(('row', 'reason', *COLUMNS))
+        check = self.plan.check
+        sinks = self.sinks
+        observe = self.duplicates.observe if self.duplicates is not None else None
+
+        def accept(row):
+            accepted.writerow(row)
+            for sink in sinks:
+                sink.add(row)
+
+        errors = []
+        held = []
+        row_number = 0
+        for row_number, row in enumerate(rows, start=1):
+            failure = check(row)
+            if failure is not None:
+                errors.append((row_number, row[0] if row else '', *failure))
+                rejected.writerow((row_number, failure[0], *row))
+            elif observe is not None and observe(row_number, row[ID], row[BILL_DATE]) is not None:
+                # Repeats and filter hits wait until the hits are confirmed in one batch after the pass
+                held.append((row_number, row))
+            else:
+                accept(row)
+            if row_number % FLUSH_EVERY_ROWS == 0:
+                self.drain(accepted_text, self.accepted)
+                self.drain(rejected_text, self.rejected)
+        if self.duplicates is not None:
+            duplicates = self.duplicates.confirm()
+            duplicate_rows = {duplicate[0] for duplicate in duplicates}
+            # Held rows are written after the rest; the rejected output keeps each row's original number
+            for held_number, row in held:
+                if held_number in duplicate_rows:
+                    rejected.writerow((held_number, 'duplicate_id', *row))
+                else:
+                    accept(row)
+            errors = sorted(errors + duplicates)
+        self.drain(accepted_text, self.accepted)
+        self.drain(rejected_text, self.rejected)
+        self.valid_rows = row_number - len(errors)
+        return row_number, errors
+
+    @staticmethod
+    def drain(text, writer):
+        writer.write(text.getvalue().encode('utf-8'))
+        text.seek(0)
+        text.truncate()
+
+    def commit(self):
+        self.accepted.commit()
+        self.rejected.commit()
+
+    def abort(self):
+        self.accepted.abort()
+        self.rejected.abort()
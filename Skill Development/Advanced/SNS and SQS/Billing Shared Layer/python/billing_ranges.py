@@ -0,0 +1,139 @@
+import csv
+import io
+import multiprocessing
+from multiprocessing.connection import wait
+import boto3
+from billing_aggregates import FileAggregate
+from billing_rules import track_pairs
+
+# Bytes fetched per ranged GET; each worker holds one range in memory at a time
+RANGE_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Workers are forked from a single-threaded server process, not from the handler: a plain fork copies whatever
+# locks the handler's fan-out and part-copy threads hold at that instant (boto3's connection pools, logging)
+START_METHOD = 'forkserver'
+
+def split_ranges(size, chunk_size=RANGE_CHUNK_SIZE):
+    """Split an object of `size` bytes into (index, start, end) ranges, end exclusive"""
+    return [(index, start, min(start + chunk_size, size))
+            for index, start in enumerate(range(0, size, chunk_size))]
+
+def validate_range(s3_client, plan, bucket, key, index, start, end, collect_all):
+    """Fetch one byte range and validate the complete lines inside it
+
+    Returns (index, head, tail, complete, row_count, errors, pairs, aggregate). `head` holds the bytes up to and
+    including the first newline, which finish the row that straddles the previous range (or the
+    header for range 0). `tail` holds the bytes after the last newline, which start the row that
+    continues into the next range. Only the lines in between are validated here; `pairs` are
+    their distinct (country, product_line) values and `aggregate` their FileAggregate totals.
+    """
+    data = s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end - 1}')['Body'].read()
+    first_newline = data.find(b'\n')
+    if first_newline < 0:
+        # The whole range sits inside one long row; the merge stitches it to its neighbours
+        return index, data, b'', False, 0, [], set(), FileAggregate()
+    last_newline = data.rfind(b'\n')
+    head, tail = data[:first_newline + 1], data[last_newline + 1:]
+    # Lines are cut at b'\n', which never appears inside a multi-byte UTF-8 sequence
+    middle = io.TextIOWrapper(io.BytesIO(data[first_newline + 1:last_newline + 1]), encoding='utf-8', newline='')
+    pairs = set()
+    aggregate = FileAggregate()
+    rows = aggregate.tee(track_pairs(csv.reader(middle, delimiter=','), pairs))
+    row_count, errors = plan.find_errors(rows, collect_all)
+    return index, head, tail, True, row_count, errors, pairs, aggregate
+
+def range_worker(conn, plan, bucket, key, ranges, collect_all):
+    """Worker process: validate the assigned ranges in order and send each verdict to the parent"""
+    try:
+        s3_client = boto3.client('s3')
+        for index, start, end in ranges:
+            conn.send(validate_range(s3_client, plan, bucket, key, index, start, end, collect_all))
+    except Exception as error:
+        conn.send(f"Range worker failed on '{key}': {error}")
+    finally:
+        conn.close()
+
+def merge_verdicts(plan, verdicts, collect_all, pairs, aggregate):
+    """Stitch straddling rows together and combine range verdicts in row order"""
+    header_done = False
+    carry = b''
+    row_number = 0
+    errors = []
+
+    def check_boundary(line):
+        nonlocal row_number
+        row_number += 1
+        row = next(track_pairs(csv.reader([line.decode('utf-8')], delimiter=','), pairs), [])
+        aggregate.add(row)
+        failure = plan.check(row)
+        if failure is not None:
+            errors.append((row_number, row[0] if row else '', *failure))
+
+    for index, head, tail, complete, row_count, range_errors, range_pairs, range_aggregate in verdicts:
+        pairs.update(range_pairs)
+        aggregate.merge(range_aggregate)
+        if not complete:
+            carry += head
+            continue
+        if header_done:
+            check_boundary(carry + head)
+            if errors and not collect_all:
+                # The stitched row is the first failure, so the count stops there, as it does when streaming
+                return row_number, errors
+        header_done = True
+        errors.extend((row_number + local_row, *rest) for local_row, *rest in range_errors)
+        row_number += row_count
+        carry = tail
+        if errors and not collect_all:
+            return row_number, errors[:1]
+    if carry and header_done:
+        check_boundary(carry)
+    return row_number, errors if collect_all else errors[:1]
+
+def validate_object_ranges(plan, bucket, key, size, workers, collect_all=False, chunk_size=RANGE_CHUNK_SIZE,
+                           pairs=None, aggregate=None):
+    """Validate an S3 object with concurrent ranged GETs across `workers` processes
+
+    Returns (row_count, errors) exactly like ValidationPlan.find_errors on the whole object. When a set
+    is passed as `pairs`, the (country, product_line) pairs seen in the object are added to it; a
+    FileAggregate passed as `aggregate` receives the object's totals.
+    """
+    ranges = split_ranges(size, chunk_size)
+    # Lambda has no /dev/shm, so use Process + Pipe rather than Pool or Queue
+    context = multiprocessing.get_context(START_METHOD)
+    if START_METHOD == 'forkserver':
+        # The server imports boto3 and the rules once per container, so each worker starts with them loaded
+        context.set_forkserver_preload(['billing_ranges'])
+    connections, processes = [], []
+    for worker in range(min(workers, len(ranges))):
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        # Deal ranges round-robin so the earliest rows are validated first
+        process = context.Process(
+            target=range_worker,
+            args=(child_conn, plan, bucket, key, ranges[worker::workers], collect_all)
+        )
+        process.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(process)
+
+    verdicts = {}
+    try:
+        while connections:
+            for conn in wait(connections):
+                try:
+                    verdict = conn.recv()
+                except EOFError:
+                    connections.remove(conn)
+                    continue
+                if isinstance(verdict, str):
+                    raise RuntimeError(verdict)
+                verdicts[verdict[0]] = verdict
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    return merge_verdicts(plan, (verdicts[index] for index, _, _ in ranges), collect_all,
+                          pairs if pairs is not None else set(),
+                          aggregate if aggregate is not None else FileAggregate())
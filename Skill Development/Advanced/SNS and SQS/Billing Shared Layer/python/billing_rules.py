@@ -0,0 +1,209 @@
+import json
+import re
+from itertools import compress, islice
+from operator import itemgetter, not_
+
+# Column layout of every billing CSV (header row included in the files)
+COLUMNS = ('id', 'company_name', 'country', 'city', 'product_line',
+           'item', 'bill_date', 'currency', 'bill_amount')
+ID, COMPANY_NAME, COUNTRY, CITY, PRODUCT_LINE, ITEM, BILL_DATE, CURRENCY, BILL_AMOUNT = range(len(COLUMNS))
+
+# Business rules for data validation
+VALID_PRODUCT_LINES = ('Bakery', 'Meat', 'Dairy')
+VALID_CURRENCIES = ('USD', 'MXN', 'CAD')
+
+# Error messages printed by the billing parsers, keyed by reason code
+DEFAULT_MESSAGES = {
+    'malformed_row': "Error in record {record}: expected {expected} columns, found {value}.",
+    'product_line': "Error in record {record}: Unrecognized product line: {value}.",
+    'currency': "Error in record {record}: Unrecognized currency: {value}.",
+    'bill_amount': "Error in record {record}: invalid bill amount: {value}.",
+    'negative_amount': "Error in record {record}: negative bill amount: {value}.",
+    'bill_date': "Error in record {record}: incorrect date format: {value}.",
+    'duplicate_id': "Error in record {record}: duplicate id for this bill date, already in {value}.",
+}
+
+# Rows per column batch in collect-all-errors mode
+BATCH_SIZE = 8192
+
+# Days per month in a non-leap year, index 0 unused
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Same shapes datetime.strptime accepts for '%Y-%m-%d' (month/day may drop the leading zero)
+LOOSE_DATE = re.compile(r'(\d{4})-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])')
+
+def is_valid_date(value):
+    """Check a YYYY-MM-DD date without building a datetime object"""
+    # Fast path: the canonical zero-padded form every exporter produces
+    year, month, day = value[:4], value[5:7], value[8:]
+    # isdecimal() on ASCII only: isdigit() also accepts superscripts such as '²', which int() rejects
+    if (len(value) == 10 and value[4] == '-' and value[7] == '-' and value.isascii()
+            and year.isdecimal() and month.isdecimal() and day.isdecimal()):
+        year, month, day = int(year), int(month), int(day)
+    else:
+        match = LOOSE_DATE.fullmatch(value)
+        if not match:
+            return False
+        year, month, day = (int(part) for part in match.groups())
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return day <= 29
+    return day <= DAYS_IN_MONTH[month]
+
+def canonical_date(value):
+    """Zero-pad a loose YYYY-M-D date so every spelling of a day compares and groups the same"""
+    match = LOOSE_DATE.fullmatch(value)
+    if not match:
+        return value
+    year, month, day = (int(part) for part in match.groups())
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+class ValidationPlan:
+    """Column-indexed validation rules compiled once per cold start"""
+
+    def __init__(self, product_lines, currencies, messages):
+        self.product_lines = frozenset(product_lines)
+        self.currencies = frozenset(currencies)
+        self.messages = {**DEFAULT_MESSAGES, **messages}
+        self.width = len(COLUMNS)
+        self.columns = itemgetter(ID, PRODUCT_LINE, CURRENCY, BILL_AMOUNT, BILL_DATE)
+
+    def check(self, row):
+        """Return (reason, value) for the first rule the row breaks, or None if it is valid"""
+        if len(row) < self.width:
+            return 'malformed_row', len(row)
+        # Rules run in the same order the parsers have always applied them
+        product_line = row[PRODUCT_LINE]
+        if product_line not in self.product_lines:
+            return 'product_line', product_line
+        currency = row[CURRENCY]
+        if currency not in self.currencies:
+            return 'currency', currency
+        try:
+            bill_amount = float(row[BILL_AMOUNT])
+        except ValueError:
+            return 'bill_amount', row[BILL_AMOUNT]
+        if bill_amount < 0:
+            return 'negative_amount', bill_amount
+        bill_date = row[BILL_DATE]
+        if not is_valid_date(bill_date):
+            return 'bill_date', bill_date
+        return None
+
+    def describe(self, row, reason, value):
+        """Format the error message for a failed row"""
+        record = row[ID] if row else ''
+        return self.messages[reason].format(record=record, value=value, expected=self.width)
+
+    def format_error(self, error):
+        """Format the error message for a (row_number, record_id, reason, value) error tuple"""
+        _, record, reason, value = error
+        return self.messages[reason].format(record=record, value=value, expected=self.width)
+
+    def first_error(self, rows):
+        """Validate rows until the first failure; return (row_count, message or None)"""
+        check = self.check
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            failure = check(row)
+            if failure is not None:
+                return row_count, self.describe(row, *failure)
+        return row_count, None
+
+    def find_errors(self, rows, collect_all=False):
+        """Return (row_count, errors) as error tuples; stops at the first failure unless collect_all"""
+        if collect_all:
+            return self.collect_errors(rows)
+        check = self.check
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            failure = check(row)
+            if failure is not None:
+                return row_count, [(row_count, row[ID] if row else '', *failure)]
+        return row_count, []
+
+    def collect_errors(self, rows, batch_size=BATCH_SIZE):
+        """Validate every row in column batches; return (row_count, errors) sorted by row number
+
+        Each error is (row_number, record_id, reason, value), where row_number counts data rows from 1.
+        """
+        rows = iter(rows)
+        errors = []
+        row_count = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            errors.extend(self.check_batch(batch, row_count))
+            row_count += len(batch)
+        return row_count, errors
+
+    def check_batch(self, batch, offset):
+        """Run each rule over a whole column at once and report the first rule every bad row breaks"""
+        failures = {}
+        positions = range(len(batch))
+        # Short rows cannot be transposed into columns, so report them up front and leave them out
+        if min(map(len, batch)) < self.width:
+            positions = [i for i, row in enumerate(batch) if len(row) >= self.width]
+            for i, row in enumerate(batch):
+                if len(row) < self.width:
+                    failures[i] = (row[ID] if row else '', 'malformed_row', len(row))
+            batch = [batch[i] for i in positions]
+            if not batch:
+                return [(offset + i + 1, *failure) for i, failure in sorted(failures.items())]
+        ids, product_lines, currencies, amounts, dates = zip(*map(self.columns, batch))
+        indexes = range(len(batch))
+
+        def record(reason, failed, values):
+            # Rules run in check() order, so a row keeps the first reason it was given
+            for i in failed:
+                failures.setdefault(positions[i], (ids[i], reason, values[i]))
+
+        # Membership and sign checks stay inside C-level map/compress; only failing indexes reach Python
+        record('product_line', compress(indexes, map(not_, map(self.product_lines.__contains__, product_lines))), product_lines)
+        record('currency', compress(indexes, map(not_, map(self.currencies.__contains__, currencies))), currencies)
+        try:
+            parsed = list(map(float, amounts))
+        except ValueError:
+            parsed = [parse_amount(amount) for amount in amounts]
+            record('bill_amount', [i for i in indexes if parsed[i] is None], amounts)
+            parsed = [-1.0 if amount is None else amount for amount in parsed]
+        record('negative_amount', compress(indexes, map((0.0).__gt__, parsed)), parsed)
+        record('bill_date', compress(indexes, map(not_, map(is_valid_date, dates))), dates)
+        return [(offset + i + 1, *failure) for i, failure in sorted(failures.items())]
+
+def track_pairs(rows, pairs):
+    """Pass rows through unchanged while adding each (country, product_line) pair to `pairs`"""
+    add = pairs.add
+    for row in rows:
+        if len(row) > PRODUCT_LINE:
+            add((row[COUNTRY], row[PRODUCT_LINE]))
+        yield row
+
+def parse_amount(value):
+    """float() that returns None instead of raising on a malformed amount"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def error_manifest(source, row_count, errors):
+    """Serialize collected errors as compact column-oriented JSON for the error bucket"""
+    rows, ids, reasons, values = (list(column) for column in zip(*errors)) if errors else ([], [], [], [])
+    manifest = {
+        'source': source,
+        'rows_checked': row_count,
+        'error_count': len(errors),
+        'row': rows,
+        'id': ids,
+        'reason': reasons,
+        'value': [str(value) for value in values],
+    }
+    return json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+
+def compile_plan(product_lines=VALID_PRODUCT_LINES, currencies=VALID_CURRENCIES, messages=None):
+    """Build the validation plan; call at module level so it is reused across warm invocations"""
+    return ValidationPlan(product_lines, currencies, messages or {})
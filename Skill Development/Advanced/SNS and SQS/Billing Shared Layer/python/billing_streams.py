@@ -0,0 +1,67 @@
+import csv
+import gzip
+import io
+
+try:
+    # Python 3.14+ ships zstd in the standard library
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Read buffer for the S3 response stream; peak memory is bounded by this, not by the file size
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Compressed billing exports are recognised by Content-Encoding first, then by extension
+EXTENSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+
+def compression_of(key, content_encoding=None):
+    """Return 'gzip', 'zstd' or None for an object with this key and Content-Encoding header"""
+    for encoding in (content_encoding or '').lower().split(','):
+        if encoding.strip() in ENCODINGS:
+            return ENCODINGS[encoding.strip()]
+    lowered = key.lower()
+    for extension, compression in EXTENSIONS.items():
+        if lowered.endswith(extension):
+            return compression
+    return None
+
+def plain_key(key):
+    """The key without its compression extension, for outputs derived from the decompressed rows"""
+    lowered = key.lower()
+    for extension in EXTENSIONS:
+        if lowered.endswith(extension):
+            return key[:-len(extension)]
+    return key
+
+def decompressed(body, compression):
+    """Wrap a binary stream so reads return decompressed bytes, a buffer at a time"""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=body, mode='rb')
+    if compression == 'zstd':
+        if zstd is not None:
+            return zstd.ZstdFile(body, mode='rb')
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+        raise RuntimeError("zstd-compressed input needs Python 3.14+ or the zstandard package.")
+    return body
+
+def stream_csv_rows(body, compression=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Parse CSV data rows incrementally from an S3 StreamingBody instead of loading the whole object"""
+    buffered = io.BufferedReader(decompressed(body, compression), buffer_size=chunk_size)
+    # newline='' lets csv.reader handle quoted fields that contain line breaks
+    text = io.TextIOWrapper(buffered, encoding='utf-8', newline='')
+    # Skip the header as a raw line so a stray quote in it cannot swallow the data rows
+    text.readline()
+    return csv.reader(text, delimiter=',')
+
+def open_csv_rows(s3_client, bucket, key, chunk_size=STREAM_CHUNK_SIZE):
+    """GET a billing file and stream its data rows, decompressing on the fly.
+    Returns (rows, body) so the caller can close the connection when it stops early"""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    compression = compression_of(key, response.get('ContentEncoding'))
+    return stream_csv_rows(response['Body'], compression, chunk_size), response['Body']
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from decimal import Decimal
+import boto3
+
+# Rates change rarely, so a cached rate is trusted for an hour
+RATE_TTL_SECONDS = 60 * 60
+
+# Give up on the API quickly: a slow failure holds the whole invocation
+REQUEST_TIMEOUT_SECONDS = 2
+
+# Open the circuit after this many consecutive failures, then probe again after the cool-down
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT_SECONDS = 30
+
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+MAX_BATCH_GET_KEYS = 100
+
+class TaxApiUnavailable(Exception):
+    """The international taxes API failed, or the circuit is open and the call was not attempted"""
+
+class CircuitBreaker:
+    """Fail fast while a dependency is down instead of waiting for a timeout on every call"""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True when a call may go out: the circuit is closed, or a half-open probe is due"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: let this one call probe the API and hold everyone else back meanwhile
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+class DynamoRateCache:
+    """Tax rates shared by every container through a DynamoDB table keyed by 'country|product_line'"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = boto3.resource('dynamodb')
+
+    def get_many(self, pairs):
+        rates = {}
+        keys = [{'pair': f'{country}|{product_line}'} for country, product_line in pairs]
+        now = int(time.time())
+        try:
+            for start in range(0, len(keys), MAX_BATCH_GET_KEYS):
+                request = {self.table_name: {'Keys': keys[start:start + MAX_BATCH_GET_KEYS]}}
+                # Unprocessed keys are simply treated as misses
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    if item['expires_at'] > now:
+                        country, product_line = item['pair'].split('|', 1)
+                        rates[(country, product_line)] = float(item['rate'])
+        except Exception as e:
+            print(f"Error reading cached tax rates: {str(e)}.")
+        return rates
+
+    def put_many(self, rates):
+        expires_at = int(time.time()) + RATE_TTL_SECONDS
+        try:
+            with self.dynamodb.Table(self.table_name).batch_writer() as batch:
+                for (country, product_line), rate in rates.items():
+                    batch.put_item(Item={
+                        'pair': f'{country}|{product_line}',
+                        'rate': Decimal(str(rate)),
+                        'expires_at': expires_at
+                    })
+        except Exception as e:
+            print(f"Error caching tax rates: {str(e)}.")
+
+class TaxRateClient:
+    """International tax rates for (country, product_line) pairs, looked up in one batched request
+
+    Lookups go to the in-process cache first, then the shared cache, and only the misses reach the API.
+    The API is expected to answer POST {"pairs": [{"country", "product_line"}, ...]} with
+    {"rates": [{"country", "product_line", "rate"}, ...]}.
+    """
+
+    def __init__(self, url, shared_cache=None, breaker=None, timeout=REQUEST_TIMEOUT_SECONDS):
+        self.url = url
+        self.shared_cache = shared_cache
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.local_cache = {}
+        self.lock = threading.Lock()
+        self.api_calls = 0
+
+    def get_rates(self, pairs):
+        """Return {(country, product_line): rate} for every pair, or raise TaxApiUnavailable"""
+        pairs = set(pairs)
+        now = time.monotonic()
+        with self.lock:
+            cached = {pair: self.local_cache[pair][0] for pair in pairs
+                      if pair in self.local_cache and self.local_cache[pair][1] > now}
+        missing = pairs - cached.keys()
+        if missing and self.shared_cache is not None:
+            shared = self.shared_cache.get_many(missing)
+            self.remember(shared)
+            cached.update(shared)
+            missing -= shared.keys()
+        if missing:
+            fetched = self.fetch(missing)
+            self.remember(fetched)
+            if self.shared_cache is not None:
+                self.shared_cache.put_many(fetched)
+            cached.update(fetched)
+        return cached
+
+    def remember(self, rates):
+        expires_at = time.monotonic() + RATE_TTL_SECONDS
+        with self.lock:
+            for pair, rate in rates.items():
+                self.local_cache[pair] = (rate, expires_at)
+
+    def fetch(self, pairs):
+        """One API request for every missing pair, guarded by the circuit breaker"""
+        if not self.breaker.allow():
+            raise TaxApiUnavailable("International Taxes API circuit is open; skipping the call.")
+        body = json.dumps({'pairs': [{'country': country, 'product_line': product_line}
+                                     for country, product_line in sorted(pairs)]}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        self.api_calls += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+            rates = {(rate['country'], rate['product_line']): float(rate['rate']) for rate in payload['rates']}
+            if not pairs <= rates.keys():
+                raise ValueError(f"response is missing {len(pairs - rates.keys())} of {len(pairs)} rates")
+        except Exception as error:
+            self.breaker.record_failure()
+            raise TaxApiUnavailable(f"API failure: International Taxes API is currently unavailable ({error}).") from error
+        self.breaker.record_success()
+        return rates
+
+def tax_client_from_env():
+    """Client for TAX_API_URL sharing rates through TAX_RATE_TABLE; None when no API is configured"""
+    url = os.environ.get('TAX_API_URL')
+    if not url:
+        return None
+    table_name = os.environ.get('TAX_RATE_TABLE')
+    return TaxRateClient(url, DynamoRateCache(table_name) if table_name else None)
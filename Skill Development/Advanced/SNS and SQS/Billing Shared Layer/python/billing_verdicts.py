@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+import boto3
+
+# Verdicts expire after this long so the table never grows without bound (DynamoDB TTL attribute)
+VERDICT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+class DynamoVerdictStore:
+    """Validation verdicts in a DynamoDB table keyed by 'bucket/key', valid only for the stored ETag"""
+
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+
+    def get(self, bucket, key, etag):
+        # The cache is an optimization, so a table error just means validating the file again
+        try:
+            item = self.table.get_item(Key={'object': f'{bucket}/{key}'}, ConsistentRead=True).get('Item')
+        except Exception as e:
+            print(f"Error reading cached verdict for '{key}': {str(e)}.")
+            return None
+        if item is None or item['etag'] != etag:
+            return None
+        return item['verdict']
+
+    def put(self, bucket, key, etag, verdict):
+        try:
+            self.table.put_item(Item={
+                'object': f'{bucket}/{key}',
+                'etag': etag,
+                'verdict': verdict,
+                'expires_at': int(time.time()) + VERDICT_TTL_SECONDS
+            })
+        except Exception as e:
+            print(f"Error caching verdict for '{key}': {str(e)}.")
+
+class MemoryVerdictStore:
+    """Local stand-in for the verdict table; shared by every invocation of a warm container"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, bucket, key, etag):
+        with self.lock:
+            item = self.items.get((bucket, key))
+        if item is None or item[0] != etag or item[2] < time.time():
+            return None
+        return item[1]
+
+    def put(self, bucket, key, etag, verdict):
+        with self.lock:
+            self.items[(bucket, key)] = (etag, verdict, time.time() + VERDICT_TTL_SECONDS)
+
+def verdict_store_from_env():
+    """Use the DynamoDB table named by VERDICT_TABLE, or the in-memory stand-in when it is unset"""
+    table_name = os.environ.get('VERDICT_TABLE')
+    return DynamoVerdictStore(table_name) if table_name else MemoryVerdictStore()
+
+def make_verdict(plan, row_count, errors, pairs=(), aggregate=None):
+    """The part of a validation result worth caching: enough to route the file without reading it"""
+    return {
+        'valid': not errors,
+        'rows': row_count,
+        'errors': len(errors),
+        'message': plan.format_error(errors[0]) if errors else '',
+        # Distinct (country, product_line) pairs, so the tax lookup needs no second pass over the file
+        'pairs': [list(pair) for pair in sorted(pairs)],
+        # Per-file totals for the aggregate sidecar, kept only for clean files (only they get a sidecar)
+        'aggregates': aggregate.to_dict() if aggregate is not None and not errors else None
+    }
+
+def usable_verdict(verdict, collect_all):
+    """Cached verdicts don't keep every error, so an invalid file is re-validated when every bad row is needed
+    (the collect-all manifest, or a quarantine split)"""
+    return verdict is not None and (verdict['valid'] or not collect_all)
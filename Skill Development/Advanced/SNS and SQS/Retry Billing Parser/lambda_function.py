@@ -1,89 +1,201 @@
-import csv
+import os
 import boto3
-from datetime import datetime
-import re
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from billing_aggregates import FileAggregate, aggregate_sidecar
+from billing_duplicates import duplicate_index_from_env, with_duplicates
+from billing_events import retry_target
+from billing_moves import MoveEngine
+from billing_quarantine import Quarantine
+from billing_rules import compile_plan, error_manifest
+from billing_streams import open_csv_rows
+from billing_verdicts import make_verdict, usable_verdict, verdict_store_from_env
+
+# Validation rules compiled once per cold start (billing_rules ships in the Billing Shared Layer)
+VALIDATION_PLAN = compile_plan()
+
+# 'first_error' stops at the first bad record; 'collect_all' reports every bad record in an error manifest;
+# 'quarantine' splits a file into its valid rows (processed bucket) and its rejected rows (error bucket)
+VALIDATION_MODE = os.environ.get('VALIDATION_MODE', 'first_error')
+
+# Verdicts keyed by bucket, key and ETag, written by the Billing Bucket Parser for the same bytes
+VERDICT_STORE = verdict_store_from_env()
+
+# Ids of every processed file, shared with the Billing Bucket Parser (None without DUPLICATE_ID_TABLE)
+DUPLICATE_INDEX = duplicate_index_from_env()
+
+# Messages from one SQS batch are validated concurrently (the queue's batch size is at most 10)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '10'))
+
+# Boto3 clients are thread-safe, unlike resources, so one client is shared by the batch and part-copy workers
+s3_client = boto3.client('s3', config=Config(max_pool_connections=64))
 
 def lambda_handler(event, context):
-    s3 = boto3.resource('s3')
+    records = event['Records']
+    if DUPLICATE_INDEX is not None:
+        # Pick up the ids other containers committed since this one last loaded the filter
+        DUPLICATE_INDEX.refresh()
+    
+    # Validate every message in the batch; any exception marks only that message for redelivery
+    mover = MoveEngine(s3_client)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(records)))) as executor:
+        outcomes = list(executor.map(lambda record: process_record(record, mover), records))
     
+    # Delete every moved original with batched DeleteObjects calls; a failed delete means a retry
+    failed_deletes = set(mover.flush_deletes())
+    failed = [record for record, outcome in zip(records, outcomes) if outcome is False or outcome in failed_deletes]
+    
+    if DUPLICATE_INDEX is not None:
+        # The ids are already in the exact store; an unsaved filter is kept and saved by the next invocation
+        try:
+            DUPLICATE_INDEX.save()
+        except Exception as e:
+            print(f"Error while saving the duplicate id filter: {str(e)}.")
+    print(f"Processed {len(records) - len(failed)} of {len(records)} messages; {len(failed)} will be retried.")
+    
+    if any('Sns' in record for record in failed):
+        # A direct SNS subscription has no partial batch response (and invokes with one record), so the failure
+        # is raised for Lambda's asynchronous retry to redeliver that message
+        raise RuntimeError(f"{len(failed)} SNS messages failed and will be retried.")
+    # Partial batch response: SQS deletes the successful messages and redelivers only these
+    return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in failed]}
+
+def message_id(record):
+    return record['Sns']['MessageId'] if 'Sns' in record else record['messageId']
+
+def process_record(record, mover):
+    """Validate and route the file named by one SQS or SNS message; return False if it should be retried"""
+    try:
+        # SQS bodies are either the bare failure message or, without raw delivery, the SNS envelope around it;
+        # retry_target unwraps both. A direct SNS subscription puts the message under 'Sns'
+        message = record['Sns']['Message'] if 'Sns' in record else record['body']
+        return process_message(message, mover)
+    except Exception as e:
+        print(f"Error processing message {message_id(record)}: {str(e)}.")
+        return False
+
+def process_message(message, mover):
+    """Validate the billing file named in a retry message and move it to the processed or error bucket.
+    Returns the moved (bucket, key), or None when the message could not be parsed or the file was already routed"""
     # Parse SQS message to extract bucket and file information
-    message = event['Records'][0]['body']
-    match = re.search("for '(.*?)' bucket and file '(.*?)'", message)
-    if match:
-        billing_bucket, csv_file = match.groups()
+    target = retry_target(message)
+    if target:
+        billing_bucket, csv_file = target
     else:
+        # A malformed message will never parse, so it is dropped rather than redelivered
         print(f"Error parsing message: {message}.")
         return
     
     error_bucket = 'billing-errors'
     processed_bucket = 'Processed'
     
-    # Download and parse CSV file from S3
-    obj = s3.Object(billing_bucket, csv_file)
-    data = obj.get()['Body'].read().decode('utf-8').splitlines()
+    collect_all = VALIDATION_MODE == 'collect_all'
+    quarantine = VALIDATION_MODE == 'quarantine'
+    errors = []
+    split = None
+    aggregate = FileAggregate()
     
-    error_found = False
-    
-    # Business rules for data validation
-    valid_product_lines = ['Bakery', 'Meat', 'Dairy']
-    valid_currencies = ['USD', 'MXN', 'CAD']
-    
-    # Validate each billing record against business rules
-    for row in csv.reader(data[1:], delimiter=','):
-        date = row[6]
-        product_line = row[4]
-        currency = row[7]
-        bill_amount = float(row[8])
-        
-        # Validate product line
-        if product_line not in valid_product_lines:
-            error_found = True
-            print(f"Error in record {row[0]}: Unrecognized product line: {product_line}.")
-            break
-        
-        # Validate currency code
-        if currency not in valid_currencies:
-            error_found = True
-            print(f"Error in record {row[0]}: Unrecognized currency: {currency}.")
-            break
+    # A repeated message (duplicate delivery, or a redrive of one that was already handled) finds the file
+    # moved; there is nothing left to do, so the message is acknowledged instead of retried into the DLQ
+    try:
+        head = s3_client.head_object(Bucket=billing_bucket, Key=csv_file)
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            print(f"'{billing_bucket}/{csv_file}' is gone; it was already routed.")
+            return
+        raise
+
+    # Skip the download and the parse when this exact file (same ETag) was already validated
+    etag = head['ETag']
+    verdict = VERDICT_STORE.get(billing_bucket, csv_file, etag)
+    if usable_verdict(verdict, collect_all or quarantine):
+        print(f"Using cached verdict for '{csv_file}' (ETag {etag}).")
+    else:
+        # Stream and parse CSV file from S3, decompressing gzip and zstd files on the fly
+        rows, body = open_csv_rows(s3_client, billing_bucket, csv_file)
         
-        # Validate bill amount is non-negative
-        if bill_amount < 0:
-            error_found = True
-            print(f"Error in record {row[0]}: negative bill amount: {bill_amount}.")
-            break
+        # Each row's id is checked against every processed file when the duplicate index is enabled
+        scan = DUPLICATE_INDEX.scan(f'{billing_bucket}/{csv_file}') if DUPLICATE_INDEX is not None else None
         
-        # Validate date format (YYYY-MM-DD)
+        # 'collect_all' validates whole column batches; 'quarantine' writes every row to the accepted or
+        # rejected output as it is checked; otherwise stop at the first bad record
         try:
-            datetime.strptime(date, '%Y-%m-%d')
-        except ValueError:
-            error_found = True
-            print(f"Error in record {row[0]}: incorrect date format: {date}.")
-            break
+            if quarantine:
+                split = Quarantine(VALIDATION_PLAN, s3_client, csv_file, processed_bucket, error_bucket,
+                                   sinks=(aggregate,), duplicates=scan)
+                row_count, errors = split.run(rows)
+            else:
+                rows = aggregate.tee(rows)
+                if scan is not None:
+                    rows = scan.tee(rows)
+                row_count, errors = VALIDATION_PLAN.find_errors(rows, collect_all)
+                if scan is not None:
+                    errors = with_duplicates(errors, scan, collect_all)
+            if scan is not None and (not errors or split is not None and split.valid_rows > 0):
+                # Recorded before the verdict is cached, so a cached verdict always means the ids are indexed
+                DUPLICATE_INDEX.commit(scan)
+        except Exception:
+            if split is not None:
+                split.abort()
+            raise
+        finally:
+            body.close()
+            if scan is not None:
+                scan.close()
+        verdict = make_verdict(VALIDATION_PLAN, row_count, errors, aggregate=aggregate)
+        VERDICT_STORE.put(billing_bucket, csv_file, etag, verdict)
     
-    # Route file to appropriate bucket based on validation results
-    if error_found:
-        copy_source = {
-            'Bucket': billing_bucket,
-            'Key': csv_file
-        }
-        try:
-            s3.meta.client.copy(copy_source, error_bucket, csv_file)
-            print(f"Moved erroneous file to: {error_bucket}.")
-            s3.Object(billing_bucket, csv_file).delete()
-            print("Deleted original file from bucket.")
-        except Exception as e:
-            print(f"Error while move file: {str(e)}.")
+    error_found = not verdict['valid']
+    if split is not None and error_found and split.valid_rows > 0:
+        # The valid rows become the processed file and the rejected rows land in the error bucket
+        split.commit()
+        mover.delete(billing_bucket, csv_file)
+        print(f"Wrote {split.valid_rows} valid records to: {processed_bucket}/{split.accepted.key} and "
+              f"{verdict['errors']} rejected records to: {error_bucket}/{split.rejected.key}.")
+        write_aggregates(processed_bucket, split.accepted.key, aggregate)
+        return billing_bucket, csv_file
+    if split is not None:
+        # Nothing to split: the file is routed whole, bytes unchanged
+        split.abort()
     
-    else:
-        copy_source = {
-            'Bucket': billing_bucket,
-            'Key': csv_file
-        }
-        try:
-            s3.meta.client.copy(copy_source, processed_bucket, csv_file)
-            print(f"Moved processed file to: {processed_bucket}.")
-            s3.Object(billing_bucket, csv_file).delete()
-            print("Deleted original file from bucket.")
-        except Exception as e:
-            print(f"Error while move file: {str(e)}.")
\ No newline at end of file
+    if error_found and collect_all:
+        print(f"Found {verdict['errors']} invalid records in '{csv_file}'.")
+    elif error_found:
+        print(verdict['message'])
+    
+    # Route file to appropriate bucket based on validation results.
+    # Move failures propagate so the message is redelivered instead of lost
+    destination = error_bucket if error_found else processed_bucket
+    # Server-side copy now; the original is deleted in one batch once every message is handled
+    mover.move(billing_bucket, csv_file, destination, head=head)
+    print(f"Moved {'erroneous' if error_found else 'processed'} file to: {destination}.")
+    if not error_found and verdict.get('aggregates'):
+        # Per-file totals next to the clean file; a cached verdict from the Billing Bucket Parser carries them
+        write_aggregates(processed_bucket, csv_file, FileAggregate.from_dict(verdict['aggregates']))
+    if collect_all and error_found:
+        # Write every failing row and reason next to the moved file so it can be fixed in one pass
+        manifest_key = f"{csv_file}.errors.json"
+        s3_client.put_object(
+            Bucket=error_bucket,
+            Key=manifest_key,
+            Body=error_manifest(csv_file, row_count, errors),
+            ContentType='application/json'
+        )
+        print(f"Wrote error manifest to: {error_bucket}/{manifest_key}.")
+    
+    return billing_bucket, csv_file
+
+def write_aggregates(bucket, key, aggregate):
+    """Write the per-file totals next to a routed object. The file is already moved, so a failure here is
+    only logged: redelivering the message would find the source gone"""
+    sidecar_key = f"{key}.aggregates.json"
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=sidecar_key,
+            Body=aggregate_sidecar(key, aggregate),
+            ContentType='application/json'
+        )
+        print(f"Wrote aggregates to: {bucket}/{sidecar_key}.")
+    except Exception as e:
+        print(f"Error while writing aggregates for '{key}': {str(e)}.")
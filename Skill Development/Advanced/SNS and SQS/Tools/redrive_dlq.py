@@ -0,0 +1,210 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+import boto3
+from botocore.config import Config
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+# Make the shared layer importable the same way /opt/python is inside Lambda
+sys.path.insert(0, os.path.join(TOOLS, '..', 'Billing Shared Layer', 'python'))
+from billing_events import retry_target
+
+# ReceiveMessage, SendMessageBatch, DeleteMessageBatch and ChangeMessageVisibilityBatch take at most 10 messages
+MAX_BATCH = 10
+
+# Longest long poll SQS allows
+MAX_WAIT_SECONDS = 20
+
+# Received messages stay hidden this long, so every receiver sees each message once per run
+VISIBILITY_TIMEOUT_SECONDS = 15 * 60
+
+class RateLimiter:
+    """Token bucket shared by every receiver: at most `rate` messages per second, in bursts of one batch"""
+
+    def __init__(self, rate, burst=MAX_BATCH):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Redrive:
+    """Drain a dead-letter queue back into the retry queue, re-submitting one message per billing file
+
+    Messages naming a file that was already re-submitted in this run are deleted instead of sent, and
+    messages that don't parse are left in the dead-letter queue for a person to look at.
+    """
+
+    def __init__(self, sqs_client, source_url, target_url, receivers=4, rate=50, wait_seconds=MAX_WAIT_SECONDS,
+                 visibility_timeout=VISIBILITY_TIMEOUT_SECONDS, idle_polls=1, max_messages=None, dry_run=False):
+        self.sqs_client = sqs_client
+        self.source_url = source_url
+        self.target_url = target_url
+        self.receivers = receivers
+        self.limiter = RateLimiter(rate)
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.idle_polls = idle_polls
+        self.max_messages = max_messages
+        self.dry_run = dry_run
+        # (bucket, key) of every file re-submitted (or claimed for re-submission) in this run
+        self.claimed = set()
+        self.hidden = []
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Receive on `receivers` threads until the queue stays empty; return the counts and the elapsed time"""
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.receive_loop) for _ in range(self.receivers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.dry_run:
+            # Nothing was changed, so make every message visible again right away
+            self.release(self.hidden)
+        return {**self.counts, 'elapsed': time.perf_counter() - started}
+
+    def receive_loop(self):
+        idle = 0
+        while idle < self.idle_polls and not self.full():
+            # Long polling: an empty response means the queue really is drained, not that a poll was unlucky
+            messages = self.sqs_client.receive_message(
+                QueueUrl=self.source_url,
+                MaxNumberOfMessages=MAX_BATCH,
+                WaitTimeSeconds=self.wait_seconds,
+                VisibilityTimeout=self.visibility_timeout,
+                MessageAttributeNames=['All']
+            ).get('Messages', [])
+            if not messages:
+                idle += 1
+                continue
+            idle = 0
+            self.handle(messages)
+
+    def full(self):
+        with self.lock:
+            return self.max_messages is not None and self.counts['received'] >= self.max_messages
+
+    def handle(self, messages):
+        """Claim each message's file; send the first message per file and delete the repeats"""
+        send, repeats = [], []
+        with self.lock:
+            self.counts['received'] += len(messages)
+            for message in messages:
+                target = retry_target(message['Body'])
+                if target is None:
+                    # Becomes visible in the dead-letter queue again once the visibility timeout runs out
+                    self.counts['unparseable'] += 1
+                    print(f"Leaving unparseable message {message['MessageId']} in the dead-letter queue.")
+                elif target in self.claimed:
+                    self.counts['duplicates'] += 1
+                    repeats.append(message)
+                else:
+                    self.claimed.add(target)
+                    send.append((target, message))
+            if self.dry_run:
+                self.hidden.extend(messages)
+                self.counts['redriven'] += len(send)
+                return
+        sent = self.send([message for _, message in send])
+        failed = [target for target, message in send if message['MessageId'] not in sent]
+        if failed:
+            with self.lock:
+                # The message is still in the dead-letter queue, so a later repeat may carry the file instead
+                self.claimed.difference_update(failed)
+        self.delete([message for _, message in send if message['MessageId'] in sent] + repeats)
+
+    def send(self, messages):
+        """Re-submit messages to the retry queue unchanged; return the ids of the ones SQS accepted"""
+        if not messages:
+            return set()
+        self.limiter.acquire(len(messages))
+        response = self.sqs_client.send_message_batch(QueueUrl=self.target_url, Entries=[{
+            'Id': str(number),
+            'MessageBody': message['Body'],
+            'MessageAttributes': {name: {field: value for field, value in attribute.items()
+                                         if field in ('DataType', 'StringValue', 'BinaryValue')}
+                                  for name, attribute in message.get('MessageAttributes', {}).items()}
+        } for number, message in enumerate(messages)])
+        for failure in response.get('Failed', []):
+            print(f"Error re-submitting message {messages[int(failure['Id'])]['MessageId']}: {failure['Message']}.")
+        with self.lock:
+            self.counts['redriven'] += len(response.get('Successful', []))
+            self.counts['failed'] += len(response.get('Failed', []))
+        return {messages[int(success['Id'])]['MessageId'] for success in response.get('Successful', [])}
+
+    def delete(self, messages):
+        if not messages:
+            return
+        response = self.sqs_client.delete_message_batch(QueueUrl=self.source_url, Entries=[
+            {'Id': str(number), 'ReceiptHandle': message['ReceiptHandle']} for number, message in enumerate(messages)
+        ])
+        for failure in response.get('Failed', []):
+            # Shows up again after the visibility timeout and may be re-submitted by a later run. If its file was
+            # routed in the meantime, the Retry Billing Parser finds it gone and acknowledges the repeat
+            print(f"Error deleting message {messages[int(failure['Id'])]['MessageId']}: {failure['Message']}.")
+        with self.lock:
+            self.counts['delete_failed'] += len(response.get('Failed', []))
+
+    def release(self, messages):
+        for start in range(0, len(messages), MAX_BATCH):
+            self.sqs_client.change_message_visibility_batch(QueueUrl=self.source_url, Entries=[
+                {'Id': str(number), 'ReceiptHandle': message['ReceiptHandle'], 'VisibilityTimeout': 0}
+                for number, message in enumerate(messages[start:start + MAX_BATCH])
+            ])
+
+def source_queue(sqs_client, dlq_url):
+    """The queue whose redrive policy points at this dead-letter queue, when there is exactly one"""
+    urls = sqs_client.list_dead_letter_source_queues(QueueUrl=dlq_url).get('queueUrls', [])
+    if len(urls) != 1:
+        raise SystemExit(f"{dlq_url} is the dead-letter queue of {len(urls)} queues; pass --target.")
+    return urls[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-submit failed billing retries from a dead-letter queue')
+    parser.add_argument('dlq_url', help='dead-letter queue to drain')
+    parser.add_argument('--target', help="queue to re-submit to (default: the DLQ's only source queue)")
+    parser.add_argument('--receivers', type=int, default=4, help='parallel long-poll receivers')
+    parser.add_argument('--rate', type=float, default=50, help='messages re-submitted per second (0 for no limit)')
+    parser.add_argument('--wait-seconds', type=int, default=MAX_WAIT_SECONDS, help='long-poll wait per receive')
+    parser.add_argument('--visibility-timeout', type=int, default=VISIBILITY_TIMEOUT_SECONDS)
+    parser.add_argument('--max-messages', type=int, help='stop after receiving about this many messages')
+    parser.add_argument('--dry-run', action='store_true', help='count what would be re-submitted; change nothing')
+    parser.add_argument('--endpoint-url', help='SQS endpoint, e.g. a local ElasticMQ or LocalStack')
+    parser.add_argument('--region')
+    args = parser.parse_args()
+    # Every receiver holds a connection through a long poll, and the senders need theirs too
+    sqs_client = boto3.client('sqs', endpoint_url=args.endpoint_url, region_name=args.region,
+                              config=Config(max_pool_connections=max(10, args.receivers * 2)))
+    target_url = args.target or source_queue(sqs_client, args.dlq_url)
+    summary = Redrive(
+        sqs_client, args.dlq_url, target_url, args.receivers, args.rate, args.wait_seconds,
+        args.visibility_timeout, max_messages=args.max_messages, dry_run=args.dry_run
+    ).run()
+    print(f"{'Would re-submit' if args.dry_run else 'Re-submitted'} {summary.get('redriven', 0)} of "
+          f"{summary.get('received', 0)} messages to {target_url} in {summary['elapsed']:.1f}s: "
+          f"{summary.get('duplicates', 0)} duplicates, {summary.get('unparseable', 0)} unparseable, "
+          f"{summary.get('failed', 0)} failed.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import csv
+import io
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import boto3
+from moto import mock_aws
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+LOADER = os.path.join(BENCHMARKS, '..')
+PROJECT = os.path.join(LOADER, '..', '..', '..', 'Advanced', 'SNS and SQS')
+sys.path.insert(0, LOADER)
+# billing_streams (for open_rows_at) and the synthetic billing generator
+sys.path.insert(0, os.path.join(PROJECT, 'Billing Shared Layer', 'python'))
+sys.path.insert(0, os.path.join(PROJECT, 'Benchmarks'))
+from billing_generator import HEADER, generate_rows
+from loader_batches import INSERT_SQL, record_parameters
+from loader_checkpoints import open_rows_at
+from loader_executors import ConnectionPool, PooledDbApiExecutor
+from loader_staging import BulkLoader
+
+ROWS = int(os.environ.get('ROWS', '20000'))
+PART_ROWS = int(os.environ.get('PART_ROWS', '5000'))
+REGION = 'us-west-2'
+SOURCE_BUCKET = 'winterday-billing'
+STAGING_BUCKET = 'winterday-billing-staging'
+RATES = {'USD': 1, 'CAD': 0.79, 'MXN': 0.05}
+CREATE_TABLE = open(os.path.join(LOADER, 'SQL', 'create_billing_data_table.sql')).read()
+
+# The MySQL statements in SQLite's dialect; the temporary table has billing_data's primary key, like CREATE ... LIKE
+SQLITE_STATEMENTS = {
+    'create': CREATE_TABLE.replace('billing_data', 'temp.billing_data_staging'),
+    'load': "LOAD DATA FROM S3 '{url}' IGNORE INTO TABLE billing_data_staging ({columns})",
+    'merge': "INSERT OR IGNORE INTO billing_data ({columns}) SELECT {columns} FROM billing_data_staging",
+    'clear': "DELETE FROM billing_data_staging",
+    'drop': "DROP TABLE IF EXISTS temp.billing_data_staging"
+}
+LOAD_DATA = re.compile(r"LOAD DATA FROM S3 's3://([^/]+)/([^']+)' IGNORE INTO TABLE (\w+) \((.*)\)")
+
+class LoadDataCursor:
+    """SQLite cursor that also understands the LOAD DATA FROM S3 statement, reading the file from (moto) S3"""
+
+    def __init__(self, cursor, s3_client):
+        self.cursor = cursor
+        self.s3_client = s3_client
+        self.rowcount = -1
+
+    def execute(self, sql, values=()):
+        match = LOAD_DATA.fullmatch(sql)
+        if match is None:
+            self.cursor.execute(sql, values)
+        else:
+            bucket, key, table, columns = match.groups()
+            body = self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+            placeholders = ', '.join('?' * len(columns.split(', ')))
+            self.cursor.executemany(f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})",
+                                    csv.reader(io.StringIO(body)))
+        self.rowcount = self.cursor.rowcount
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(sql, rows)
+        self.rowcount = self.cursor.rowcount
+
+class LoadDataConnection:
+    def __init__(self, path, s3_client):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.s3_client = s3_client
+
+    def cursor(self):
+        return LoadDataCursor(self.connection.cursor(), self.s3_client)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+def billing_csv():
+    """Synthetic rows plus the awkward ones: repeated keys, quotes, commas, line breaks and non-ASCII text"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(HEADER)
+    writer.writerows(generate_rows(ROWS, seed=7, error_kinds=('duplicate_id',), error_rate=0.02))
+    writer.writerow([ROWS + 1, 'Café "Crème", Ltd', 'CA', 'Montréal', 'Bakery', 'Croissants\nau beurre',
+                     '2023-05-02', 'CAD', '1234.56'])
+    writer.writerow([ROWS + 2, 'Back\\slash BBQ', 'MX', 'Tijuana', 'Meat', 'Carne Asada', '2023-05-03', 'MXN', '0.01'])
+    writer.writerow([ROWS + 3, 'Unknown Currency Co', 'US', 'Austin', 'Dairy', 'Whole Milk', '2023-05-04', 'EUR',
+                     '99.99'])
+    return output.getvalue()
+
+def database(directory, name, s3_client, existing):
+    """A billing_data table already holding some rows, so the loads must leave those alone"""
+    path = os.path.join(directory, f'{name}.db')
+    connection = sqlite3.connect(path)
+    connection.execute(CREATE_TABLE)
+    connection.executemany(
+        "INSERT INTO billing_data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [row + ['-1'] for row in existing]
+    )
+    connection.commit()
+    connection.close()
+    pool = ConnectionPool(lambda: LoadDataConnection(path, s3_client))
+    return path, PooledDbApiExecutor(pool, placeholder='?', sql=INSERT_SQL.replace('INSERT IGNORE', 'INSERT OR IGNORE'))
+
+def table_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT * FROM billing_data ORDER BY id, bill_date").fetchall()
+    finally:
+        connection.close()
+
+def main():
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    body = billing_csv()
+    # Every 500th generated row is already in the table, with a different amount
+    existing = [[str(field) for field in row] for row in generate_rows(ROWS, seed=7)][::500]
+    with tempfile.TemporaryDirectory() as directory, mock_aws():
+        s3 = boto3.client('s3')
+        for bucket in (SOURCE_BUCKET, STAGING_BUCKET):
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+        s3.put_object(Bucket=SOURCE_BUCKET, Key='billing.csv', Body=body.encode('utf-8'))
+        etag = s3.head_object(Bucket=SOURCE_BUCKET, Key='billing.csv')['ETag']
+
+        # Row by row: one INSERT IGNORE per record, as process_record() does
+        row_path, executor = database(directory, 'row_by_row', s3, existing)
+        started = time.perf_counter()
+        for record, _ in open_rows_at(s3, SOURCE_BUCKET, 'billing.csv', etag):
+            executor.execute(executor.sql, record_parameters(record, RATES))
+        row_seconds = time.perf_counter() - started
+
+        bulk_path, executor = database(directory, 'bulk', s3, existing)
+        loader = BulkLoader(executor, s3, STAGING_BUCKET, part_rows=PART_ROWS, statements=SQLITE_STATEMENTS)
+        started = time.perf_counter()
+        stats = loader.load(open_rows_at(s3, SOURCE_BUCKET, 'billing.csv', etag), RATES, 'billing.csv', etag)
+        bulk_seconds = time.perf_counter() - started
+        left = s3.list_objects_v2(Bucket=STAGING_BUCKET).get('KeyCount', 0)
+
+        expected, actual = table_rows(row_path), table_rows(bulk_path)
+    print(f"{ROWS + 3:,} rows, {len(existing):,} already in the table; staging files of {PART_ROWS:,} rows")
+    print(f"  row by row   {row_seconds:7.2f}s  {len(expected):,} rows in billing_data")
+    print(f"  bulk         {bulk_seconds:7.2f}s  {len(actual):,} rows in billing_data ({stats['inserted']:,} new, "
+          f"{stats['files']} staging files, {left} left in S3)")
+    if expected != actual:
+        mismatches = [pair for pair in zip(expected, actual) if pair[0] != pair[1]]
+        print(f"  MISMATCH: {len(mismatches)} differing rows, first {mismatches[:1]}")
+        sys.exit(1)
+    print("  identical table contents")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import boto3
+from moto import mock_aws
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+LOADER = os.path.join(BENCHMARKS, '..')
+sys.path.insert(0, LOADER)
+from loader_batches import DataApiBatchWriter, INSERT_SQL, chunk_parameter_sets, record_parameters
+from loader_executors import (ConnectionPool, PooledDbApiExecutor, SecretCache, mysql_connector, mysql_executor,
+                              positional_sql)
+
+ROWS = int(os.environ.get('ROWS', '20000'))
+SINGLE_ROWS = int(os.environ.get('SINGLE_ROWS', '500'))
+# Simulated network round trips. The SQLite stand-in has none, so each backend pays these per call: an HTTPS
+# request to the regional Data API endpoint, and a packet exchange with the cluster inside the VPC. Both are
+# assumptions; set them from your own measurements (DRIVER_RTT_MS is ignored against a real MySQL server)
+DATA_API_RTT_MS = float(os.environ.get('DATA_API_RTT_MS', '20'))
+DRIVER_RTT_MS = float(os.environ.get('DRIVER_RTT_MS', '0.5'))
+# Point these at a local MySQL to run both backends against it instead of SQLite
+MYSQL_HOST = os.environ.get('MYSQL_HOST')
+MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
+MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', '')
+MYSQL_DATABASE = os.environ.get('MYSQL_DATABASE', 'billing')
+REGION = 'us-west-2'
+RATES = {'USD': 1, 'CAD': 0.79, 'MXN': 0.05}
+CREATE_TABLE = open(os.path.join(LOADER, 'SQL', 'create_billing_data_table.sql')).read()
+
+def round_trip(milliseconds, count=1):
+    time.sleep(milliseconds * count / 1000)
+
+class RoundTripCursor:
+    """SQLite cursor that pays DRIVER_RTT_MS per statement sent, as a prepared MySQL cursor does per row"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, values):
+        round_trip(DRIVER_RTT_MS)
+        return self.cursor.execute(sql, values)
+
+    def executemany(self, sql, rows):
+        round_trip(DRIVER_RTT_MS, len(rows))
+        return self.cursor.executemany(sql, rows)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+class RoundTripConnection:
+    """SQLite connection with the round trips a networked one would make; connecting costs a TCP, TLS and auth
+    handshake"""
+
+    def __init__(self, path):
+        round_trip(DRIVER_RTT_MS, 4)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self):
+        return RoundTripCursor(self.connection.cursor())
+
+    def commit(self):
+        round_trip(DRIVER_RTT_MS)
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+class LocalDataApi:
+    """rds-data client stand-in: runs each call's SQL on the local database after one simulated HTTPS round trip.
+    Like the real service it holds one connection per open transaction, taken from connections it keeps open."""
+
+    def __init__(self, connect, placeholder):
+        self.connect = connect
+        self.placeholder = placeholder
+        self.transactions = {}
+        self.idle = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def checkout(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def checkin(self, connection):
+        with self.lock:
+            self.idle.append(connection)
+
+    def call(self):
+        with self.lock:
+            self.calls += 1
+        round_trip(DATA_API_RTT_MS)
+
+    def begin_transaction(self, **kwargs):
+        self.call()
+        connection = self.checkout()
+        transaction_id = str(next(self.ids))
+        with self.lock:
+            self.transactions[transaction_id] = connection
+        return {'transactionId': transaction_id}
+
+    def batch_execute_statement(self, sql, parameterSets, transactionId, **kwargs):
+        self.call()
+        sql, names = positional_sql(sql, self.placeholder)
+        rows = [tuple(dict((p['name'], next(iter(p['value'].values()))) for p in s)[n] for n in names)
+                for s in parameterSets]
+        self.transactions[transactionId].cursor().executemany(sql, rows)
+        return {'updateResults': [{} for _ in rows]}
+
+    def commit_transaction(self, transactionId, **kwargs):
+        self.call()
+        connection = self.transactions.pop(transactionId)
+        connection.commit()
+        self.checkin(connection)
+        return {'transactionStatus': 'Transaction Committed'}
+
+    def rollback_transaction(self, transactionId, **kwargs):
+        self.call()
+        connection = self.transactions.pop(transactionId)
+        connection.rollback()
+        self.checkin(connection)
+        return {'transactionStatus': 'Rollback Complete'}
+
+    def execute_statement(self, sql, parameters, **kwargs):
+        self.call()
+        sql, names = positional_sql(sql, self.placeholder)
+        values = dict((p['name'], next(iter(p['value'].values()))) for p in parameters)
+        connection = self.checkout()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, tuple(values[name] for name in names))
+            connection.commit()
+            return {'numberOfRecordsUpdated': cursor.rowcount}
+        finally:
+            self.checkin(connection)
+
+def billing_rows(count, first_id):
+    rng = random.Random(first_id)
+    for number in range(first_id, first_id + count):
+        currency = rng.choice(tuple(RATES))
+        yield [str(number), 'Winterday Foods', 'USA', 'Seattle', 'Meat', 'Steak', '2023-06-01', currency,
+               f'{rng.uniform(10, 5000):.2f}']
+
+def parameter_sets(count, first_id):
+    return [record_parameters(row, RATES) for row in billing_rows(count, first_id)]
+
+def sqlite_database(directory):
+    """A fresh SQLite file per backend; WAL lets readers and one writer work side by side like MySQL sessions"""
+    path = os.path.join(directory, f'billing_{len(os.listdir(directory))}.db')
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(CREATE_TABLE)
+    connection.close()
+    return (lambda: RoundTripConnection(path)), '?', INSERT_SQL.replace('INSERT IGNORE', 'INSERT OR IGNORE')
+
+def mysql_database():
+    """The local MySQL server, emptied first; the driver's own round trips replace the simulated ones"""
+    connection = mysql_connector.connect(host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD)
+    cursor = connection.cursor()
+    cursor.execute(f'CREATE DATABASE IF NOT EXISTS {MYSQL_DATABASE}')
+    cursor.execute(f'USE {MYSQL_DATABASE}')
+    cursor.execute(CREATE_TABLE)
+    cursor.execute('TRUNCATE TABLE billing_data')
+    connection.close()
+
+    def connect():
+        return mysql_connector.connect(host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                                       database=MYSQL_DATABASE, autocommit=False)
+
+    return connect, '%s', INSERT_SQL
+
+def data_api_backend(database):
+    connect, placeholder, sql = database
+    client = LocalDataApi(connect, placeholder)
+    return DataApiBatchWriter(client, 'arn:cluster', 'arn:secret', 'billing', sql=sql), lambda: client.calls
+
+def pooled_backend(database):
+    connect, placeholder, sql = database
+    secrets_client = boto3.client('secretsmanager')
+    secret_arn = secrets_client.create_secret(Name=f'billing-{time.monotonic_ns()}', SecretString=json.dumps({
+        'username': MYSQL_USER, 'password': MYSQL_PASSWORD, 'host': MYSQL_HOST or 'localhost', 'port': 3306
+    }))['ARN']
+    secrets = SecretCache(secrets_client, secret_arn)
+    if MYSQL_HOST:
+        executor = mysql_executor(secrets, MYSQL_HOST, MYSQL_DATABASE, sql=sql)
+    else:
+        # Same pool and executor; SQLite caches compiled statements per connection, standing in for the
+        # server-side prepared statements of a MySQL prepared cursor
+        def connect_with_secret():
+            secrets.get()
+            return connect()
+        executor = PooledDbApiExecutor(ConnectionPool(connect_with_secret), placeholder=placeholder,
+                                       transient=lambda error: isinstance(error, sqlite3.OperationalError), sql=sql)
+    return executor, lambda: executor.pool.opened
+
+def measure(executor, single_rows, bulk_rows):
+    """First statement (cold), then one row per statement, then chunked bulk inserts through write()"""
+    started = time.perf_counter()
+    executor.execute(executor.sql, single_rows[0])
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    for parameters in single_rows[1:]:
+        executor.execute(executor.sql, parameters)
+    single = (time.perf_counter() - started) / max(len(single_rows) - 1, 1)
+    started = time.perf_counter()
+    for chunk in chunk_parameter_sets(bulk_rows):
+        executor.write(chunk)
+    bulk = time.perf_counter() - started
+    return cold, single, bulk
+
+def main():
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    single_rows = parameter_sets(SINGLE_ROWS, 1)
+    bulk_rows = parameter_sets(ROWS, SINGLE_ROWS + 1)
+    target = f"MySQL at {MYSQL_HOST}" if MYSQL_HOST else (
+        f"SQLite stand-in, simulated RTT: Data API {DATA_API_RTT_MS:g} ms, driver {DRIVER_RTT_MS:g} ms")
+    print(f"{SINGLE_ROWS:,} single-row inserts, then {ROWS:,} rows in chunks; {target}")
+    print(f"  {'backend':<22}{'first statement':>16}{'per row (single)':>18}{'bulk time':>11}{'bulk rows/sec':>15}"
+          f"  round trips / connections")
+    with tempfile.TemporaryDirectory() as directory, mock_aws():
+        for name, backend, counter in (('Data API', data_api_backend, 'Data API calls'),
+                                       ('pooled DB-API', pooled_backend, 'connections opened')):
+            database = mysql_database() if MYSQL_HOST else sqlite_database(directory)
+            executor, count = backend(database)
+            cold, single, bulk = measure(executor, single_rows, bulk_rows)
+            print(f"  {name:<22}{cold * 1000:13.1f} ms{single * 1000:15.2f} ms{bulk:10.2f}s{ROWS / bulk:15,.0f}"
+                  f"  {count()} {counter}")
+
+if __name__ == '__main__':
+    main()
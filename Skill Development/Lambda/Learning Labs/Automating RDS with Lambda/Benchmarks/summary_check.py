@@ -0,0 +1,152 @@
+import csv
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import boto3
+from moto import mock_aws
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+# Reuses the SQLite stand-in of the bulk path, which also puts the loader and the shared layer on sys.path
+from bulk_load_check import CREATE_TABLE, LoadDataConnection, RATES, REGION, SQLITE_STATEMENTS
+from billing_generator import HEADER, generate_rows
+from loader_batches import INSERT_SQL
+from loader_checkpoints import checkpointed_chunks, open_rows_at
+from loader_concurrency import AimdLimiter
+from loader_executors import ConnectionPool, PooledDbApiExecutor
+from loader_pipeline import LoadPipeline
+from loader_staging import BulkLoader
+from loader_summaries import CHUNK_TABLE, summarized_writes, summary_statements
+
+ROWS = int(os.environ.get('ROWS', '50000'))
+WRITERS = int(os.environ.get('WRITERS', '4'))
+SOURCE_BUCKET = 'winterday-billing'
+STAGING_BUCKET = 'winterday-billing-staging'
+
+SQLITE_SUMMARY_TABLES = (
+    "CREATE TABLE billing_monthly_summary (company_name TEXT, country TEXT, bill_month TEXT, "
+    "row_count INTEGER NOT NULL, total_usd REAL NOT NULL, PRIMARY KEY (company_name, country, bill_month))",
+    "CREATE TABLE billing_currency_summary (company_name TEXT, country TEXT, bill_month TEXT, currency TEXT, "
+    "row_count INTEGER NOT NULL, total_amount REAL NOT NULL, total_usd REAL NOT NULL, "
+    "PRIMARY KEY (company_name, country, bill_month, currency))",
+)
+# loader_summaries' upserts in SQLite's dialect: strftime for the month, ON CONFLICT ... excluded for the upsert
+SQLITE_SUMMARY_UPSERTS = (
+    "INSERT INTO billing_monthly_summary (company_name, country, bill_month, row_count, total_usd) "
+    "SELECT s.company_name, s.country, strftime('%Y-%m', s.bill_date), COUNT(*), SUM(s.bill_amount_usd) "
+    "FROM {source} s "
+    "WHERE NOT EXISTS (SELECT 1 FROM billing_data b WHERE b.id = s.id AND b.bill_date = s.bill_date) "
+    "GROUP BY 1, 2, 3 ORDER BY 1, 2, 3 "
+    "ON CONFLICT (company_name, country, bill_month) DO UPDATE SET "
+    "row_count = row_count + excluded.row_count, total_usd = total_usd + excluded.total_usd",
+
+    "INSERT INTO billing_currency_summary "
+    "(company_name, country, bill_month, currency, row_count, total_amount, total_usd) "
+    "SELECT s.company_name, s.country, strftime('%Y-%m', s.bill_date), s.currency, COUNT(*), SUM(s.bill_amount), "
+    "SUM(s.bill_amount_usd) FROM {source} s "
+    "WHERE NOT EXISTS (SELECT 1 FROM billing_data b WHERE b.id = s.id AND b.bill_date = s.bill_date) "
+    "GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4 "
+    "ON CONFLICT (company_name, country, bill_month, currency) DO UPDATE SET "
+    "row_count = row_count + excluded.row_count, total_amount = total_amount + excluded.total_amount, "
+    "total_usd = total_usd + excluded.total_usd",
+)
+SQLITE_CHUNK_STATEMENTS = {
+    'create': CREATE_TABLE.replace('billing_data', f'temp.{CHUNK_TABLE}'),
+    'clear': f"DELETE FROM {CHUNK_TABLE}",
+    'insert': INSERT_SQL.replace('INSERT IGNORE INTO billing_data', f'INSERT OR IGNORE INTO {CHUNK_TABLE}'),
+    'merge': f"INSERT OR IGNORE INTO billing_data SELECT * FROM {CHUNK_TABLE}",
+    'drop': f"DROP TABLE IF EXISTS temp.{CHUNK_TABLE}"
+}
+
+# Recomputed from the fact table, the way reports did it before; amounts rounded because SQLite sums doubles
+RECOMPUTED = {
+    'billing_monthly_summary': (
+        "SELECT company_name, country, strftime('%Y-%m', bill_date), COUNT(*), ROUND(SUM(bill_amount_usd), 2) "
+        "FROM billing_data GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"),
+    'billing_currency_summary': (
+        "SELECT company_name, country, strftime('%Y-%m', bill_date), currency, COUNT(*), "
+        "ROUND(SUM(bill_amount), 2), ROUND(SUM(bill_amount_usd), 2) FROM billing_data GROUP BY 1, 2, 3, 4 "
+        "ORDER BY 1, 2, 3, 4"),
+}
+MAINTAINED = {
+    'billing_monthly_summary': (
+        "SELECT company_name, country, bill_month, row_count, ROUND(total_usd, 2) FROM billing_monthly_summary "
+        "ORDER BY 1, 2, 3"),
+    'billing_currency_summary': (
+        "SELECT company_name, country, bill_month, currency, row_count, ROUND(total_amount, 2), ROUND(total_usd, 2) "
+        "FROM billing_currency_summary ORDER BY 1, 2, 3, 4"),
+}
+REPORT = "SELECT bill_month, SUM(row_count), SUM(total_usd) FROM billing_monthly_summary " \
+         "WHERE company_name = 'The Beef Baron' GROUP BY bill_month"
+REPORT_FROM_SCAN = "SELECT strftime('%Y-%m', bill_date), COUNT(*), SUM(bill_amount_usd) FROM billing_data " \
+                   "WHERE company_name = 'The Beef Baron' GROUP BY 1"
+
+def upload(s3, key, rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=output.getvalue().encode('utf-8'))
+    return s3.head_object(Bucket=SOURCE_BUCKET, Key=key)['ETag']
+
+def load_batched(executor, s3, key, etag):
+    """The handler's batched path: pipelined chunks, each upserting its new rows' summaries before its merge"""
+    pipeline = LoadPipeline(lambda item: executor.write(item[1], limiter=limiter), WRITERS)
+    limiter = AimdLimiter(maximum=WRITERS)
+    return pipeline.run(checkpointed_chunks(open_rows_at(s3, SOURCE_BUCKET, key, etag), RATES))['rows']
+
+def timed(connection, sql, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        connection.execute(sql).fetchall()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    os.environ['AWS_DEFAULT_REGION'] = REGION
+    with tempfile.TemporaryDirectory() as directory, mock_aws():
+        s3 = boto3.client('s3')
+        for bucket in (SOURCE_BUCKET, STAGING_BUCKET):
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+        path = os.path.join(directory, 'billing.db')
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        for statement in (CREATE_TABLE,) + SQLITE_SUMMARY_TABLES:
+            connection.execute(statement)
+        connection.commit()
+
+        pool = ConnectionPool(lambda: LoadDataConnection(path, s3), WRITERS)
+        executor = PooledDbApiExecutor(pool, placeholder='?', **summarized_writes(SQLITE_SUMMARY_UPSERTS,
+                                                                                    SQLITE_CHUNK_STATEMENTS),
+                                       transient=lambda error: isinstance(error, sqlite3.OperationalError))
+        # Repeated keys inside the file, the same file twice, and a bulk file overlapping half of it
+        first = list(generate_rows(ROWS, seed=11, error_kinds=('duplicate_id',), error_rate=0.02))
+        second = list(generate_rows(ROWS, seed=11, first_id=ROWS // 2 + 1))
+        etag = upload(s3, 'first.csv', first)
+        loaded = load_batched(executor, s3, 'first.csv', etag)
+        loaded += load_batched(executor, s3, 'first.csv', etag)
+        bulk = BulkLoader(executor, s3, STAGING_BUCKET, part_rows=ROWS // 4, statements=SQLITE_STATEMENTS,
+                          summaries=summary_statements('billing_data_staging', SQLITE_SUMMARY_UPSERTS))
+        etag = upload(s3, 'second.csv', second)
+        loaded += bulk.load(open_rows_at(s3, SOURCE_BUCKET, 'second.csv', etag), RATES, 'second.csv', etag)['rows']
+
+        facts = connection.execute("SELECT COUNT(*) FROM billing_data").fetchone()[0]
+        print(f"{loaded:,} rows loaded ({WRITERS} writers, then bulk), {facts:,} distinct rows in billing_data")
+        failed = False
+        for table in RECOMPUTED:
+            expected = connection.execute(RECOMPUTED[table]).fetchall()
+            actual = connection.execute(MAINTAINED[table]).fetchall()
+            print(f"  {table:<26} {len(actual):>5} rows  {'matches' if actual == expected else 'DIFFERS FROM'} "
+                  f"a full recompute")
+            failed = failed or actual != expected
+        print(f"  one company's monthly totals: {timed(connection, REPORT):.2f} ms from the summary, "
+              f"{timed(connection, REPORT_FROM_SCAN):.2f} ms scanning billing_data")
+        connection.close()
+        pool.close()
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+-- Report queries answered from the summary tables alone, which hold one row per company, country and month
+-- (and currency) however many billing rows there are. billing_data is never read.
+
+-- One company's monthly totals in USD
+SELECT bill_month, SUM(row_count) AS bills, SUM(total_usd) AS total_usd
+FROM billing_monthly_summary
+WHERE company_name = 'The Beef Baron'
+GROUP BY bill_month
+ORDER BY bill_month;
+
+-- Totals per country for one month
+SELECT country, SUM(row_count) AS bills, SUM(total_usd) AS total_usd
+FROM billing_monthly_summary
+WHERE bill_month = '2023-06'
+GROUP BY country;
+
+-- Per-currency totals, in the billed currency and in USD, for one company and month
+SELECT currency, row_count, total_amount, total_usd
+FROM billing_currency_summary
+WHERE company_name = 'The Beef Baron' AND country = 'US' AND bill_month = '2023-06';
@@ -0,0 +1,32 @@
+-- Totals per company, country and month, kept up to date by the loader as chunks commit.
+-- bill_month is 'YYYY-MM' in ASCII, which keeps the four-column key within InnoDB's 3072-byte limit.
+CREATE TABLE IF NOT EXISTS billing_monthly_summary (
+    company_name VARCHAR(255),
+    country VARCHAR(255),
+    bill_month CHAR(7) CHARACTER SET ascii,
+    row_count BIGINT NOT NULL,
+    total_usd DECIMAL(20, 2) NOT NULL,
+	PRIMARY KEY (company_name, country, bill_month)
+);
+
+CREATE TABLE IF NOT EXISTS billing_currency_summary (
+    company_name VARCHAR(255),
+    country VARCHAR(255),
+    bill_month CHAR(7) CHARACTER SET ascii,
+    currency VARCHAR(255),
+    row_count BIGINT NOT NULL,
+    total_amount DECIMAL(20, 2) NOT NULL,
+    total_usd DECIMAL(20, 2) NOT NULL,
+	PRIMARY KEY (company_name, country, bill_month, currency)
+);
+
+-- One-off backfill from the rows loaded before the summaries existed; run it with the loader stopped
+INSERT INTO billing_monthly_summary (company_name, country, bill_month, row_count, total_usd)
+SELECT company_name, country, DATE_FORMAT(bill_date, '%Y-%m'), COUNT(*), SUM(bill_amount_usd)
+FROM billing_data
+GROUP BY company_name, country, DATE_FORMAT(bill_date, '%Y-%m');
+
+INSERT INTO billing_currency_summary (company_name, country, bill_month, currency, row_count, total_amount, total_usd)
+SELECT company_name, country, DATE_FORMAT(bill_date, '%Y-%m'), currency, COUNT(*), SUM(bill_amount), SUM(bill_amount_usd)
+FROM billing_data
+GROUP BY company_name, country, DATE_FORMAT(bill_date, '%Y-%m'), currency;
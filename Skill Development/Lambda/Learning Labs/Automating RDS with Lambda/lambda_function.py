@@ -1,7 +1,15 @@
+import os
 import boto3
-import io
-import csv
 import logging
+from functools import partial
+from loader_batches import INSERT_SQL, record_parameters
+from loader_checkpoints import Checkpointer, checkpoint_store_from_env, checkpointed_chunks, open_rows_at
+from loader_concurrency import AimdLimiter
+from loader_executors import executor_from_env
+from loader_metrics import LoadMetrics, log_sampled
+from loader_pipeline import LoadPipeline
+from loader_staging import bulk_loader_from_env
+from loader_summaries import summaries_enabled, summarized_writes, summary_statements
 
 # Constants - database and credentials details, and currency conversion rates
 currency_conversion_to_usd = {'USD': 1, 'CAD': 0.79, 'MXN': 0.05}
@@ -13,86 +21,124 @@ db_cluster_arn = 'arn:aws:rds:us-west-2:522814732220:cluster:winter-cluster'
 s3_client = boto3.client('s3')
 rds_client = boto3.client('rds-data')
 
+# Insert threads, and chunks parsed ahead of them; the reader waits whenever that many chunks are queued.
+# How many of the writers actually run at once is set adaptively (AIMD) from chunk latency and throttling
+max_writers = int(os.environ.get('MAX_WRITERS', '16'))
+queued_chunks = int(os.environ.get('QUEUED_CHUNKS', '4'))
+
+# Rows are written in chunks, every chunk in its own transaction: one BatchExecuteStatement each through the
+# Data API (default), or one prepared executemany each over pooled MySQL connections (SQL_BACKEND=mysql).
+# Created at module scope, so pooled connections and cached credentials survive warm invocations.
+# With MAINTAIN_SUMMARIES=true, each chunk also adds its new rows to the summary tables in that transaction
+maintain_summaries = summaries_enabled()
+executor = executor_from_env(rds_client, db_cluster_arn, secret_store_arn, database_name, pool_size=max_writers,
+                             **(summarized_writes() if maintain_summaries else {}))
+
+# LOAD_MODE: 'batched' chunks of INSERTs (default), 'bulk' staging files loaded with LOAD DATA FROM S3 and
+# merged (needs STAGING_BUCKET), or 'auto' for bulk at BULK_MIN_BYTES and above
+load_mode = os.environ.get('LOAD_MODE', 'batched')
+bulk_min_bytes = int(os.environ.get('BULK_MIN_BYTES', str(256 * 1024 * 1024)))
+bulk_loader = bulk_loader_from_env(
+    executor, s3_client, summary_statements('billing_data_staging') if maintain_summaries else ()
+)
+
+# Committed byte offset per object and ETag, so a retry after a timeout resumes where the last attempt stopped
+checkpoint_store = checkpoint_store_from_env()
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Function to process each record/row from the CSV file
+# Function to process a single record/row from the CSV file (the batched path in lambda_handler is the default)
 def process_record(record):
-    id, company_name, country, city, product_line, item, bill_date, currency, bill_amount = record
-    bill_amount = float(bill_amount)
-    
-    # Convert the bill amount to USD using conversion rates
-    usd_amount = 0  # Fixed: typo 'usd_ammount'
-    rate = currency_conversion_to_usd.get(currency)
+    # Prepare parameters for the SQL statement, with the bill amount converted to USD
+    sql_parameters = record_parameters(record, currency_conversion_to_usd)
     
-    if rate:
-        usd_amount = bill_amount * rate
-    else:
-        # If no conversion rate is found for the currency, log an info message
-        logger.info(f"No rate found for currency: {currency}.")
-    
-    # Prepare SQL statement with placeholders for inserting record into the database
-    sql_statement = ("INSERT IGNORE INTO billing_data "
-                    "(id, company_name, country, city, product_line, "
-                    "item, bill_date, currency, bill_amount, bill_amount_usd) "
-                    "VALUES (:id, :company_name, :country, :city, :product_line, "
-                    ":item, :bill_date, :currency, :bill_amount, :usd_amount)")
-    
-    # Prepare parameters for SQL statement
-    sql_parameters = [
-        {'name': 'id', 'value': {'stringValue': id}},
-        {'name': 'company_name', 'value': {'stringValue': company_name}},
-        {'name': 'country', 'value': {'stringValue': country}},
-        {'name': 'city', 'value': {'stringValue': city}},
-        {'name': 'product_line', 'value': {'stringValue': product_line}},
-        {'name': 'item', 'value': {'stringValue': item}},
-        {'name': 'bill_date', 'value': {'stringValue': bill_date}},
-        {'name': 'currency', 'value': {'stringValue': currency}},
-        {'name': 'bill_amount', 'value': {'doubleValue': bill_amount}},
-        {'name': 'usd_amount', 'value': {'doubleValue': usd_amount}},
-    ]
-    
-    # Execute the SQL statement and log the response
-    response = execute_statement(sql_statement, sql_parameters)
-    logger.info(f"SQL execution response: {response}") 
+    # Execute the SQL statement; only a DEBUG_SAMPLE_RATE sample of the responses is logged
+    response = execute_statement(INSERT_SQL, sql_parameters)
+    log_sampled(f"SQL execution response: {response}")
 
 # Function to execute SQL statement
 def execute_statement(sql, sql_parameters):
     try:
-        response = rds_client.execute_statement(
-            secretArn=secret_store_arn,
-            database=database_name,
-            resourceArn=db_cluster_arn,
-            sql=sql,
-            parameters=sql_parameters
-        )
+        response = executor.execute(sql, sql_parameters)
     except Exception as e:
         logger.error("ERROR: Could not connect to Aurora Serverless MySQL instance.")
         return None
     
     return response
 
+# Function to write one chunk from the pipeline and record it as committed
+def write_chunk(item, limiter, checkpointer, metrics):
+    sequence, chunk, end_offset, end_row = item
+    rows = executor.write(chunk, limiter=limiter, metrics=metrics)
+    checkpointer.committed(sequence, end_offset, end_row)
+    return rows
+
 def lambda_handler(event, context):
     try:
         # Get the bucket name and file name from the event
         bucket_name = event['Records'][0]['s3']['bucket']['name']
         s3_file = event['Records'][0]['s3']['object']['key']
         
-        # Read the file from S3
-        response = s3_client.get_object(Bucket=bucket_name, Key=s3_file)
-        data = response['Body'].read().decode('utf-8')
-        
-        # Use csv reader to process the CSV data
-        csv_reader = csv.reader(io.StringIO(data))
-        next(csv_reader)
-        
-        # Process each record in the CSV file
-        for record in csv_reader:
-            process_record(record)
-        
-        logger.info("Lambda has finished execution.")
-        
+        # Resume from the last committed offset if an earlier attempt stopped partway through these same bytes
+        head = s3_client.head_object(Bucket=bucket_name, Key=s3_file)
+        etag = head['ETag']
+        checkpoint = checkpoint_store.get(bucket_name, s3_file, etag)
+        if checkpoint and checkpoint['complete']:
+            logger.info(f"'{s3_file}' (ETag {etag}) is already loaded.")
+            return
+        offset, rows_done = (checkpoint['offset'], checkpoint['rows']) if checkpoint else (0, 0)
+        if offset:
+            logger.info(f"Resuming '{s3_file}' after {rows_done} committed records (byte {offset}).")
+
+        # Stream the file from S3 row by row from that offset (past the header on a fresh load). Gzip and zstd
+        # files are decompressed on the fly; billing_streams comes from the Billing Shared Layer
+        csv_rows = open_rows_at(s3_client, bucket_name, s3_file, etag, offset, head.get('ContentEncoding'))
+
+        # Very large files go through a staging table instead: one transaction, so the checkpoint only
+        # records that the file is done
+        bulk = load_mode == 'bulk' or (load_mode == 'auto' and head['ContentLength'] >= bulk_min_bytes)
+
+        # Rows, inserts, unknown currencies and chunk latencies are counted for the whole file and written once,
+        # as one CloudWatch metrics (EMF) record, whether the load finishes or fails
+        metrics = LoadMetrics('bulk' if bulk else 'batched')
+        summary = {'bucket': bucket_name, 'key': s3_file, 'etag': etag, 'resumed_from_row': rows_done,
+                   'status': 'failed'}
+        try:
+            if bulk:
+                if bulk_loader is None:
+                    raise ValueError(f"LOAD_MODE={load_mode} needs STAGING_BUCKET for the staging files")
+                stats = bulk_loader.load(csv_rows, currency_conversion_to_usd, s3_file, etag, metrics)
+                checkpoint_store.put(bucket_name, s3_file, etag, head['ContentLength'], rows_done + stats['rows'],
+                                     complete=True)
+                summary.update(status='complete', staging_files=stats['files'])
+                logger.info(f"Bulk loaded {stats['rows']} records from '{s3_file}' ({stats['inserted']} new).")
+                logger.info("Lambda has finished execution.")
+                return
+
+            # Insert the records in chunks sized to the Data API request limit: one round trip per chunk
+            # instead of one per row. Chunks are parsed while earlier ones are being written, through a
+            # bounded queue; a chunk that still fails after its retries stops the load
+            checkpointer = Checkpointer(checkpoint_store, bucket_name, s3_file, etag, offset, rows_done)
+            limiter = AimdLimiter(maximum=max_writers)
+            pipeline = LoadPipeline(partial(write_chunk, limiter=limiter, checkpointer=checkpointer, metrics=metrics),
+                                    max_writers, queued_chunks)
+            try:
+                stats = pipeline.run(checkpointed_chunks(csv_rows, currency_conversion_to_usd, rows_done, metrics))
+            finally:
+                summary['concurrency'] = limiter.summary()
+            checkpointer.complete()
+            summary.update(status='complete', reader_wait_seconds=round(stats['reader_wait_seconds'], 3))
+
+            logger.info(f"Loaded {stats['rows']} records from '{s3_file}' in {stats['chunks']} batches "
+                        f"in {stats['elapsed_seconds']:.2f}s; the reader waited {stats['reader_wait_seconds']:.2f}s "
+                        f"on the writers.")
+            logger.info("Lambda has finished execution.")
+        finally:
+            metrics.emit(**summary)
+
     except Exception as e:
-        # If an unexpected error occurs, log an error message
-        logger.error(f"ERROR: unexpected error: {e}")
\ No newline at end of file
+        # Log the error and fail the invocation, so Lambda's asynchronous retry resumes from the checkpoint
+        logger.error(f"ERROR: unexpected error: {e}")
+        raise
\ No newline at end of file
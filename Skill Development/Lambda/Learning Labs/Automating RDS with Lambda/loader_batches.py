@@ -0,0 +1,191 @@
+import logging
+import random
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger()
+
+# Same statement the per-row path used; INSERT IGNORE keeps a retried chunk from failing on rows it already wrote
+INSERT_SQL = ("INSERT IGNORE INTO billing_data "
+              "(id, company_name, country, city, product_line, "
+              "item, bill_date, currency, bill_amount, bill_amount_usd) "
+              "VALUES (:id, :company_name, :country, :city, :product_line, "
+              ":item, :bill_date, :currency, :bill_amount, :usd_amount)")
+
+STRING_COLUMNS = ('id', 'company_name', 'country', 'city', 'product_line', 'item', 'bill_date', 'currency')
+
+# The Data API rejects requests over 4 MiB, headers and JSON included; chunks are cut well below that
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+CHUNK_BYTES = MAX_REQUEST_BYTES * 3 // 4
+# A row count cap as well, so one chunk's statement stays far inside the Data API's 45 second timeout
+CHUNK_ROWS = 1000
+# JSON around one parameter set's values: names, type keys, braces and quotes (values are counted separately)
+PARAMETER_SET_OVERHEAD_BYTES = 560
+
+# Errors worth another attempt: throttling, a cold or resuming cluster, and transient service failures
+RETRYABLE_ERRORS = {
+    'ThrottlingException', 'ServiceUnavailableError', 'InternalServerErrorException',
+    'StatementTimeoutException', 'DatabaseResumingException', 'DatabaseUnavailableException',
+    'TooManyRequestsException'
+}
+# The Data API reports MySQL deadlocks and lock wait timeouts as a BadRequestException; they are worth a retry too
+RETRYABLE_MESSAGES = ('Deadlock found', 'Lock wait timeout exceeded')
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 10
+
+def record_parameters(record, rates, metrics=None):
+    """Convert one CSV row into the named parameters of INSERT_SQL, with the amount converted to USD.
+    Rows in a currency without a rate are counted on metrics (loader_metrics.LoadMetrics) when given"""
+    id, company_name, country, city, product_line, item, bill_date, currency, bill_amount = record
+    bill_amount = float(bill_amount)
+
+    # Convert the bill amount to USD using conversion rates
+    usd_amount = 0
+    rate = rates.get(currency)
+    if rate:
+        usd_amount = bill_amount * rate
+    elif metrics is not None:
+        metrics.unknown_currency(currency, record)
+    else:
+        logger.debug(f"No rate found for currency: {currency}.")
+
+    values = (id, company_name, country, city, product_line, item, bill_date, currency)
+    return [{'name': name, 'value': {'stringValue': value}} for name, value in zip(STRING_COLUMNS, values)] + [
+        {'name': 'bill_amount', 'value': {'doubleValue': bill_amount}},
+        {'name': 'usd_amount', 'value': {'doubleValue': usd_amount}},
+    ]
+
+def parameter_set_bytes(parameters):
+    """Estimated JSON size of one parameter set, without serializing it"""
+    size = PARAMETER_SET_OVERHEAD_BYTES
+    for parameter in parameters:
+        value = parameter['value'].get('stringValue', '')
+        # Non-ASCII text is sent as \uXXXX escapes, so count it at 6 bytes per character
+        size += len(value) if value.isascii() else 6 * len(value)
+    return size
+
+def chunk_parameter_sets(parameter_sets, max_bytes=CHUNK_BYTES, max_rows=CHUNK_ROWS):
+    """Group parameter sets into lists that fit one BatchExecuteStatement request"""
+    chunk, size = [], 0
+    for parameters in parameter_sets:
+        row_bytes = parameter_set_bytes(parameters)
+        if chunk and (size + row_bytes > max_bytes or len(chunk) >= max_rows):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(parameters)
+        size += row_bytes
+    if chunk:
+        yield chunk
+
+def error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code', type(error).__name__)
+
+class ChunkWriter:
+    """Retry loop shared by the SQL executors; a backend supplies write_once (one atomic chunk) and retryable.
+    Parameterless before and after statements run in each chunk's transaction around its batch insert"""
+
+    def __init__(self, sql=INSERT_SQL, max_attempts=MAX_ATTEMPTS, before=(), after=(), inserted_by=None):
+        self.sql = sql
+        self.max_attempts = max_attempts
+        self.before = before
+        self.after = after
+        # Index in after of the statement whose affected-row count is the number of rows the chunk added;
+        # None counts the batch insert itself, where the backend can
+        self.inserted_by = inserted_by
+
+    def retryable(self, error):
+        code = error_code(error)
+        if code in RETRYABLE_ERRORS:
+            return True
+        return code == 'BadRequestException' and any(message in str(error) for message in RETRYABLE_MESSAGES)
+
+    def write(self, chunk, limiter=None, metrics=None):
+        """Insert one chunk atomically; retry it with jittered backoff on transient errors, raise on anything else.
+        With a limiter, every attempt waits for a concurrency slot and reports its latency and outcome; with
+        metrics (loader_metrics.LoadMetrics), every attempt's DB latency and the rows it inserted are recorded"""
+        for attempt in range(1, self.max_attempts + 1):
+            latency = 0.0
+            try:
+                with limiter.slot(len(chunk)) if limiter is not None else nullcontext():
+                    started = time.perf_counter()
+                    try:
+                        inserted = self.write_once(chunk)
+                    finally:
+                        latency = time.perf_counter() - started
+                if metrics is not None:
+                    metrics.chunk(len(chunk), inserted, latency)
+                return len(chunk)
+            except Exception as e:
+                code = error_code(e)
+                if metrics is not None:
+                    metrics.failed_attempt(latency, code)
+                if not self.retryable(e) or attempt == self.max_attempts:
+                    logger.error(f"ERROR: chunk of {len(chunk)} rows failed after {attempt} attempts: {code}.")
+                    raise
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+                logger.info(f"Retrying chunk of {len(chunk)} rows in {delay:.1f}s after {code}.")
+                time.sleep(delay)
+
+    def write_once(self, chunk):
+        """Insert the chunk in one transaction; return how many rows it added, or None if that is unknown"""
+        raise NotImplementedError
+
+class DataApiBatchWriter(ChunkWriter):
+    """Insert chunks of rows with one BatchExecuteStatement each, inside a transaction, retrying failed chunks"""
+
+    def __init__(self, rds_client, resource_arn, secret_arn, database, sql=INSERT_SQL, max_attempts=MAX_ATTEMPTS,
+                 before=(), after=(), inserted_by=None):
+        super().__init__(sql, max_attempts, before, after, inserted_by)
+        self.rds_client = rds_client
+        self.connection = {'resourceArn': resource_arn, 'secretArn': secret_arn, 'database': database}
+
+    def execute(self, sql, parameters):
+        """Run one statement with ExecuteStatement (auto-commit) and return the Data API response"""
+        return self.rds_client.execute_statement(**self.connection, sql=sql, parameters=parameters)
+
+    def transaction(self, statements):
+        """Run parameterless statements in order inside one transaction (one session, so temporary tables
+        last until the commit); return each statement's affected row count"""
+        transaction_id = self.rds_client.begin_transaction(**self.connection)['transactionId']
+        try:
+            counts = [self.rds_client.execute_statement(**self.connection, sql=sql, transactionId=transaction_id)
+                      .get('numberOfRecordsUpdated', 0) for sql in statements]
+            self.rds_client.commit_transaction(
+                resourceArn=self.connection['resourceArn'], secretArn=self.connection['secretArn'],
+                transactionId=transaction_id
+            )
+        except Exception:
+            self.rollback(transaction_id)
+            raise
+        return counts
+
+    def write_once(self, chunk):
+        transaction_id = self.rds_client.begin_transaction(**self.connection)['transactionId']
+        try:
+            for sql in self.before:
+                self.rds_client.execute_statement(**self.connection, sql=sql, transactionId=transaction_id)
+            self.rds_client.batch_execute_statement(
+                **self.connection, sql=self.sql, parameterSets=chunk, transactionId=transaction_id
+            )
+            counts = [self.rds_client.execute_statement(**self.connection, sql=sql, transactionId=transaction_id)
+                      .get('numberOfRecordsUpdated', 0) for sql in self.after]
+            self.rds_client.commit_transaction(
+                resourceArn=self.connection['resourceArn'], secretArn=self.connection['secretArn'],
+                transactionId=transaction_id
+            )
+        except Exception:
+            # Nothing from a failed chunk is kept, so the retry starts from a clean slate
+            self.rollback(transaction_id)
+            raise
+        # BatchExecuteStatement reports no row counts, so only an after statement can say what was inserted
+        return counts[self.inserted_by] if self.inserted_by is not None else None
+
+    def rollback(self, transaction_id):
+        try:
+            self.rds_client.rollback_transaction(
+                resourceArn=self.connection['resourceArn'], secretArn=self.connection['secretArn'],
+                transactionId=transaction_id
+            )
+        except Exception as e:
+            logger.error(f"ERROR: could not roll back transaction {transaction_id}: {e}")
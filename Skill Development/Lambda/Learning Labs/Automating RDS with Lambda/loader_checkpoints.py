@@ -0,0 +1,155 @@
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+import boto3
+from billing_streams import STREAM_CHUNK_SIZE, compression_of, decompressed
+from loader_batches import chunk_parameter_sets, record_parameters
+
+logger = logging.getLogger()
+
+# Checkpoints expire after this long so the table never grows without bound (DynamoDB TTL attribute)
+CHECKPOINT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+class DynamoCheckpointStore:
+    """Load progress in a DynamoDB table keyed by 'bucket/key', valid only for the stored ETag"""
+
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+
+    def get(self, bucket, key, etag):
+        item = self.table.get_item(Key={'object': f'{bucket}/{key}'}, ConsistentRead=True).get('Item')
+        if item is None or item['etag'] != etag:
+            return None
+        # DynamoDB hands numbers back as Decimal
+        return {'offset': int(item['offset']), 'rows': int(item['rows']), 'complete': item['complete']}
+
+    def put(self, bucket, key, etag, offset, rows, complete=False):
+        self.table.put_item(Item={
+            'object': f'{bucket}/{key}',
+            'etag': etag,
+            'offset': offset,
+            'rows': rows,
+            'complete': complete,
+            'expires_at': int(time.time()) + CHECKPOINT_TTL_SECONDS
+        })
+
+class MemoryCheckpointStore:
+    """Local stand-in for the checkpoint table; lost when the execution environment is recycled"""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, bucket, key, etag):
+        with self.lock:
+            item = self.items.get((bucket, key))
+        if item is None or item['etag'] != etag:
+            return None
+        return item
+
+    def put(self, bucket, key, etag, offset, rows, complete=False):
+        with self.lock:
+            self.items[(bucket, key)] = {'etag': etag, 'offset': offset, 'rows': rows, 'complete': complete}
+
+def checkpoint_store_from_env():
+    """Use the DynamoDB table named by CHECKPOINT_TABLE, or the in-memory stand-in when it is unset"""
+    table_name = os.environ.get('CHECKPOINT_TABLE')
+    return DynamoCheckpointStore(table_name) if table_name else MemoryCheckpointStore()
+
+def open_rows_at(s3_client, bucket, key, etag, offset=0, content_encoding=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream (row, end_offset) pairs from a byte offset into the file's CSV text; offset 0 skips the header.
+
+    A plain file is read from the offset with a ranged GET. A compressed one has to be decompressed from the
+    start, but the bytes before the offset are discarded unparsed. IfMatch makes S3 refuse a changed object,
+    so an offset is never applied to different bytes than it was taken from.
+    """
+    compression = compression_of(key, content_encoding)
+    request = {'Bucket': bucket, 'Key': key, 'IfMatch': etag}
+    if offset and compression is None:
+        request['Range'] = f'bytes={offset}-'
+    try:
+        body = s3_client.get_object(**request)['Body']
+    except s3_client.exceptions.ClientError as e:
+        # Every byte was committed before the previous attempt could mark the load complete
+        if e.response['Error']['Code'] == 'InvalidRange':
+            return iter(())
+        raise
+    binary = io.BufferedReader(decompressed(body, compression), buffer_size=chunk_size)
+    if offset and compression is not None:
+        remaining = offset
+        while remaining:
+            skipped = len(binary.read(min(remaining, chunk_size)))
+            if not skipped:
+                break
+            remaining -= skipped
+    if not offset:
+        offset = len(binary.readline())
+    return tracked_rows(binary, offset)
+
+def tracked_rows(binary, offset):
+    """csv.reader over the stream's lines, counting the bytes behind each row (quoted line breaks included)"""
+    position = offset
+
+    def lines():
+        nonlocal position
+        for line in binary:
+            position += len(line)
+            yield line.decode('utf-8')
+
+    for row in csv.reader(lines(), delimiter=','):
+        yield row, position
+
+def checkpointed_chunks(rows, rates, start_row=0, metrics=None):
+    """Chunk (row, end_offset) pairs for the pipeline as (sequence, chunk, end_offset, end_row) items"""
+    offsets = deque()
+
+    def parameter_sets():
+        for record, offset in rows:
+            offsets.append(offset)
+            yield record_parameters(record, rates, metrics)
+
+    end_row = start_row
+    for sequence, chunk in enumerate(chunk_parameter_sets(parameter_sets())):
+        # The chunker has pulled exactly this chunk's rows (plus, maybe, the first row of the next one)
+        for _ in range(len(chunk) - 1):
+            offsets.popleft()
+        end_row += len(chunk)
+        yield sequence, chunk, offsets.popleft(), end_row
+
+class Checkpointer:
+    """Persist the end of the longest run of committed chunks after every commit
+
+    Writers commit chunks out of order, so the checkpoint only moves past a chunk once every chunk before it
+    has committed too; anything after the checkpoint is sent again on a retry, which INSERT IGNORE absorbs.
+    """
+
+    def __init__(self, store, bucket, key, etag, offset=0, rows=0):
+        self.store = store
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
+        self.offset = offset
+        self.rows = rows
+        self.next_sequence = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def committed(self, sequence, offset, rows):
+        with self.lock:
+            self.pending[sequence] = (offset, rows)
+            advanced = False
+            while self.next_sequence in self.pending:
+                self.offset, self.rows = self.pending.pop(self.next_sequence)
+                self.next_sequence += 1
+                advanced = True
+            if advanced:
+                self.store.put(self.bucket, self.key, self.etag, self.offset, self.rows)
+
+    def complete(self):
+        """Mark the object fully loaded, so another invocation for the same ETag does nothing"""
+        with self.lock:
+            self.store.put(self.bucket, self.key, self.etag, self.offset, self.rows, complete=True)
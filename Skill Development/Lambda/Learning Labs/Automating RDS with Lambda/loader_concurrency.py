@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Writers start cautiously and may grow to one per ACU at the cluster's 16 ACU ceiling (Basics/RDS.py)
+INITIAL_LIMIT = 2
+MIN_LIMIT = 1
+MAX_LIMIT = 16
+
+# A chunk is "fast" while its per-row latency stays within this factor of the best seen recently
+LATENCY_TOLERANCE = 2.0
+# The best latency is forgotten slowly, so a cluster that scaled down sets a new, slower baseline
+BASELINE_DRIFT = 0.02
+# Multiplicative decrease on throttling, errors or slow chunks
+BACKOFF_FACTOR = 0.5
+
+class AimdLimiter:
+    """Additive-increase / multiplicative-decrease limit on concurrent chunk writes
+
+    Each fast chunk raises the limit by 1/limit (about +1 per round of writes); a throttle, an error or a chunk
+    far slower than the baseline halves it, at most once per chunk latency so one burst of failures counts once.
+    Throughput therefore follows whatever capacity the Serverless cluster has right now.
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=MAX_LIMIT):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        self.latencies = []
+        self.peak_limit = self.limit
+        self.decreases = 0
+
+    @contextmanager
+    def slot(self, rows):
+        """Hold one of the allowed concurrent writes while the body runs, then adjust the limit by the outcome"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.release(time.perf_counter() - started, rows, ok=False)
+            raise
+        self.release(time.perf_counter() - started, rows, ok=True)
+
+    def release(self, latency, rows, ok):
+        with self.condition:
+            self.in_flight -= 1
+            per_row = latency / max(rows, 1)
+            if ok:
+                self.latencies.append(latency)
+                self.baseline = per_row if self.baseline is None else min(self.baseline * (1 + BASELINE_DRIFT), per_row)
+            if ok and per_row <= self.baseline * LATENCY_TOLERANCE:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+            else:
+                now = time.perf_counter()
+                # Writes already in flight when capacity ran out report it too; only the first one cuts the limit
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit * BACKOFF_FACTOR)
+                    self.last_decrease = now
+                    self.decreases += 1
+                    logger.info(f"Concurrency limit cut to {self.limit:.2f} after a chunk of {rows} rows "
+                                f"{'took' if ok else 'failed in'} {latency * 1000:.0f} ms.")
+            self.condition.notify_all()
+        # Per-chunk latencies go into the load's metrics record (loader_metrics); this line is for debugging only
+        logger.debug(f"Chunk of {rows} rows {'committed' if ok else 'failed'} in {latency * 1000:.0f} ms; "
+                     f"concurrency limit {self.limit:.2f}.")
+
+    def summary(self):
+        """Chunk latency percentiles and how the limit moved"""
+        with self.condition:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {'chunks': 0}
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            'chunks': len(latencies),
+            'latency_p50_ms': round(percentile(0.5), 1),
+            'latency_p95_ms': round(percentile(0.95), 1),
+            'latency_max_ms': round(latencies[-1] * 1000, 1),
+            'final_limit': round(self.limit, 2),
+            'peak_limit': round(self.peak_limit, 2),
+            'decreases': self.decreases
+        }
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import boto3
+from loader_batches import ChunkWriter, DataApiBatchWriter, INSERT_SQL, MAX_ATTEMPTS
+
+try:
+    import mysql.connector as mysql_connector
+except ImportError:
+    # The driver is not in the Lambda runtime; bundle mysql-connector-python with the function to use SQL_BACKEND=mysql
+    mysql_connector = None
+
+logger = logging.getLogger()
+
+# Credentials are fetched again after this long, so a rotated password is picked up without a cold start
+SECRET_TTL_SECONDS = 15 * 60
+# Connections idle longer than this are closed rather than reused: a frozen environment can sit far past
+# MySQL's wait_timeout, and a dead connection only shows up as an error on its next statement
+MAX_IDLE_SECONDS = 5 * 60
+POOL_SIZE = 16
+
+# MySQL errors worth another attempt on a fresh connection: deadlock, lock wait timeout, server gone or restarting
+MYSQL_RETRYABLE_ERRNOS = {1205, 1213, 2003, 2006, 2013, 2055}
+MYSQL_ACCESS_DENIED = 1045
+
+# Named Data API parameters (:name) in the SQL text; '::' casts and names inside words are left alone
+NAMED_PARAMETER = re.compile(r'(?<![:\w]):([A-Za-z_]\w*)')
+
+def positional_sql(sql, placeholder):
+    """Rewrite :name parameters to the driver's placeholder; return the SQL and the names in order"""
+    names = NAMED_PARAMETER.findall(sql)
+    return NAMED_PARAMETER.sub(placeholder, sql), names
+
+def parameter_values(parameters, names):
+    """Data API parameter list -> the plain values a DB-API driver binds, in the SQL's placeholder order"""
+    values = {}
+    for parameter in parameters:
+        value = parameter['value']
+        values[parameter['name']] = None if value.get('isNull') else next(iter(value.values()))
+    return tuple(values[name] for name in names)
+
+class SecretCache:
+    """Database credentials from Secrets Manager, kept for a TTL across warm invocations"""
+
+    def __init__(self, secrets_client, secret_arn, ttl_seconds=SECRET_TTL_SECONDS):
+        self.secrets_client = secrets_client
+        self.secret_arn = secret_arn
+        self.ttl_seconds = ttl_seconds
+        self.secret = None
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.secret is None or time.monotonic() - self.fetched_at > self.ttl_seconds:
+                response = self.secrets_client.get_secret_value(SecretId=self.secret_arn)
+                self.secret = json.loads(response['SecretString'])
+                self.fetched_at = time.monotonic()
+            return self.secret
+
+    def invalidate(self):
+        """Forget the cached secret, e.g. after the database refused it because it was rotated"""
+        with self.lock:
+            self.secret = None
+
+class PooledConnection:
+    """One open connection plus the cursors prepared on it, keyed by SQL text"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursors = {}
+        self.last_used = time.monotonic()
+
+    def cursor(self, sql, prepare):
+        # A cursor keeps its statement prepared on the server, so each SQL text is prepared once per connection
+        if sql not in self.cursors:
+            self.cursors[sql] = prepare(self.connection)
+        return self.cursors[sql]
+
+    def rollback(self):
+        # The connection may be what failed; the pool closes it afterwards either way
+        try:
+            self.connection.rollback()
+        except Exception as e:
+            logger.error(f"ERROR: could not roll back on a pooled connection: {e}")
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception as e:
+            logger.info(f"Closing a pooled connection failed: {e}")
+
+class ConnectionPool:
+    """Connections opened on demand, up to size at once, and kept for the next warm invocation"""
+
+    def __init__(self, connect, size=POOL_SIZE, max_idle_seconds=MAX_IDLE_SECONDS):
+        self.connect = connect
+        self.max_idle_seconds = max_idle_seconds
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    @contextmanager
+    def connection(self):
+        """Lend a connection to the caller; one that raised is closed instead of going back to the pool"""
+        with self.slots:
+            pooled = self.checkout()
+            try:
+                yield pooled
+            except Exception:
+                pooled.close()
+                raise
+            pooled.last_used = time.monotonic()
+            with self.lock:
+                self.idle.append(pooled)
+
+    def checkout(self):
+        with self.lock:
+            while self.idle:
+                # Most recently used first, so the ones left at the bottom age out instead of all staying warm
+                pooled = self.idle.pop()
+                if time.monotonic() - pooled.last_used <= self.max_idle_seconds:
+                    return pooled
+                pooled.close()
+            self.opened += 1
+        return PooledConnection(self.connect())
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for pooled in idle:
+            pooled.close()
+
+class PooledDbApiExecutor(ChunkWriter):
+    """Write chunks over pooled DB-API connections: one executemany of a prepared statement per chunk, committed
+    as one transaction. Same interface as DataApiBatchWriter: write(chunk, limiter), execute(sql, parameters)
+    and transaction(statements).
+
+    The pool opens connections, prepare makes a cursor that prepares its statement (on the server, for MySQL),
+    and transient tells which driver errors are worth another attempt on a fresh connection.
+    """
+
+    def __init__(self, pool, placeholder='%s', prepare=lambda connection: connection.cursor(),
+                 transient=lambda error: False, sql=INSERT_SQL, max_attempts=MAX_ATTEMPTS, before=(), after=(),
+                 inserted_by=None):
+        super().__init__(sql, max_attempts, before, after, inserted_by)
+        self.pool = pool
+        self.placeholder = placeholder
+        self.prepare = prepare
+        self.transient = transient
+        self.statements = {}
+
+    def retryable(self, error):
+        return self.transient(error)
+
+    def statement(self, sql):
+        if sql not in self.statements:
+            self.statements[sql] = positional_sql(sql, self.placeholder)
+        return self.statements[sql]
+
+    def write_once(self, chunk):
+        sql, names = self.statement(self.sql)
+        with self.pool.connection() as pooled:
+            try:
+                # Statements around the insert go through a plain cursor; only the insert itself is prepared
+                cursor = pooled.connection.cursor()
+                for statement in self.before:
+                    cursor.execute(statement)
+                insert = pooled.cursor(sql, self.prepare)
+                insert.executemany(sql, [parameter_values(p, names) for p in chunk])
+                counts = [insert.rowcount]
+                for statement in self.after:
+                    cursor.execute(statement)
+                    counts.append(cursor.rowcount)
+                pooled.connection.commit()
+            except Exception:
+                pooled.rollback()
+                raise
+        inserted = counts[0] if self.inserted_by is None else counts[self.inserted_by + 1]
+        # DB-API drivers report -1 when they cannot tell
+        return inserted if inserted >= 0 else None
+
+    def execute(self, sql, parameters):
+        """Run one statement in its own transaction and return the number of rows it affected"""
+        sql, names = self.statement(sql)
+        with self.pool.connection() as pooled:
+            cursor = pooled.cursor(sql, self.prepare)
+            try:
+                cursor.execute(sql, parameter_values(parameters, names))
+                pooled.connection.commit()
+            except Exception:
+                pooled.rollback()
+                raise
+            return cursor.rowcount
+
+    def transaction(self, statements):
+        """Run parameterless statements in order inside one transaction on one connection; return each
+        statement's affected row count. A plain cursor, since statements like LOAD DATA cannot be prepared"""
+        with self.pool.connection() as pooled:
+            cursor = pooled.connection.cursor()
+            try:
+                counts = []
+                for sql in statements:
+                    cursor.execute(sql)
+                    counts.append(cursor.rowcount)
+                pooled.connection.commit()
+            except Exception:
+                pooled.rollback()
+                raise
+            return counts
+
+def mysql_connect(secrets, host=None, database=None):
+    """Connection factory for the pool: credentials from the secret cache, fetched again once if refused"""
+
+    def connect():
+        for attempt in (1, 2):
+            secret = secrets.get()
+            try:
+                return mysql_connector.connect(
+                    host=host or secret['host'], port=int(secret.get('port', 3306)),
+                    user=secret['username'], password=secret['password'],
+                    database=database or secret.get('dbname'), autocommit=False
+                )
+            except mysql_connector.Error as e:
+                if e.errno != MYSQL_ACCESS_DENIED or attempt == 2:
+                    raise
+                # The password was rotated since it was cached
+                secrets.invalidate()
+
+    return connect
+
+def mysql_transient(error):
+    return isinstance(error, mysql_connector.Error) and error.errno in MYSQL_RETRYABLE_ERRNOS
+
+def mysql_executor(secrets, host=None, database=None, pool_size=POOL_SIZE, sql=INSERT_SQL, before=(), after=(),
+                   inserted_by=None):
+    """Pooled executor for Aurora MySQL through mysql-connector-python's server-side prepared cursors"""
+    if mysql_connector is None:
+        raise RuntimeError("SQL_BACKEND=mysql needs mysql-connector-python bundled with the function")
+    return PooledDbApiExecutor(
+        ConnectionPool(mysql_connect(secrets, host, database), pool_size),
+        placeholder='%s',
+        prepare=lambda connection: connection.cursor(prepared=True),
+        transient=mysql_transient,
+        sql=sql,
+        before=before,
+        after=after,
+        inserted_by=inserted_by
+    )
+
+def executor_from_env(rds_client, resource_arn, secret_arn, database, pool_size=POOL_SIZE, sql=INSERT_SQL,
+                      before=(), after=(), inserted_by=None):
+    """SQL_BACKEND picks the executor: 'data-api' (default) or 'mysql', a pooled direct connection.
+    DB_HOST overrides the secret's host, e.g. with an RDS Proxy endpoint."""
+    backend = os.environ.get('SQL_BACKEND', 'data-api')
+    if backend == 'data-api':
+        return DataApiBatchWriter(rds_client, resource_arn, secret_arn, database, sql=sql, before=before, after=after,
+                                  inserted_by=inserted_by)
+    if backend == 'mysql':
+        secrets = SecretCache(boto3.client('secretsmanager'), secret_arn)
+        return mysql_executor(secrets, os.environ.get('DB_HOST'), database, pool_size, sql, before, after, inserted_by)
+    raise ValueError(f"Unknown SQL_BACKEND '{backend}'; expected 'data-api' or 'mysql'")
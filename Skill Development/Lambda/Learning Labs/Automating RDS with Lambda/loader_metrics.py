@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+logger = logging.getLogger()
+
+NAMESPACE = 'BillingLoader'
+# Fraction of rows whose details are logged (unknown currency, single-row responses); 0 logs none
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_SAMPLE_RATE', '0'))
+# Upper bounds of the chunk latency histogram buckets, in milliseconds; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+def sampled():
+    """True for about DEBUG_SAMPLE_RATE of calls"""
+    return DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+
+def log_sampled(message):
+    if sampled():
+        logger.info(message)
+
+class LoadMetrics:
+    """Counters and chunk latencies for one file, written once at the end as a CloudWatch Embedded Metric Format
+    (EMF) record instead of a log line per row
+
+    Rows inserted and ignored are only known when the executor can count them (see ChunkWriter's inserted_by);
+    otherwise those two metrics are left out rather than reported as zero.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.inserted = 0
+        self.inserted_known = True
+        self.chunks = 0
+        self.failed_attempts = Counter()
+        self.unknown_currencies = Counter()
+        self.latencies = []
+
+    def chunk(self, rows, inserted, seconds):
+        """A committed chunk: its rows, how many were new (None if the backend cannot tell) and its DB latency"""
+        with self.lock:
+            self.rows += rows
+            self.chunks += 1
+            self.latencies.append(seconds * 1000)
+            if inserted is None:
+                self.inserted_known = False
+            else:
+                self.inserted += inserted
+
+    def failed_attempt(self, seconds, code):
+        with self.lock:
+            self.failed_attempts[code] += 1
+            self.latencies.append(seconds * 1000)
+
+    def unknown_currency(self, currency, record):
+        with self.lock:
+            self.unknown_currencies[currency] += 1
+        log_sampled(f"No rate found for currency: {currency} (row {record[0]}).")
+
+    def histogram(self):
+        counts = Counter(bisect_left(LATENCY_BUCKETS_MS, latency) for latency in self.latencies)
+        labels = [f'<={bound}ms' for bound in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}ms']
+        return {labels[index]: counts[index] for index in sorted(counts)}
+
+    def record(self, **properties):
+        """The EMF document: metrics under the function and mode dimensions, everything else as searchable fields"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = {
+                'RowsRead': (self.rows, 'Count'),
+                'UnknownCurrencyRows': (sum(self.unknown_currencies.values()), 'Count'),
+                'Chunks': (self.chunks, 'Count'),
+                'FailedChunkAttempts': (sum(self.failed_attempts.values()), 'Count'),
+                'LoadDuration': (round(time.perf_counter() - self.started, 3), 'Seconds'),
+            }
+            if self.inserted_known:
+                metrics['RowsInserted'] = (self.inserted, 'Count')
+                metrics['RowsIgnored'] = (self.rows - self.inserted, 'Count')
+            if latencies:
+                def percentile(p):
+                    return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+                metrics['ChunkLatencyP50'] = (percentile(0.5), 'Milliseconds')
+                metrics['ChunkLatencyP95'] = (percentile(0.95), 'Milliseconds')
+                metrics['ChunkLatencyMax'] = (round(latencies[-1], 1), 'Milliseconds')
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['FunctionName', 'Mode']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+                    }]
+                },
+                'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+                'Mode': self.mode,
+                **{name: value for name, (value, _) in metrics.items()},
+                'unknown_currencies': dict(self.unknown_currencies),
+                'failed_attempts': dict(self.failed_attempts),
+                'chunk_latency_histogram': self.histogram(),
+            }
+        document.update(properties)
+        return document
+
+    def emit(self, **properties):
+        # Lambda sends stdout lines to CloudWatch Logs as they are, and EMF needs the line to be the JSON alone,
+        # so this bypasses the logging formatter
+        print(json.dumps(self.record(**properties), default=str), flush=True)
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Chunks parsed ahead of the writers; with ~3 MB chunks, memory stays near (queue + writers) x 3 MB for any file size
+QUEUE_CHUNKS = 4
+WRITERS = 4
+
+# How often a blocked reader or an idle writer looks up to see whether the load has failed
+POLL_SECONDS = 0.5
+
+class LoadPipeline:
+    """Overlap download, parse and insert: the calling thread reads chunks off the S3 stream into a bounded queue
+    and writer threads insert them. A full queue blocks the reader, which stops pulling bytes from S3 until
+    the writers catch up.
+    """
+
+    def __init__(self, write, writers=WRITERS, queue_chunks=QUEUE_CHUNKS):
+        self.write = write
+        self.writers = writers
+        self.chunks = queue.Queue(maxsize=queue_chunks)
+        self.failed = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        self.started = None
+        self.stats = {'rows': 0, 'chunks': 0, 'first_commit_seconds': None, 'reader_wait_seconds': 0.0}
+
+    def run(self, chunks):
+        """Insert every chunk; return the load statistics, or raise the first writer error"""
+        self.started = time.perf_counter()
+        threads = [threading.Thread(target=self.write_loop) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for chunk in chunks:
+                if not self.put(chunk):
+                    break
+        finally:
+            # One sentinel per writer; writers stop early by themselves once the load has failed
+            for _ in threads:
+                self.put(None)
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+        self.stats['elapsed_seconds'] = time.perf_counter() - self.started
+        return self.stats
+
+    def put(self, chunk):
+        """Queue a chunk, waiting while the writers are behind; False once the load has failed"""
+        waited = time.perf_counter()
+        while not self.failed.is_set():
+            try:
+                self.chunks.put(chunk, timeout=POLL_SECONDS)
+            except queue.Full:
+                continue
+            self.stats['reader_wait_seconds'] += time.perf_counter() - waited
+            return True
+        return False
+
+    def write_loop(self):
+        while not self.failed.is_set():
+            try:
+                chunk = self.chunks.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                return
+            try:
+                rows = self.write(chunk)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                self.failed.set()
+                return
+            with self.lock:
+                self.stats['rows'] += rows
+                self.stats['chunks'] += 1
+                if self.stats['first_commit_seconds'] is None:
+                    self.stats['first_commit_seconds'] = time.perf_counter() - self.started
+                    logger.info(f"First chunk committed after {self.stats['first_commit_seconds']:.2f}s.")
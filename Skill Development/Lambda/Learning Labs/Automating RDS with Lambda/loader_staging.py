@@ -0,0 +1,135 @@
+import csv
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from loader_batches import error_code, record_parameters
+
+logger = logging.getLogger()
+
+# Column order of the staging files and of the staging table's LOAD / merge statements
+STAGING_COLUMNS = ('id', 'company_name', 'country', 'city', 'product_line', 'item', 'bill_date', 'currency',
+                   'bill_amount', 'bill_amount_usd')
+STAGING_PREFIX = 'staging/'
+# Rows per staging file. Each file is one LOAD DATA statement plus one merge, so no single statement has to take
+# the whole file inside the Data API's 45 second limit; /tmp only ever holds one file
+STAGING_PART_ROWS = 250_000
+
+# Aurora MySQL statements; the temporary table only lives for the load's transaction (one session)
+MYSQL_STATEMENTS = {
+    'create': "CREATE TEMPORARY TABLE IF NOT EXISTS billing_data_staging LIKE billing_data",
+    # IGNORE keeps the first row of an (id, bill_date) repeated inside the file, as INSERT IGNORE row by row does
+    'load': ("LOAD DATA FROM S3 '{url}' IGNORE INTO TABLE billing_data_staging CHARACTER SET utf8mb4 "
+             "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' "
+             "({columns})"),
+    'merge': "INSERT IGNORE INTO billing_data ({columns}) SELECT {columns} FROM billing_data_staging",
+    'clear': "DELETE FROM billing_data_staging",
+    'drop': "DROP TEMPORARY TABLE IF EXISTS billing_data_staging"
+}
+
+def staging_row(record, rates, metrics=None):
+    """One CSV row as a staging row: the same conversion as the row-by-row path, so the values are identical"""
+    values = [next(iter(parameter['value'].values())) for parameter in record_parameters(record, rates, metrics)]
+    # repr() is the shortest text that reads back as the same double, so MySQL rounds it into DECIMAL(14, 2)
+    # exactly as it does the doubleValue the row-by-row path sends
+    return values[:8] + [repr(values[8]), repr(values[9])]
+
+class BulkLoader:
+    """Load a whole file with the engine's bulk path: write USD-enriched staging files to S3, then in one
+    transaction LOAD DATA FROM S3 each into a temporary table and INSERT IGNORE it into billing_data.
+
+    The executor is any SQL backend from loader_executors; statements can be swapped for another dialect.
+    summaries are statements run on each loaded file just before its merge (see loader_summaries).
+    """
+
+    def __init__(self, executor, s3_client, bucket, prefix=STAGING_PREFIX, part_rows=STAGING_PART_ROWS,
+                 statements=MYSQL_STATEMENTS, summaries=()):
+        self.executor = executor
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_rows = part_rows
+        self.statements = statements
+        self.summaries = summaries
+
+    def staging_key(self, key, etag, part):
+        # Keyed by ETag too, so a newer version of the file never picks up an older one's staging files
+        digest = hashlib.sha256(f'{key}/{etag}'.encode()).hexdigest()[:16]
+        return f'{self.prefix}{digest}/part-{part:05d}.csv'
+
+    def stage(self, rows, rates, key, etag, metrics=None):
+        """Write (row, offset) pairs to staging files of part_rows rows each; return their keys and the row count"""
+        keys, count = [], 0
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'part.csv')
+            output, writer, in_part = None, None, 0
+            for record, _ in rows:
+                if output is None:
+                    output = open(path, 'w', newline='', encoding='utf-8')
+                    writer = csv.writer(output, lineterminator='\n')
+                writer.writerow(staging_row(record, rates, metrics))
+                count += 1
+                in_part += 1
+                if in_part == self.part_rows:
+                    output.close()
+                    keys.append(self.upload(path, key, etag, len(keys)))
+                    output, in_part = None, 0
+            if output is not None:
+                output.close()
+                keys.append(self.upload(path, key, etag, len(keys)))
+        return keys, count
+
+    def upload(self, path, key, etag, part):
+        staging_key = self.staging_key(key, etag, part)
+        self.s3_client.upload_file(path, self.bucket, staging_key)
+        return staging_key
+
+    def merge_statements(self, keys):
+        """The load's statements, and the positions of the merges among them"""
+        columns = ', '.join(STAGING_COLUMNS)
+        statements, merges = [self.statements['create']], []
+        for staging_key in keys:
+            statements.append(self.statements['load'].format(url=f's3://{self.bucket}/{staging_key}', columns=columns))
+            statements += self.summaries
+            merges.append(len(statements))
+            statements += [self.statements['merge'].format(columns=columns), self.statements['clear']]
+        return statements + [self.statements['drop']], merges
+
+    def load(self, rows, rates, key, etag, metrics=None):
+        """Stage, load and merge; return the staged row count and how many of those rows were new.
+        With metrics (loader_metrics.LoadMetrics), the whole transaction is recorded as one chunk"""
+        started = time.perf_counter()
+        keys, staged = self.stage(rows, rates, key, etag, metrics)
+        staged_seconds = time.perf_counter() - started
+        statements, merges = self.merge_statements(keys)
+        try:
+            counts = self.executor.transaction(statements) if keys else []
+        except Exception as e:
+            if metrics is not None:
+                metrics.failed_attempt(time.perf_counter() - started - staged_seconds, error_code(e))
+            raise
+        finally:
+            self.delete(keys)
+        # The merges' row counts are what was new to billing_data
+        inserted = sum(counts[index] for index in merges) if counts else 0
+        if metrics is not None:
+            metrics.chunk(staged, inserted, time.perf_counter() - started - staged_seconds)
+        logger.info(f"Staged {staged} rows in {len(keys)} files in {staged_seconds:.2f}s; loaded and merged in "
+                    f"{time.perf_counter() - started - staged_seconds:.2f}s, {inserted} of them new.")
+        return {'rows': staged, 'inserted': inserted, 'files': len(keys)}
+
+    def delete(self, keys):
+        # DeleteObjects takes at most 1,000 keys per call
+        for start in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': staging_key} for staging_key in keys[start:start + 1000]], 'Quiet': True
+            })
+
+def bulk_loader_from_env(executor, s3_client, summaries=()):
+    """BulkLoader writing to STAGING_BUCKET, or None when no staging bucket is configured"""
+    bucket = os.environ.get('STAGING_BUCKET')
+    if not bucket:
+        return None
+    return BulkLoader(executor, s3_client, bucket, os.environ.get('STAGING_PREFIX', STAGING_PREFIX),
+                      int(os.environ.get('STAGING_PART_ROWS', STAGING_PART_ROWS)), summaries=summaries)
@@ -0,0 +1,69 @@
+import os
+from loader_batches import INSERT_SQL
+
+# Rows of one chunk land here first, in the chunk's transaction, so the summaries can be built from exactly
+# the rows that are new to billing_data before they are merged into it
+CHUNK_TABLE = 'billing_data_chunk'
+
+# Upserts of the rows in {source} that billing_data does not hold yet, grouped by company, country and month
+# (and currency). Run before the merge into billing_data, inside the same transaction. At REPEATABLE READ the
+# NOT EXISTS read of INSERT ... SELECT locks the keys it checks, so two writers carrying the same new row
+# cannot both count it: one waits for, or deadlocks with, the other and is retried after it commits.
+# ORDER BY takes the summary row locks in the same order in every transaction, which keeps deadlocks rare. It is
+# on the outer SELECT that feeds the INSERT: MySQL may drop an ORDER BY inside a derived table.
+MYSQL_SUMMARY_UPSERTS = (
+    "INSERT INTO billing_monthly_summary (company_name, country, bill_month, row_count, total_usd) "
+    "SELECT * FROM ("
+    "SELECT s.company_name, s.country, DATE_FORMAT(s.bill_date, '%Y-%m') AS bill_month, "
+    "COUNT(*) AS row_count, SUM(s.bill_amount_usd) AS total_usd FROM {source} s "
+    "WHERE NOT EXISTS (SELECT 1 FROM billing_data b WHERE b.id = s.id AND b.bill_date = s.bill_date) "
+    "GROUP BY s.company_name, s.country, bill_month"
+    ") AS delta "
+    "ORDER BY delta.company_name, delta.country, delta.bill_month "
+    "ON DUPLICATE KEY UPDATE row_count = billing_monthly_summary.row_count + delta.row_count, "
+    "total_usd = billing_monthly_summary.total_usd + delta.total_usd",
+
+    "INSERT INTO billing_currency_summary "
+    "(company_name, country, bill_month, currency, row_count, total_amount, total_usd) "
+    "SELECT * FROM ("
+    "SELECT s.company_name, s.country, DATE_FORMAT(s.bill_date, '%Y-%m') AS bill_month, s.currency, "
+    "COUNT(*) AS row_count, SUM(s.bill_amount) AS total_amount, SUM(s.bill_amount_usd) AS total_usd "
+    "FROM {source} s "
+    "WHERE NOT EXISTS (SELECT 1 FROM billing_data b WHERE b.id = s.id AND b.bill_date = s.bill_date) "
+    "GROUP BY s.company_name, s.country, bill_month, s.currency"
+    ") AS delta "
+    "ORDER BY delta.company_name, delta.country, delta.bill_month, delta.currency "
+    "ON DUPLICATE KEY UPDATE row_count = billing_currency_summary.row_count + delta.row_count, "
+    "total_amount = billing_currency_summary.total_amount + delta.total_amount, "
+    "total_usd = billing_currency_summary.total_usd + delta.total_usd",
+)
+
+# The chunk table's lifecycle around the batch insert. A rolled-back transaction leaves a temporary table behind
+# on the session (DDL on it is not transactional), so it is emptied before use as well as dropped after
+MYSQL_CHUNK_STATEMENTS = {
+    'create': f"CREATE TEMPORARY TABLE IF NOT EXISTS {CHUNK_TABLE} LIKE billing_data",
+    'clear': f"DELETE FROM {CHUNK_TABLE}",
+    'insert': INSERT_SQL.replace('INTO billing_data', f'INTO {CHUNK_TABLE}'),
+    'merge': f"INSERT IGNORE INTO billing_data SELECT * FROM {CHUNK_TABLE}",
+    'drop': f"DROP TEMPORARY TABLE IF EXISTS {CHUNK_TABLE}"
+}
+
+def summary_statements(source, upserts=MYSQL_SUMMARY_UPSERTS):
+    """The summary upserts for the new rows in a staging or chunk table"""
+    return [upsert.format(source=source) for upsert in upserts]
+
+def summarized_writes(upserts=MYSQL_SUMMARY_UPSERTS, statements=MYSQL_CHUNK_STATEMENTS):
+    """Executor arguments (sql, before, after) that write each chunk through the chunk table, upserting the
+    summaries from its new rows and merging it into billing_data in the chunk's transaction"""
+    return {
+        'sql': statements['insert'],
+        'before': (statements['create'], statements['clear']),
+        'after': tuple(summary_statements(CHUNK_TABLE, upserts)) + (statements['merge'], statements['drop']),
+        # The merge's row count is how many of the chunk's rows were new to billing_data
+        'inserted_by': len(upserts)
+    }
+
+def summaries_enabled():
+    """Summaries are opt-in: MAINTAIN_SUMMARIES=true once SQL/create_billing_summary_tables.sql has run.
+    Otherwise chunks are written straight into billing_data"""
+    return os.environ.get('MAINTAIN_SUMMARIES', 'false').lower() == 'true'
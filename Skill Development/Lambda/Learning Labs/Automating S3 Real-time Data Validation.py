@@ -1,77 +1,94 @@
-import csv
 import boto3
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from billing_events import s3_objects
+from billing_moves import MoveEngine
+from billing_rules import compile_plan
+from billing_streams import open_csv_rows
+
+# Compile the validation rules once per cold start. billing_rules comes from the Billing Shared Layer
+# (Advanced/SNS and SQS/Billing Shared Layer), which must be attached to this function
+VALIDATION_PLAN = compile_plan(
+    currencies=['USD', 'CAD', 'MXN'],
+    messages={
+        'product_line': "Error in record {record}: invalid product line: {value}.",
+        'currency': "Error in record {record}: invalid currency: {value}.",
+    },
+)
+
+# Maximum number of CSV files validated at the same time when one event carries several objects
+MAX_WORKERS = 8
+
+# Initialize one S3 client using boto3. Clients (unlike resources) are thread-safe, so the workers can share it
+s3_client = boto3.client('s3')
 
 def lambda_handler(event, context):
-    # Initialize the S3 resource using boto3
-    s3 = boto3.resource('s3')
+    # Extract every (bucket, CSV file) pair from the 'event' input. S3 events routed through SQS, SNS or
+    # EventBridge can carry many objects, so we no longer look only at event['Records'][0]
+    objects = s3_objects(event)
+    
+    # The move engine copies small files with one CopyObject and large ones (even above 5 GB) with parallel
+    # multipart copies. It remembers the originals so they can be deleted together at the end
+    mover = MoveEngine(s3_client)
     
-    # Extract the bucket name and the CSV file name from the 'event' input
-    billing_bucket = event['Records'][0]['s3']['bucket']['name']
-    csv_file = event['Records'][0]['s3']['object']['key']
+    # Validate the files concurrently with a bounded pool of worker threads, one file per worker at a time
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(objects)))) as executor:
+        results = list(executor.map(lambda obj: validate_file(*obj, mover), objects))
     
+    # Delete all moved originals with batched DeleteObjects calls, and flag any file that could not be deleted
+    failed_deletes = set(mover.flush_deletes())
+    for result in results:
+        if (result['bucket'], result['key']) in failed_deletes:
+            result.update(status='failed', error='Copied but could not delete the original file.')
+    
+    # Count how many files were clean, moved to the error bucket, or failed to process
+    invalid_files = sum(1 for result in results if result['status'] == 'error')
+    failed_files = sum(1 for result in results if result['status'] == 'failed')
+    
+    # Return status code 200 with a summary body and the status of every object
+    return {
+        'statusCode': 200,
+        'body': f'CSV validation complete for {len(results)} files: {invalid_files} had errors and were moved to error bucket, {failed_files} failed.',
+        'results': results
+    }
+
+def validate_file(billing_bucket, csv_file, mover):
     # Define the name of the error bucket where you want to copy the erroneous CSV files
     error_bucket = 'winter-errors'
     
-    # Download the CSV file from S3, read the content, decode from bytes to string, and split the content by lines
-    obj = s3.Object(billing_bucket, csv_file)
-    data = obj.get()['Body'].read().decode('utf-8').splitlines()
+    try:
+        # Open the CSV file from S3 as a stream of rows. The header line is skipped, and gzip or zstd files
+        # (by extension or Content-Encoding) are decompressed on the fly, so memory stays flat for big files
+        rows, body = open_csv_rows(s3_client, billing_bucket, csv_file)
+    except Exception as e:
+        # If the file cannot be read, report it as failed and let the other files carry on
+        print(f"Error reading {csv_file}: {str(e)}")
+        return {'bucket': billing_bucket, 'key': csv_file, 'status': 'failed', 'error': str(e)}
     
-    # Initialize a flag (error_found) to False. We'll set this flag to True when we find an error
-    error_found = False
+    # The compiled plan checks product line, currency, bill amount and date, and stops at the first bad record
+    try:
+        _, error_message = VALIDATION_PLAN.first_error(rows)
+    except Exception as e:
+        # A truncated or corrupt compressed file fails while it is being read
+        print(f"Error reading {csv_file}: {str(e)}")
+        return {'bucket': billing_bucket, 'key': csv_file, 'status': 'failed', 'error': str(e)}
+    finally:
+        body.close()
     
-    # Define valid product lines and valid currencies
-    valid_product_lines = ['Bakery', 'Meat', 'Dairy']
-    valid_currencies = ['USD', 'CAD', 'MXN']
-    
-    # Read the CSV content line by line using Python's csv reader. Ignore the header line (data[1:])
-    for row in csv.reader(data[1:], delimiter=','):
-        # For each row, extract the product line, currency, bill amount, and date from the specific columns
-        date = row[6]
-        product_line = row[4]
-        currency = row[7]
-        bill_amount = float(row[8])
-        
-        # Check if the product line is valid. If not, set error flag to True and print an error message
-        if product_line not in valid_product_lines:
-            error_found = True
-            print(f"Error in record {row[0]}: invalid product line: {product_line}.")
-            break
-        
-        # Check if the currency is valid. If not, set error flag to True and print an error message
-        if currency not in valid_currencies:
-            error_found = True
-            print(f"Error in record {row[0]}: invalid currency: {currency}.")
-            break
-        
-        # Check if the bill amount is negative. If so, set error flag to True and print an error message
-        if bill_amount < 0:
-            error_found = True
-            print(f"Error in record {row[0]}: negative bill amount: {bill_amount}.")
-            break
-        
-        # Check if the date is in the correct format ('%Y-%m-%d'). If not, set error flag to True and print an error message
-        try:
-            datetime.strptime(date, '%Y-%m-%d')
-        except ValueError:
-            error_found = True
-            print(f"Error in record {row[0]}: incorrect date format: {date}.")
-            break
+    # If a record failed validation, set error flag to True and print the error message
+    error_found = error_message is not None
+    if error_found:
+        print(error_message)
     
-    # After checking all rows, if an error is found, copy the CSV file to the error bucket and delete it from the original bucket
+    # After checking all rows, if an error is found, move the CSV file to the error bucket
     if error_found:
         try:
-            # Copy to error bucket
-            s3.Object(error_bucket, csv_file).copy_from(CopySource={'Bucket': billing_bucket, 'Key': csv_file})
-            # Delete from original bucket
-            s3.Object(billing_bucket, csv_file).delete()
+            # Copy to error bucket; the original is deleted from the source bucket once every file is handled
+            mover.move(billing_bucket, csv_file, error_bucket)
             print(f"Moved {csv_file} to error bucket.")
         except Exception as e:
             # Handle any exception that may occur while moving the file, and print the error message
             print(f"Error moving file: {str(e)}")
+            return {'bucket': billing_bucket, 'key': csv_file, 'status': 'failed', 'error': str(e)}
     
-    # If no errors were found, return a success message with status code 200 and a body message indicating that no errors were found
-    return {
-        'statusCode': 200,
-        'body': 'CSV validation complete. No errors found.' if not error_found else 'CSV had errors and was moved to error bucket.'
-    }
\ No newline at end of file
+    # Report whether the file was clean or moved to the error bucket
+    return {'bucket': billing_bucket, 'key': csv_file, 'status': 'error' if error_found else 'valid'}